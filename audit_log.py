@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Audit Log
+Фоновая пакетная запись login_attempts
+"""
+
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+INSERT_SQL = """
+    INSERT INTO login_attempts (username, success, hwid, ip_address, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def utc_timestamp():
+    """Время в формате SQLite CURRENT_TIMESTAMP"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class AuditWriter:
+    """Очередь записей аудита + фоновый поток, который пишет их пачками
+
+    Запись сбрасывается в БД когда набралось batch_size строк или самой
+    старой строке больше flush_interval секунд. Если очередь полна:
+    block=True - ждем до put_timeout секунд, потом строка отбрасывается;
+    block=False - строка отбрасывается сразу. Отброшенные строки считаются.
+
+    sink(batch) вместо записи в свою БД - реплика отправляет пачки на primary.
+    """
+
+    def __init__(self, pool, max_queue=10000, batch_size=500,
+                 flush_interval=0.5, block=False, put_timeout=0.05, sink=None):
+        self.pool = pool
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block = block
+        self.put_timeout = put_timeout
+        self.max_queue = max_queue
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._stats = {"enqueued": 0, "written": 0, "dropped": 0,
+                       "batches": 0, "errors": 0}
+
+    # ───────────────────────────────────────────────────────────
+    # Запуск (лениво, в каждом процессе отдельно)
+    # ───────────────────────────────────────────────────────────
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # После fork поток родителя не существует - начинаем заново
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="audit-writer", daemon=True
+            )
+            self._pid = os.getpid()
+            self._thread.start()
+
+    # ───────────────────────────────────────────────────────────
+    # API для запросов
+    # ───────────────────────────────────────────────────────────
+
+    def submit(self, username, success, hwid, ip_address):
+        """Поставить строку в очередь. Возвращает False если она отброшена"""
+        self._ensure_started()
+        row = (username, 1 if success else 0, hwid, ip_address, utc_timestamp())
+        try:
+            if self.block:
+                self._queue.put(row, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+            return False
+        with self._lock:
+            self._stats["enqueued"] += 1
+        return True
+
+    def submit_many(self, entries):
+        """[(username, success, hwid, ip_address), ...] -> сколько поставлено.
+        Строки встают подряд и обычно попадают в одну пачку записи"""
+        self._ensure_started()
+        timestamp = utc_timestamp()
+        enqueued = 0
+        for username, success, hwid, ip_address in entries:
+            row = (username, 1 if success else 0, hwid, ip_address, timestamp)
+            try:
+                if self.block:
+                    self._queue.put(row, timeout=self.put_timeout)
+                else:
+                    self._queue.put_nowait(row)
+            except queue.Full:
+                break
+            enqueued += 1
+        with self._lock:
+            self._stats["enqueued"] += enqueued
+            self._stats["dropped"] += len(entries) - enqueued
+        return enqueued
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+        result["queued"] = self._queue.qsize() if self._queue else 0
+        return result
+
+    # ───────────────────────────────────────────────────────────
+    # Фоновый поток
+    # ───────────────────────────────────────────────────────────
+
+    def _run(self):
+        batch = []
+        first_at = None
+
+        while True:
+            if batch:
+                wait = max(0.0, self.flush_interval - (time.monotonic() - first_at))
+            else:
+                wait = self.flush_interval
+
+            try:
+                row = self._queue.get(timeout=wait)
+                if not batch:
+                    first_at = time.monotonic()
+                batch.append(row)
+                # Забираем все что уже лежит в очереди, не засыпая
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            expired = batch and time.monotonic() - first_at >= self.flush_interval
+            if len(batch) >= self.batch_size or expired or (batch and self._stopping.is_set()):
+                self._write(batch)
+                batch = []
+
+            if self._stopping.is_set() and self._queue.empty() and not batch:
+                return
+
+    def _write(self, batch):
+        try:
+            if self.sink is not None:
+                self.sink(batch)
+            else:
+                with self.pool.connection() as conn:
+                    conn.executemany(INSERT_SQL, batch)
+                    conn.commit()
+        except Exception as e:
+            with self._lock:
+                self._stats["errors"] += 1
+                self._stats["dropped"] += len(batch)
+            print(f"[AUDIT] Failed to write {len(batch)} rows: {e}")
+            return
+
+        with self._lock:
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+
+    # ───────────────────────────────────────────────────────────
+    # Остановка
+    # ───────────────────────────────────────────────────────────
+
+    def close(self, timeout=5.0):
+        """Дописать все что в очереди и остановить поток"""
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f"[AUDIT] Writer did not stop in {timeout}s, "
+                  f"{self._queue.qsize()} rows lost")
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Auth API Server - async (ASGI) режим
+Те же маршруты и JSON что и auth_server.py
+
+Соединения держит event loop, поэтому тысячи клиентов в очереди на вход
+не занимают по потоку. Блокирующая работа идет в ограниченные пулы:
+    SQLite / rate limit   -> ASGI_DB_WORKERS потоков
+    scrypt                -> пул PasswordHasher (ждем его future без потока)
+    остальные маршруты    -> Flask приложение в ASGI_WSGI_WORKERS потоках
+
+Запуск:
+    python auth_asgi.py
+    python -c "import auth_server; auth_server.init_database()"   # один раз, до воркеров
+    uvicorn auth_asgi:app --host 0.0.0.0 --port 5000 --workers 4
+
+Подбор числа воркеров и потоков - см. README.md
+"""
+
+import asyncio
+import contextvars
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import auth_server as server
+
+# ═══════════════════════════════════════════════════════════════
+# КОНФИГУРАЦИЯ
+# ═══════════════════════════════════════════════════════════════
+ASGI_DB_WORKERS = server.DB_POOL_SIZE   # потоков под SQLite: по соединению на поток
+ASGI_WSGI_WORKERS = 8                   # потоков под админские маршруты через Flask
+# Сколько запросов одновременно отдаем в пулы, остальные ждут в loop.
+# Для входа - столько, сколько примет PasswordHasher (остальное - под хеши
+# create_user из потоков Flask), чтобы в пик клиенты стояли в очереди,
+# а не получали 503 от HasherBusy
+ASGI_LOGIN_SLOTS = server.PASSWORD_MAX_PENDING - ASGI_WSGI_WORKERS
+ASGI_ADMIN_SLOTS = ASGI_WSGI_WORKERS * 2
+ASGI_CHECK_SLOTS = ASGI_DB_WORKERS * 2     # check_batch в пуле БД
+ASGI_QUEUE_TIMEOUT = 20.0               # дольше ждать слот - 503, сек
+ASGI_MAX_BODY = 1024 * 1024
+
+db_executor = ThreadPoolExecutor(ASGI_DB_WORKERS, thread_name_prefix="asgi-db")
+wsgi_executor = ThreadPoolExecutor(ASGI_WSGI_WORKERS, thread_name_prefix="asgi-wsgi")
+
+
+class QueueTimeout(Exception):
+    """Слот не освободился за ASGI_QUEUE_TIMEOUT"""
+
+
+class Lane:
+    """Ограничение одновременной блокирующей работы (asyncio.Semaphore)
+
+    Ожидающий запрос - это только корутина и открытый сокет, поэтому
+    очередь перед пулами может быть длинной.
+    """
+
+    def __init__(self, name, slots, timeout):
+        self.name = name
+        self.slots = slots
+        self.timeout = timeout
+        self.waiting = 0
+        self._semaphore = None
+
+    async def acquire(self):
+        # Семафор создаем уже внутри работающего loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.slots)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise QueueTimeout(f"No {self.name} slot in {self.timeout}s") from None
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+login_lane = Lane("login", ASGI_LOGIN_SLOTS, ASGI_QUEUE_TIMEOUT)
+admin_lane = Lane("admin", ASGI_ADMIN_SLOTS, ASGI_QUEUE_TIMEOUT)
+check_lane = Lane("check", ASGI_CHECK_SLOTS, ASGI_QUEUE_TIMEOUT)
+
+server.metrics.gauge('rulix_asgi_waiting', 'Requests waiting for a free ASGI slot',
+                     lambda: {(("lane", lane.name),): lane.waiting for lane in (login_lane, admin_lane, check_lane)})
+
+
+# ═══════════════════════════════════════════════════════════════
+# HTTP УТИЛИТЫ
+# ═══════════════════════════════════════════════════════════════
+
+async def read_body(receive):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > ASGI_MAX_BODY:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def send_json(send, status, body):
+    payload = json.dumps(body).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+            (b"access-control-allow-origin", b"*"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+def header(scope, name):
+    """Значение заголовка (name - строчными байтами) или None"""
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def client_ip(scope):
+    """Адрес клиента по тем же правилам, что во Flask: запрос, пересланный
+    репликой, - по адресу из ее заголовка"""
+    client = scope.get("client")
+    return server.resolve_client_ip(client[0] if client else None,
+                                    header(scope, b"authorization"),
+                                    header(scope, server.FORWARDED_IP_HEADER.lower().encode()))
+
+
+# ═══════════════════════════════════════════════════════════════
+# НАТИВНЫЕ ASYNC МАРШРУТЫ (горячий путь)
+# ═══════════════════════════════════════════════════════════════
+
+def run_in_db(loop, fn, *args):
+    """fn в пуле БД с contextvars запроса: трейс SQL попадет в журнал медленных"""
+    return loop.run_in_executor(db_executor, contextvars.copy_context().run, fn, *args)
+
+
+async def login(scope, body):
+    clock = server.metrics.stage_clock('rulix_login_stage_seconds')
+    server.slow_log.attach_stages(clock.laps)
+    loop = asyncio.get_running_loop()
+    try:
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = None
+
+        async with login_lane:
+            attempt = await run_in_db(loop, server.login_lookup, data, client_ip(scope), clock)
+
+            valid, needs_rehash = await asyncio.wrap_future(server.login_verify(attempt))
+            clock.lap('password_hash')
+
+            result = await run_in_db(loop, server.login_complete, attempt, valid, needs_rehash)
+
+        server.metrics.inc('rulix_login_total', outcome='success')
+        return 200, result
+
+    except server.LoginFailed as e:
+        server.metrics.inc('rulix_login_total', outcome=e.outcome)
+        return e.status, {'success': False, 'error': e.error}
+    except (server.PoolTimeout, server.HasherBusy, server.PrimaryUnavailable, QueueTimeout) as e:
+        print(f"[BUSY] {e}")
+        server.metrics.inc('rulix_login_total', outcome='busy')
+        return 503, {'success': False, 'error': 'Server busy, try again'}
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        import traceback
+        traceback.print_exc()
+        server.metrics.inc('rulix_login_total', outcome='error')
+        return 500, {'success': False, 'error': 'Internal server error'}
+
+
+async def validate(scope, body):
+    # Проверка токена только по памяти - прямо в loop
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        data = {}
+
+    token = data.get('session_token') if isinstance(data, dict) else None
+    if not isinstance(token, str):
+        return 400, {'success': False, 'error': 'Missing session_token'}
+
+    result = server.validate_session(token, data.get('hwid'))
+    return (200 if result['valid'] else 401), {'success': result['valid'], **result}
+
+
+async def validate_batch(scope, body):
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        data = {}
+
+    tokens = data.get('tokens') if isinstance(data, dict) else None
+    if not isinstance(tokens, list) or len(tokens) > server.VALIDATE_BATCH_MAX:
+        return 400, {'success': False,
+                     'error': f'tokens must be a list of at most {server.VALIDATE_BATCH_MAX}'}
+
+    results = []
+    for item in tokens:
+        if not isinstance(item, dict) or not isinstance(item.get('session_token'), str):
+            results.append({'valid': False, 'error': 'malformed'})
+            continue
+        results.append(server.validate_session(item['session_token'], item.get('hwid')))
+
+    return 200, {'success': True, 'results': results}
+
+
+async def check_batch(scope, body):
+    loop = asyncio.get_running_loop()
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+
+    try:
+        async with check_lane:
+            return await run_in_db(loop, server.check_seats, data, client_ip(scope))
+    except (server.PoolTimeout, QueueTimeout) as e:
+        print(f"[BUSY] {e}")
+        return 503, {'success': False, 'error': 'Server busy, try again'}
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        return 500, {'success': False, 'error': 'Internal server error'}
+
+
+NATIVE_ROUTES = {
+    ('POST', '/api/auth/login'): ('login', login),
+    ('POST', '/api/auth/validate'): ('validate', validate),
+    ('POST', '/api/auth/validate_batch'): ('validate_batch', validate_batch),
+    ('POST', '/api/auth/check_batch'): ('check_batch', check_batch),
+}
+
+
+# ═══════════════════════════════════════════════════════════════
+# ОСТАЛЬНЫЕ МАРШРУТЫ ЧЕРЕЗ FLASK (WSGI)
+# ═══════════════════════════════════════════════════════════════
+
+def build_environ(scope, body):
+    server_addr = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server_addr[0]),
+        "SERVER_PORT": str(server_addr[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client_ip(scope) or "",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def run_wsgi(environ):
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+    iterable = server.app(environ, start_response)
+    return response, iter(iterable), iterable
+
+
+async def call_wsgi(scope, body, send):
+    loop = asyncio.get_running_loop()
+    # Flask держит запрос в contextvars: все шаги одного ответа выполняем
+    # в одном контексте, хотя потоки пула между шагами разные
+    ctx = contextvars.copy_context()
+
+    def step(fn, *args):
+        return loop.run_in_executor(wsgi_executor, ctx.run, fn, *args)
+
+    try:
+        await admin_lane.acquire()
+    except QueueTimeout as e:
+        print(f"[BUSY] {e}")
+        await send_json(send, 503, {'success': False, 'error': 'Server busy, try again'})
+        return
+
+    try:
+        response, chunks, iterable = await step(run_wsgi, build_environ(scope, body))
+        try:
+            # Тело читаем по кускам: NDJSON выгрузка не собирается в памяти
+            chunk = await step(next, chunks, None)
+            await send({"type": "http.response.start", "status": response["status"],
+                        "headers": response["headers"]})
+            while chunk is not None:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await step(next, chunks, None)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(iterable, "close"):
+                await step(iterable.close)
+    finally:
+        admin_lane.release()
+
+
+# ═══════════════════════════════════════════════════════════════
+# ASGI ПРИЛОЖЕНИЕ
+# ═══════════════════════════════════════════════════════════════
+
+async def lifespan(receive, send):
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Схему создает init_database до запуска воркеров: N воркеров на
+            # новой БД гонялись бы за DDL и созданием админа
+            if not await loop.run_in_executor(db_executor, server.database_initialized):
+                await send({"type": "lifespan.startup.failed",
+                            "message": f"{server.DB_PATH} is not initialized, run "
+                                       "python -c \"import auth_server; auth_server.init_database()\""})
+                return
+            # Фоновые заполнения, если init_database их не закончил
+            server.users_migration.ensure_started()
+            server.user_search.ensure_started()
+            if server.MAINTENANCE_ENABLED:
+                server.maintenance_job.ensure_started()
+            if server.USERNAME_FILTER_ENABLED:
+                # Снимок (или проход по users) грузится в фоне, до готовности - обычный путь
+                server.username_filter.ensure_started()
+            if server.BACKUP_ENABLED and server.NODE_ROLE != 'replica':
+                server.backup_job.ensure_started()
+            if server.replica is not None:
+                server.replica.ensure_started()
+            server.profiler.ensure_started()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await loop.run_in_executor(None, server.audit_writer.close)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    body = await read_body(receive)
+    if body is None:
+        await send_json(send, 413, {'success': False, 'error': 'Request too large'})
+        return
+
+    route = NATIVE_ROUTES.get((scope["method"], scope["path"]))
+    if route is None or not server.serve_locally(scope["path"]):
+        # Реплика с устаревшими данными отдает запрос primary через Flask
+        await call_wsgi(scope, body, send)
+        return
+
+    endpoint, handler = route
+    started = time.perf_counter()
+    trace = server.slow_log.begin(endpoint)
+    status, result = await handler(scope, body)
+    await send_json(send, status, result)
+    server.slow_log.finish(trace, status)
+    server.metrics.observe('rulix_http_request_seconds', time.perf_counter() - started, endpoint=endpoint)
+    server.metrics.inc('rulix_http_requests_total', endpoint=endpoint, status=status)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("[ERROR] ASGI mode needs uvicorn: pip install uvicorn")
+
+    print("""
+╔════════════════════════════════════════════════════════════╗
+║              RULIX AUTH API SERVER v2.1 (ASGI)             ║
+╚════════════════════════════════════════════════════════════╝
+    """)
+    print(f"[INFO] Database: {server.DB_PATH}")
+    print(f"[INFO] DB threads: {ASGI_DB_WORKERS}, admin threads: {ASGI_WSGI_WORKERS}")
+    print(f"[INFO] Slots: login {ASGI_LOGIN_SLOTS}, admin {ASGI_ADMIN_SLOTS}, check {ASGI_CHECK_SLOTS}, "
+          f"queue timeout {ASGI_QUEUE_TIMEOUT}s")
+    print()
+
+    # Один процесс - схему можно создать прямо здесь
+    server.init_database()
+    uvicorn.run(app, host='0.0.0.0', port=5000, log_level='warning')
@@ -6,16 +6,36 @@ Rulix Auth API Server
 With auto database initialization
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import sqlite3
 import hashlib
 import hmac
 import secrets
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 import json
 import time
+import atexit
+import threading
+import base64
+import os
+
+from db_pool import ConnectionPool, PoolTimeout
+from audit_log import AuditWriter, INSERT_SQL as AUDIT_INSERT_SQL
+from passwords import PasswordHasher, HasherBusy, PARAM_SETS
+from session_tokens import TokenSigner, RevocationList
+from rate_limit import RateLimiter, MemoryBackend, SQLiteBackend
+from metrics import Metrics
+from profiler import SlowRequestLog, SamplingProfiler
+from user_cache import UserCache, CHANGES_TABLE_SQL
+from maintenance import MaintenanceJob, ensure_schema as ensure_maintenance_schema
+from schema_migrations import UsersEpochMigration
+from username_filter import UsernameFilter
+from user_search import UserSearch, FIELDS as SEARCH_FIELDS
+from backup import BackupJob
+from replication import (ReplicationSource, ReplicaApplier, ResyncRequired, PrimaryUnavailable,
+                         FORWARDED_IP_HEADER, prepare as prepare_replication)
 
 app = Flask(__name__)
 CORS(app)
@@ -26,6 +46,109 @@ CORS(app)
 API_SECRET = "G_SECRET_KEY_CHANGE_ME_123456789"  # ← МЕНЯЙ ЭТО!
 DB_PATH = Path("server_data/rulix_auth.db")
 
+# Пул соединений (на каждый gunicorn воркер)
+DB_POOL_SIZE = 8
+DB_POOL_TIMEOUT = 2.0  # сколько ждать свободное соединение, сек
+
+# Аудит входов пишется пачками в фоне
+AUDIT_QUEUE_SIZE = 10000
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_INTERVAL = 0.5  # сек
+AUDIT_BLOCK_WHEN_FULL = False  # False - отбрасывать и считать, True - ждать
+
+# Хеширование паролей (scrypt), см. python passwords.py для замеров
+PASSWORD_PARAMS = PARAM_SETS["interactive"]
+PASSWORD_WORKERS = 4          # потоков KDF на воркер
+PASSWORD_MAX_PENDING = 64     # больше - отвечаем 503
+PASSWORD_CACHE_SIZE = 10000   # кеш успешных проверок (0 - выключен)
+PASSWORD_CACHE_TTL = 300      # сек
+
+# Токены сессии (проверяются через /api/auth/validate без БД)
+SESSION_TOKEN_TTL = 3600          # сек, но не дольше лицензии
+REVOCATION_REFRESH_INTERVAL = 2.0  # как быстро отзыв доходит до всех воркеров
+VALIDATE_BATCH_MAX = 500
+
+# Пакетная проверка мест лаунчерами (/api/auth/check_batch)
+CHECK_BATCH_MAX = 500
+CHECK_BATCH_MAX_SKEW = 300        # сек, насколько timestamp запроса может отличаться от часов сервера
+
+# Кеш строк users для входа (0 - выключен). Изменения доходят до других
+# воркеров через user_cache_changes не позже USER_CACHE_REFRESH_INTERVAL
+USER_CACHE_SIZE = 50000
+USER_CACHE_TTL = 300               # сек
+USER_CACHE_REFRESH_INTERVAL = 1.0  # сек
+
+# Bloom фильтр логинов: вход с несуществующим логином отклоняется без
+# SELECT и KDF (ответ задерживается на обычное время проверки)
+USERNAME_FILTER_ENABLED = True
+USERNAME_FILTER_SNAPSHOT = Path("server_data/username_filter.bin")
+USERNAME_FILTER_ERROR_RATE = 0.001   # доля несуществующих, которые пройдут обычным путем
+UNKNOWN_USER_AUDIT_SAMPLE = 100      # в login_attempts - 1 из N таких входов, в метриках - все
+
+# Постраничный список пользователей
+LIST_PAGE_DEFAULT = 50
+LIST_PAGE_MAX = 1000
+
+# Поиск по части username / license_key / hwid (user_search.py, FTS5 trigram).
+# Существующие строки индексируются в фоне пачками USERS_MIGRATION_BATCH
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_MAX_MATCHES = 1000   # больше совпадений - ранжируются первые, ответ truncated
+
+# Метрики (/metrics). Воркеры складывают снимки в METRICS_DIR
+METRICS_DIR = Path("server_data/metrics")
+METRICS_FLUSH_INTERVAL = 2.0
+METRICS_ALLOWED_IPS = {"127.0.0.1", "::1"}  # остальным нужен Bearer API_SECRET
+
+# Профилирование по запросу (/api/admin/profile) и журнал медленных запросов
+# (/api/admin/slow_requests). Файлы воркеров - в PROFILE_DIR
+PROFILE_DIR = Path("server_data/profiles")
+PROFILE_MAX_SECONDS = 60
+PROFILE_DEFAULT_INTERVAL = 0.005   # сек между снимками стеков
+SLOW_REQUEST_LOG_SIZE = 50         # самых медленных на воркер (0 - выключен)
+SLOW_REQUEST_WINDOW = 900          # сек, за какой период
+
+# Массовое создание (/api/admin/bulk_create)
+BULK_CREATE_MAX = 1000
+BULK_PREFIX_MAX_LENGTH = 24   # к префиксу добавляется "_" и 8 hex
+USERNAME_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_.-")
+
+# Сводка /api/admin/stats
+STATS_CACHE_TTL = 15     # сек, сводка считается не чаще
+STATS_TOP_IPS = 10
+
+# Обслуживание login_attempts: сводки по часам, архив, incremental VACUUM
+MAINTENANCE_ENABLED = True
+MAINTENANCE_INTERVAL = 600              # сек
+LOGIN_ATTEMPTS_RETENTION_DAYS = 30      # старше - в архив
+LOGIN_ARCHIVE_DIR = Path("server_data/archive")
+
+# Перевод users.expires_at / created_at в числа (schema_migrations.py)
+USERS_MIGRATION_BATCH = 2000    # строк в одной транзакции
+USERS_MIGRATION_PAUSE = 0.05    # сек между пачками, чтобы входы не ждали запись
+
+# Резервные копии БД (backup.py): online backup API, gzip, проверка копии
+BACKUP_ENABLED = True
+BACKUP_DIR = Path("server_data/backups")
+BACKUP_INTERVAL = 6 * 3600      # сек между копиями по расписанию
+BACKUP_KEEP = 14                # хранить последних копий
+BACKUP_PAGES_PER_STEP = 256     # страниц за шаг (по 4 КБ)
+BACKUP_STEP_PAUSE = 0.01        # сек между шагами, чтобы входы не ждали диск
+
+# Несколько узлов (replication.py). Роль - из окружения, чтобы на одной
+# машине можно было поднять primary и реплики из разных папок:
+#   RULIX_NODE_ROLE=replica RULIX_PRIMARY_URL=http://10.0.0.1:5000 gunicorn ...
+# "standalone" - один узел; "primary" - пишет и раздает журнал изменений;
+# "replica" - вход по локальной копии, запись и админка уходят на primary
+NODE_ROLE = os.environ.get("RULIX_NODE_ROLE", "standalone")
+PRIMARY_URL = os.environ.get("RULIX_PRIMARY_URL", "http://127.0.0.1:5000")
+REPLICA_MAX_STALENESS = 5.0        # сек, старее - вход и проверки уходят на primary
+REPLICA_POLL_WAIT = 2.0            # сек, long poll журнала
+REPLICATION_BATCH = 5000           # строк журнала за запрос
+REPLICATION_LOG_RETENTION = 86400  # сек, отставшая сильнее реплика копирует все заново
+
+if NODE_ROLE not in ("standalone", "primary", "replica"):
+    raise SystemExit(f"[ERROR] RULIX_NODE_ROLE must be standalone, primary or replica, not {NODE_ROLE!r}")
+
 # ═══════════════════════════════════════════════════════════════
 # АВТОМАТИЧЕСКОЕ СОЗДАНИЕ БД
 # ═══════════════════════════════════════════════════════════════
@@ -42,6 +165,13 @@ def init_database():
     conn = sqlite3.connect(str(DB_PATH))
     cursor = conn.cursor()
 
+    # Действует только для новой БД (до первой таблицы), существующую
+    # переводит python maintenance.py --enable-incremental-vacuum
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+    # WAL хранится в файле БД, достаточно включить один раз
+    cursor.execute("PRAGMA journal_mode = WAL")
+
     # Создаем таблицу пользователей
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -52,7 +182,9 @@ def init_database():
             hwid TEXT,
             expires_at TEXT NOT NULL,
             is_active INTEGER DEFAULT 1,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            expires_ts INTEGER,
+            created_ts INTEGER
         )
     """)
 
@@ -68,24 +200,52 @@ def init_database():
         )
     """)
 
+    # Отозванные сессии (отключенные аккаунты)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS session_revocations (
+            user_id INTEGER PRIMARY KEY,
+            revoked_at REAL NOT NULL
+        )
+    """)
+
+    # Журнал изменений users для кеша пользователей в воркерах
+    cursor.execute(CHANGES_TABLE_SQL)
+
+    # Индексы login_attempts, таблицы почасовых сводок и maintenance_state
+    ensure_maintenance_schema(conn)
+
+    # Журнал изменений для реплик (триггеры только на primary)
+    prepare_replication(conn, NODE_ROLE)
+
+    # Числовые expires_ts / created_ts и индексы для списка, фильтров по
+    # сроку и /api/admin/stats. Старые строки заполняются в фоне
+    users_migration.prepare(conn)
+
     conn.commit()
 
+    # Триграммный индекс для /api/admin/search. Старые строки - в фоне
+    user_search.prepare(conn)
+
     # Проверяем есть ли пользователи
     cursor.execute("SELECT COUNT(*) FROM users")
     count = cursor.fetchone()[0]
 
-    if count == 0:
+    # Реплика получит пользователей (и админа) с primary
+    if count == 0 and NODE_ROLE != 'replica':
         print("[DB] No users found, creating default admin...")
 
         # Создаем дефолтного админа
         admin_password = secrets.token_urlsafe(16)
-        password_hash = hashlib.sha256(admin_password.encode()).hexdigest()
-        expires_at = (datetime.now() + timedelta(days=365)).isoformat()
+        password_hash = hash_password(admin_password)
+        expires = datetime.now() + timedelta(days=365)
+        expires_at = expires.isoformat()
 
         cursor.execute("""
-            INSERT INTO users (username, password_hash, license_key, expires_at)
-            VALUES (?, ?, ?, ?)
-        """, ("admin", password_hash, "ADMIN-KEY", expires_at))
+            INSERT INTO users (username, password_hash, license_key, expires_at, expires_ts,
+                               created_at, created_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, ("admin", password_hash, "ADMIN-KEY", expires_at, int(expires.timestamp()),
+              *creation_stamp()))
 
         conn.commit()
 
@@ -100,32 +260,157 @@ def init_database():
         print("[DB] ═══════════════════════════════════════════════════")
 
     conn.close()
+    users_migration.ensure_started()
+    user_search.ensure_started()
     print("[DB] ✅ Database ready")
 
+def database_initialized():
+    """Создана ли схема (init_database запускается один раз до воркеров)"""
+    try:
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
+        return False
+    try:
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'"
+        ).fetchone() is not None
+    finally:
+        conn.close()
+
+def creation_stamp():
+    """(created_at в формате CURRENT_TIMESTAMP, created_ts) из одного момента"""
+    created_ts = int(time.time())
+    return datetime.fromtimestamp(created_ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S"), created_ts
+
 # ═══════════════════════════════════════════════════════════════
 # ЗАЩИТА ОТ БРУТФОРСА
 # ═══════════════════════════════════════════════════════════════
-failed_attempts = {}
-MAX_ATTEMPTS = 5
-LOCKOUT_TIME = 300
-
-def check_rate_limit(ip):
-    if ip in failed_attempts:
-        count, last_time = failed_attempts[ip]
-        if time.time() - last_time < LOCKOUT_TIME and count >= MAX_ATTEMPTS:
-            return False, f"Too many attempts. Try again in {int(LOCKOUT_TIME - (time.time() - last_time))} seconds"
+MAX_ATTEMPTS = 5           # неудачных попыток с одного IP
+MAX_USER_ATTEMPTS = 10     # неудачных попыток на один username
+LOCKOUT_TIME = 300         # окно, сек
+
+RATE_LIMIT_BACKEND = "sqlite"  # "sqlite" - общий для всех воркеров, "memory" - свой у каждого
+RATE_LIMIT_DB_PATH = Path("server_data/rate_limit.db")
+RATE_LIMIT_MAX_ENTRIES = 200000
+
+if RATE_LIMIT_BACKEND == "sqlite":
+    rate_limit_backend = SQLiteBackend(RATE_LIMIT_DB_PATH, max_entries=RATE_LIMIT_MAX_ENTRIES)
+else:
+    rate_limit_backend = MemoryBackend(max_entries=RATE_LIMIT_MAX_ENTRIES)
+
+ip_limiter = RateLimiter(rate_limit_backend, MAX_ATTEMPTS, LOCKOUT_TIME)
+user_limiter = RateLimiter(rate_limit_backend, MAX_USER_ATTEMPTS, LOCKOUT_TIME)
+
+def check_rate_limit(ip, username=None):
+    allowed, retry_after = True, 0
+    if ip is not None:
+        allowed, retry_after = ip_limiter.check(f"ip:{ip}")
+    if allowed and username is not None:
+        allowed, retry_after = user_limiter.check(f"user:{username}")
+    if not allowed:
+        return False, f"Too many attempts. Try again in {retry_after} seconds"
     return True, None
 
-def record_failed_attempt(ip):
-    if ip in failed_attempts:
-        count, _ = failed_attempts[ip]
-        failed_attempts[ip] = (count + 1, time.time())
-    else:
-        failed_attempts[ip] = (1, time.time())
+def record_failed_attempt(ip, username=None):
+    ip_limiter.hit(f"ip:{ip}")
+    if username is not None:
+        user_limiter.hit(f"user:{username}")
 
-def clear_failed_attempts(ip):
-    if ip in failed_attempts:
-        del failed_attempts[ip]
+def clear_failed_attempts(ip, username=None):
+    ip_limiter.reset(f"ip:{ip}")
+    if username is not None:
+        user_limiter.reset(f"user:{username}")
+
+# ═══════════════════════════════════════════════════════════════
+# МЕТРИКИ
+# ═══════════════════════════════════════════════════════════════
+
+metrics = Metrics(METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL)
+metrics.counter('rulix_login_total', 'Login attempts by outcome')
+metrics.counter('rulix_seat_checks_total', 'check_batch entries by status')
+metrics.histogram('rulix_login_stage_seconds', 'Time spent in each login() stage')
+metrics.counter('rulix_http_requests_total', 'HTTP requests by endpoint and status')
+metrics.histogram('rulix_http_request_seconds', 'HTTP request latency by endpoint')
+
+# Профиль ждет свое окно, long poll реплики ждет изменений - оба медленные нарочно
+slow_log = SlowRequestLog(SLOW_REQUEST_LOG_SIZE, SLOW_REQUEST_WINDOW,
+                          exclude={'admin_profile', 'replication_changes'})
+profiler = SamplingProfiler(PROFILE_DIR, slow_log=slow_log, max_duration=PROFILE_MAX_SECONDS)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_trace = slow_log.begin(request.endpoint or 'unknown')
+
+@app.before_request
+def start_maintenance():
+    # Поток в каждом воркере, работает только владелец аренды
+    if MAINTENANCE_ENABLED:
+        maintenance_job.ensure_started()
+    # Заполнение числовых сроков и индекса поиска, если init_database был до fork
+    users_migration.ensure_started()
+    user_search.ensure_started()
+    if USERNAME_FILTER_ENABLED:
+        username_filter.ensure_started()
+    # Копии делает primary (или одиночный узел), у реплики они те же
+    if BACKUP_ENABLED and NODE_ROLE != 'replica':
+        backup_job.ensure_started()
+    if replica is not None:
+        replica.ensure_started()
+    profiler.ensure_started()
+
+# Маршруты про сам узел - реплика отвечает на них всегда
+NODE_LOCAL_PATHS = {'/api/health', '/metrics', '/api/admin/profile', '/api/admin/slow_requests'}
+
+# Маршруты, которые реплика обслуживает сама, пока ее данные свежие
+REPLICA_LOCAL_PATHS = {'/api/auth/login', '/api/auth/validate', '/api/auth/validate_batch',
+                       '/api/auth/check_batch'}
+
+def serve_locally(path):
+    """False - запрос целиком уходит на primary"""
+    if replica is None or path in NODE_LOCAL_PATHS or path.startswith('/api/replication/'):
+        return True
+    return path in REPLICA_LOCAL_PATHS and replica.fresh()
+
+def forward_to_primary():
+    try:
+        upstream = replica.forward(request.method, request.full_path, request.get_data(),
+                                   request.headers, request.remote_addr)
+    except PrimaryUnavailable as e:
+        print(f"[REPLICA] Forward to primary failed: {e}")
+        return jsonify({'success': False, 'error': 'Primary unavailable, try again'}), 503
+    return Response(stream_with_context(upstream.iter_content(64 * 1024)),
+                    status=upstream.status_code,
+                    content_type=upstream.headers.get('Content-Type'))
+
+def resolve_client_ip(remote_addr, authorization, forwarded):
+    """Адрес клиента для rate limit и аудита (и во Flask, и в auth_asgi).
+    Запросу, пересланному репликой с Bearer API_SECRET, - адрес из
+    FORWARDED_IP_HEADER. Реплика сама заголовку не верит: к ней приходят клиенты"""
+    if replica is None and forwarded and authorization and hmac.compare_digest(
+            authorization.encode(), f"Bearer {API_SECRET}".encode()):
+        return forwarded
+    return remote_addr
+
+@app.before_request
+def route_between_nodes():
+    if replica is None:
+        request.remote_addr = resolve_client_ip(request.remote_addr,
+                                                request.headers.get('Authorization'),
+                                                request.headers.get(FORWARDED_IP_HEADER))
+        return None
+    if not serve_locally(request.path):
+        return forward_to_primary()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None and request.endpoint != 'metrics_endpoint':
+        endpoint = request.endpoint or 'unknown'
+        metrics.observe('rulix_http_request_seconds', time.perf_counter() - started, endpoint=endpoint)
+        metrics.inc('rulix_http_requests_total', endpoint=endpoint, status=response.status_code)
+    slow_log.finish(g.pop('request_trace', None), response.status_code)
+    return response
 
 # ═══════════════════════════════════════════════════════════════
 # УТИЛИТЫ
@@ -139,11 +424,148 @@ def verify_signature(data, signature):
     ).hexdigest()
     return hmac.compare_digest(expected, signature)
 
+db_pool = ConnectionPool(DB_PATH, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                         trace=slow_log.trace_sql if SLOW_REQUEST_LOG_SIZE else None)
+
 def get_db():
-    return sqlite3.connect(str(DB_PATH))
+    """Соединение из пула: with get_db() as conn: ..."""
+    return db_pool.connection()
+
+def replicated_users_changed(conn, usernames):
+    # Другие воркеры реплики увидят изменение так же, как чужую запись на primary
+    user_cache.invalidate(conn, usernames)
+    username_filter.add(usernames)
+
+# Реплика: журнал primary -> локальная БД, запись -> primary
+replica = ReplicaApplier(
+    db_pool,
+    PRIMARY_URL,
+    API_SECRET,
+    on_users_changed=replicated_users_changed,
+    poll_wait=REPLICA_POLL_WAIT,
+    max_staleness=REPLICA_MAX_STALENESS,
+    batch_size=REPLICATION_BATCH,
+) if NODE_ROLE == 'replica' else None
+
+replication_source = ReplicationSource(
+    db_pool,
+    batch_size=REPLICATION_BATCH,
+    retention=REPLICATION_LOG_RETENTION,
+)
+
+audit_writer = AuditWriter(
+    db_pool,
+    max_queue=AUDIT_QUEUE_SIZE,
+    batch_size=AUDIT_BATCH_SIZE,
+    flush_interval=AUDIT_FLUSH_INTERVAL,
+    block=AUDIT_BLOCK_WHEN_FULL,
+    sink=replica.forward_audit if replica else None,
+)
+atexit.register(audit_writer.close)
+
+password_hasher = PasswordHasher(
+    params=PASSWORD_PARAMS,
+    workers=PASSWORD_WORKERS,
+    max_pending=PASSWORD_MAX_PENDING,
+    cache_size=PASSWORD_CACHE_SIZE,
+    cache_ttl=PASSWORD_CACHE_TTL,
+)
 
 def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+    return password_hasher.hash(password)
+
+token_signer = TokenSigner(API_SECRET, ttl=SESSION_TOKEN_TTL)
+revocations = RevocationList(
+    db_pool,
+    refresh_interval=REVOCATION_REFRESH_INTERVAL,
+    max_age=SESSION_TOKEN_TTL,
+)
+
+user_cache = UserCache(
+    db_pool,
+    max_size=USER_CACHE_SIZE,
+    ttl=USER_CACHE_TTL,
+    refresh_interval=USER_CACHE_REFRESH_INTERVAL,
+)
+
+maintenance_job = MaintenanceJob(
+    db_pool,
+    archive_dir=LOGIN_ARCHIVE_DIR,
+    retention_days=LOGIN_ATTEMPTS_RETENTION_DAYS,
+    interval=MAINTENANCE_INTERVAL,
+)
+
+username_filter = UsernameFilter(
+    db_pool,
+    snapshot_path=USERNAME_FILTER_SNAPSHOT,
+    error_rate=USERNAME_FILTER_ERROR_RATE,
+)
+
+def username_may_exist(username):
+    return not USERNAME_FILTER_ENABLED or username_filter.might_exist(username)
+
+backup_job = BackupJob(
+    db_pool,
+    db_path=DB_PATH,
+    backup_dir=BACKUP_DIR,
+    interval=BACKUP_INTERVAL,
+    keep=BACKUP_KEEP,
+    pages_per_step=BACKUP_PAGES_PER_STEP,
+    pause=BACKUP_STEP_PAUSE,
+)
+
+users_migration = UsersEpochMigration(
+    db_pool,
+    batch_size=USERS_MIGRATION_BATCH,
+    pause=USERS_MIGRATION_PAUSE,
+)
+
+user_search = UserSearch(
+    db_pool,
+    max_matches=SEARCH_MAX_MATCHES,
+    batch_size=USERS_MIGRATION_BATCH,
+    pause=USERS_MIGRATION_PAUSE,
+)
+
+def pool_gauges():
+    stats = db_pool.stats()
+    return {(('stat', name),): stats[name] for name in ('size', 'in_use', 'idle', 'waits', 'timeouts')}
+
+def audit_gauges():
+    stats = audit_writer.stats()
+    return {(('stat', name),): stats[name] for name in ('queued', 'written', 'dropped', 'errors')}
+
+def user_cache_gauges():
+    stats = user_cache.stats()
+    return {(('stat', name),): stats[name] for name in ('size', 'hits', 'misses', 'invalidations')}
+
+def rate_limit_gauges():
+    stats = rate_limit_backend.stats()
+    return {(('stat', name),): stats[name] for name in ('entries', 'memory_bytes', 'evictions')}
+
+metrics.gauge('rulix_db_pool', 'DB connection pool state (per worker)', pool_gauges)
+metrics.gauge('rulix_audit_queue', 'Audit writer state (per worker)', audit_gauges)
+metrics.gauge('rulix_rate_limiter', 'Rate limiter state', rate_limit_gauges)
+metrics.gauge('rulix_user_cache', 'User cache state (per worker)', user_cache_gauges)
+
+def validate_session(token, hwid=None):
+    """Проверка токена сессии только по памяти"""
+    claims, reason = token_signer.decode(token)
+    if claims is None:
+        return {'valid': False, 'error': reason}
+
+    if hwid is not None and not hmac.compare_digest(str(claims['h']).encode(), str(hwid).encode()):
+        return {'valid': False, 'error': 'hwid_mismatch'}
+
+    if revocations.is_revoked(claims['u'], claims['i']):
+        return {'valid': False, 'error': 'revoked'}
+
+    return {
+        'valid': True,
+        'user_id': claims['u'],
+        'expires_at': datetime.fromtimestamp(claims['x']).isoformat(),
+        'token_expires_at': datetime.fromtimestamp(claims['e']).isoformat()
+    }
 
 # ═══════════════════════════════════════════════════════════════
 # API ENDPOINTS
@@ -151,110 +573,367 @@ def hash_password(password):
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({
+    body = {
         'status': 'online',
         'version': '2.0',
+        'role': NODE_ROLE,
         'timestamp': datetime.now().isoformat()
-    })
-
-@app.route('/api/auth/login', methods=['POST'])
-def login():
-    try:
-        client_ip = request.remote_addr
-
-        allowed, error_msg = check_rate_limit(client_ip)
-        if not allowed:
-            return jsonify({'success': False, 'error': error_msg}), 429
-
-        data = request.get_json()
-
-        if not all(k in data for k in ['username', 'password', 'hwid', 'signature']):
-            record_failed_attempt(client_ip)
-            return jsonify({'success': False, 'error': 'Missing required fields'}), 400
-
-        username = data['username']
-        password = data['password']
-        hwid = data['hwid']
-        signature = data['signature']
-
-        payload = f"{username}:{password}:{hwid}"
-        if not verify_signature(payload, signature):
-            record_failed_attempt(client_ip)
-            print(f"[SECURITY] Invalid signature from {client_ip}")
-            return jsonify({'success': False, 'error': 'Invalid signature'}), 403
+    }
+    if replica is not None:
+        staleness = replica.staleness()
+        body['replica_staleness'] = round(staleness, 3) if staleness is not None else None
+        body['replica_fresh'] = replica.fresh()
+    return jsonify(body)
+
+class LoginFailed(Exception):
+    """Вход отклонен: outcome для метрик, error и status для ответа"""
+
+    def __init__(self, outcome, error, status):
+        super().__init__(error)
+        self.outcome = outcome
+        self.error = error
+        self.status = status
+
+class LoginAttempt:
+    __slots__ = ('client_ip', 'username', 'password', 'hwid', 'user', 'unknown', 'clock')
+
+# login() разбит на шаги, чтобы async режим (auth_asgi.py) мог ждать
+# блокирующие части в своих пулах, а KDF - без занятого потока
+
+def login_lookup(data, client_ip, clock):
+    """Rate limit, подпись, SELECT пользователя -> LoginAttempt"""
+    allowed, error_msg = check_rate_limit(client_ip)
+    clock.lap('rate_limit')
+    if not allowed:
+        raise LoginFailed('rate_limited', error_msg, 429)
+
+    if not isinstance(data, dict) or not all(k in data for k in ['username', 'password', 'hwid', 'signature']):
+        record_failed_attempt(client_ip)
+        raise LoginFailed('bad_request', 'Missing required fields', 400)
+
+    # Число или список в username дошли бы до фильтра логинов и кеша как 500
+    if not all(isinstance(data[k], str) for k in ['username', 'password', 'hwid', 'signature']):
+        record_failed_attempt(client_ip)
+        raise LoginFailed('bad_request', 'Fields must be strings', 400)
+
+    attempt = LoginAttempt()
+    attempt.client_ip = client_ip
+    attempt.clock = clock
+    attempt.unknown = False
+    attempt.username = username = data['username']
+    attempt.password = password = data['password']
+    attempt.hwid = hwid = data['hwid']
+    signature = data['signature']
+
+    payload = f"{username}:{password}:{hwid}"
+    valid_signature = verify_signature(payload, signature)
+    clock.lap('signature')
+    if not valid_signature:
+        record_failed_attempt(client_ip)
+        print(f"[SECURITY] Invalid signature from {client_ip}")
+        raise LoginFailed('invalid_signature', 'Invalid signature', 403)
+
+    allowed, error_msg = check_rate_limit(None, username)
+    clock.lap('rate_limit')
+    if not allowed:
+        raise LoginFailed('rate_limited', error_msg, 429)
+
+    attempt.user = user_cache.get(username)
+    if attempt.user is not None:
+        clock.lap('user_cache')
+    elif not username_may_exist(username):
+        attempt.unknown = True
+        clock.lap('username_filter')
+    else:
+        attempt.user = user_cache.load(username, load_login_user)
+        clock.lap('select')
 
-        conn = get_db()
-        cursor = conn.cursor()
+    return attempt
 
-        password_hash = hash_password(password)
+# Строка users для входа и проверки мест (так же лежит в user_cache)
+LOGIN_USER_COLUMNS = "id, password_hash, hwid, expires_at, license_key, is_active, expires_ts"
 
-        cursor.execute("""
-            SELECT id, hwid, expires_at, license_key, is_active
+def load_login_user(username):
+    with get_db() as conn:
+        return conn.execute(f"""
+            SELECT {LOGIN_USER_COLUMNS}
             FROM users
-            WHERE username = ? AND password_hash = ?
-        """, (username, password_hash))
-
-        user = cursor.fetchone()
-
-        if not user:
-            record_failed_attempt(client_ip)
-            cursor.execute("""
-                INSERT INTO login_attempts (username, success, hwid, ip_address)
-                VALUES (?, 0, ?, ?)
-            """, (username, hwid, client_ip))
-            conn.commit()
-            conn.close()
-            return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
-
-        user_id, stored_hwid, expires_at, license_key, is_active = user
-
-        if not is_active:
-            record_failed_attempt(client_ip)
-            conn.close()
-            return jsonify({'success': False, 'error': 'Account disabled'}), 403
-
-        expires = datetime.fromisoformat(expires_at)
-        if datetime.now() > expires:
-            record_failed_attempt(client_ip)
-            conn.close()
-            return jsonify({'success': False, 'error': 'License expired'}), 403
-
-        if stored_hwid and stored_hwid != hwid:
-            record_failed_attempt(client_ip)
+            WHERE username = ?
+        """, (username,)).fetchone()
+
+def license_expires_ts(expires_at, expires_ts):
+    if expires_ts is None:
+        # Строка еще не заполнена миграцией
+        return datetime.fromisoformat(expires_at).timestamp()
+    return expires_ts
+
+def login_verify(attempt):
+    """KDF в пуле хешера -> Future[(valid, needs_rehash)]"""
+    if attempt.user:
+        return password_hasher.submit_verify(attempt.username, attempt.password, attempt.user[1])
+    if attempt.unknown:
+        return password_hasher.submit_delayed_reject()
+    return password_hasher.submit_dummy_verify(attempt.password)
+
+def login_complete(attempt, valid, needs_rehash):
+    """Проверки лицензии и HWID, запись, токен -> тело ответа"""
+    client_ip, username, password, hwid, clock = (
+        attempt.client_ip, attempt.username, attempt.password, attempt.hwid, attempt.clock)
+
+    if not valid:
+        # Лимит по логину и для несуществующих - иначе 429 выдаст, какие есть
+        record_failed_attempt(client_ip, username)
+        if attempt.unknown:
+            if secrets.randbelow(UNKNOWN_USER_AUDIT_SAMPLE) == 0:
+                audit_writer.submit(username, False, hwid, client_ip)
+            clock.lap('audit')
+            raise LoginFailed('unknown_user', 'Invalid credentials', 401)
+        audit_writer.submit(username, False, hwid, client_ip)
+        clock.lap('audit')
+        raise LoginFailed('invalid_credentials', 'Invalid credentials', 401)
+
+    user_id, stored_hash, stored_hwid, expires_at, license_key, is_active, expires_ts = attempt.user
+
+    if not is_active:
+        record_failed_attempt(client_ip, username)
+        raise LoginFailed('disabled', 'Account disabled', 403)
+
+    expires_ts = license_expires_ts(expires_at, expires_ts)
+    if time.time() > expires_ts:
+        record_failed_attempt(client_ip, username)
+        raise LoginFailed('expired', 'License expired', 403)
+
+    if stored_hwid and stored_hwid != hwid:
+        record_failed_attempt(client_ip, username)
+        print(f"[SECURITY] HWID mismatch for {username}")
+        raise LoginFailed('hwid_mismatch', 'HWID mismatch', 403)
+
+    # Старый sha256 хеш (или старые параметры) - перехешируем
+    new_hash = hash_password(password) if needs_rehash else None
+    if new_hash:
+        clock.lap('rehash')
+
+    if new_hash or not stored_hwid:
+        bind_hwid = None if stored_hwid else hwid
+        if replica is not None:
+            saved = replica.forward_login_writes(user_id, username, bind_hwid, new_hash, stored_hash)
+        else:
+            saved = save_login_writes(user_id, username, bind_hwid, new_hash, stored_hash)
+        clock.lap('commit')
+        if not saved:
+            record_failed_attempt(client_ip, username)
             print(f"[SECURITY] HWID mismatch for {username}")
-            conn.close()
-            return jsonify({'success': False, 'error': 'HWID mismatch'}), 403
-
-        if not stored_hwid:
-            cursor.execute("UPDATE users SET hwid = ? WHERE id = ?", (hwid, user_id))
-            conn.commit()
-
-        cursor.execute("""
-            INSERT INTO login_attempts (username, success, hwid, ip_address)
-            VALUES (?, 1, ?, ?)
-        """, (username, hwid, client_ip))
+            raise LoginFailed('hwid_mismatch', 'HWID mismatch', 403)
+
+        if new_hash:
+            password_hasher.remember(username, password, new_hash)
+
+    audit_writer.submit(username, True, hwid, client_ip)
+    clock.lap('audit')
+
+    clear_failed_attempts(client_ip, username)
+    clock.lap('rate_limit')
+
+    session_token = token_signer.issue(user_id, hwid, expires_ts)
+    clock.lap('token')
+
+    return {
+        'success': True,
+        'user': {
+            'user_id': user_id,
+            'username': username,
+            'license_key': license_key,
+            'expires_at': expires_at,
+            'session_token': session_token
+        }
+    }
+
+def save_login_writes(user_id, username, bind_hwid, new_hash, stored_hash):
+    """Привязка HWID и новый хеш после входа -> False если привязан другой HWID"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        if bind_hwid:
+            # Строка могла прийти из кеша (или с реплики): привязываем только
+            # если HWID все еще пустой, иначе сверяем с уже привязанным
+            cursor.execute("UPDATE users SET hwid = ? WHERE id = ? AND hwid IS NULL",
+                           (bind_hwid, user_id))
+            if cursor.rowcount == 0:
+                bound = cursor.execute("SELECT hwid FROM users WHERE id = ?", (user_id,)).fetchone()
+                if bound and bound[0] != bind_hwid:
+                    conn.rollback()
+                    return False
+        if new_hash:
+            cursor.execute("""
+                UPDATE users SET password_hash = ?
+                WHERE id = ? AND password_hash = ?
+            """, (new_hash, user_id, stored_hash))
+        user_cache.invalidate(conn, [username])
         conn.commit()
-        conn.close()
-
-        clear_failed_attempts(client_ip)
-
-        session_token = secrets.token_urlsafe(32)
-
-        return jsonify({
-            'success': True,
-            'user': {
-                'user_id': user_id,
-                'username': username,
-                'license_key': license_key,
-                'expires_at': expires_at,
-                'session_token': session_token
-            }
-        }), 200
+    return True
 
+@app.route('/api/auth/login', methods=['POST'])
+def login():
+    clock = metrics.stage_clock('rulix_login_stage_seconds')
+    slow_log.attach_stages(clock.laps)
+    try:
+        attempt = login_lookup(request.get_json(), request.remote_addr, clock)
+
+        # KDF считаем без занятого соединения
+        valid, needs_rehash = login_verify(attempt).result(password_hasher.timeout)
+        clock.lap('password_hash')
+
+        body = login_complete(attempt, valid, needs_rehash)
+        metrics.inc('rulix_login_total', outcome='success')
+        return jsonify(body), 200
+
+    except LoginFailed as e:
+        metrics.inc('rulix_login_total', outcome=e.outcome)
+        return jsonify({'success': False, 'error': e.error}), e.status
+    except (PoolTimeout, HasherBusy, PrimaryUnavailable) as e:
+        print(f"[BUSY] {e}")
+        metrics.inc('rulix_login_total', outcome='busy')
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
     except Exception as e:
         print(f"[ERROR] {str(e)}")
         import traceback
         traceback.print_exc()
+        metrics.inc('rulix_login_total', outcome='error')
+        return jsonify({'success': False, 'error': 'Internal server error'}), 500
+
+@app.route('/api/auth/validate', methods=['POST'])
+def validate():
+    """Проверка токена сессии без обращения к БД"""
+    data = request.get_json(silent=True) or {}
+
+    token = data.get('session_token')
+    if not isinstance(token, str):
+        return jsonify({'success': False, 'error': 'Missing session_token'}), 400
+
+    result = validate_session(token, data.get('hwid'))
+    return jsonify({'success': result['valid'], **result}), 200 if result['valid'] else 401
+
+@app.route('/api/auth/validate_batch', methods=['POST'])
+def validate_batch():
+    """Пакетная проверка: {"tokens": [{"session_token": ..., "hwid": ...}, ...]}"""
+    data = request.get_json(silent=True) or {}
+
+    tokens = data.get('tokens')
+    if not isinstance(tokens, list) or len(tokens) > VALIDATE_BATCH_MAX:
+        return jsonify({'success': False, 'error': f'tokens must be a list of at most {VALIDATE_BATCH_MAX}'}), 400
+
+    results = []
+    for item in tokens:
+        if not isinstance(item, dict) or not isinstance(item.get('session_token'), str):
+            results.append({'valid': False, 'error': 'malformed'})
+            continue
+        results.append(validate_session(item['session_token'], item.get('hwid')))
+
+    return jsonify({'success': True, 'results': results}), 200
+
+def check_batch_payload(timestamp, checks):
+    """Что подписывает клиент: timestamp и строки username:hwid:license_key"""
+    return "\n".join([str(timestamp)] + [
+        f"{c['username']}:{c['hwid']}:{c['license_key']}" for c in checks
+    ])
+
+def seat_status(user, hwid, license_key, now):
+    if user is None:
+        return 'not_found'
+    user_id, _, stored_hwid, expires_at, stored_license, is_active, expires_ts = user
+    if not hmac.compare_digest(str(stored_license).encode(), license_key.encode()):
+        return 'license_mismatch'
+    if not is_active:
+        return 'disabled'
+    if now > license_expires_ts(expires_at, expires_ts):
+        return 'expired'
+    if not stored_hwid:
+        return 'hwid_not_bound'
+    if not hmac.compare_digest(stored_hwid.encode(), hwid.encode()):
+        return 'hwid_mismatch'
+    return 'ok'
+
+def check_seats(data, client_ip):
+    """Пакетная проверка (username, hwid, license_key) -> (HTTP статус, тело)
+
+    Одна подпись на весь запрос, пользователи - из кеша или одним IN (...),
+    аудит всех строк одной пачкой. HWID здесь не привязывается (это делает вход)
+    """
+    allowed, error_msg = check_rate_limit(client_ip)
+    if not allowed:
+        return 429, {'success': False, 'error': error_msg}
+
+    checks = data.get('checks') if isinstance(data, dict) else None
+    if not isinstance(checks, list) or not 0 < len(checks) <= CHECK_BATCH_MAX:
+        return 400, {'success': False, 'error': f'checks must be a list of 1..{CHECK_BATCH_MAX}'}
+    for i, check in enumerate(checks):
+        if not isinstance(check, dict) or not all(
+                isinstance(check.get(k), str) and check[k] for k in ('username', 'hwid', 'license_key')):
+            return 400, {'success': False, 'error': f'checks[{i}] needs username, hwid, license_key'}
+
+    timestamp = data.get('timestamp')
+    signature = data.get('signature')
+    if not isinstance(timestamp, int) or not isinstance(signature, str):
+        return 400, {'success': False, 'error': 'Missing timestamp or signature'}
+    if abs(time.time() - timestamp) > CHECK_BATCH_MAX_SKEW:
+        record_failed_attempt(client_ip)
+        return 403, {'success': False, 'error': 'Request expired'}
+    if not verify_signature(check_batch_payload(timestamp, checks), signature):
+        record_failed_attempt(client_ip)
+        print(f"[SECURITY] Invalid check_batch signature from {client_ip}")
+        return 403, {'success': False, 'error': 'Invalid signature'}
+
+    users = {}
+    missing = []
+    for username in {c['username'] for c in checks}:
+        row = user_cache.get(username)
+        if row is not None:
+            users[username] = row
+        elif username_may_exist(username):
+            missing.append(username)
+    if missing:
+        with get_db() as conn:
+            for chunk in chunked(missing, CHECK_BATCH_MAX):
+                placeholders = ",".join("?" * len(chunk))
+                for row in conn.execute(
+                        f"SELECT username, {LOGIN_USER_COLUMNS} FROM users WHERE username IN ({placeholders})",
+                        chunk):
+                    users[row[0]] = row[1:]
+
+    now = time.time()
+    results = []
+    audit_rows = []
+    outcomes = {}
+    for check in checks:
+        username = check['username']
+        status = seat_status(users.get(username), check['hwid'], check['license_key'], now)
+        result = {'username': username, 'valid': status == 'ok', 'status': status}
+        if status == 'ok':
+            result['expires_at'] = users[username][3]
+        results.append(result)
+        audit_rows.append((username, status == 'ok', check['hwid'], client_ip))
+        outcomes[status] = outcomes.get(status, 0) + 1
+
+    audit_writer.submit_many(audit_rows)
+    for status, count in outcomes.items():
+        metrics.inc('rulix_seat_checks_total', count, status=status)
+
+    return 200, {'success': True, 'results': results}
+
+@app.route('/api/auth/check_batch', methods=['POST'])
+def check_batch():
+    """Проверка мест лаунчера/турнирного сервера одним запросом
+
+    {"checks": [{"username", "hwid", "license_key"}, ...], "timestamp": unix,
+     "signature": HMAC-SHA256(API_SECRET, check_batch_payload(...))}
+    """
+    try:
+        status, body = check_seats(request.get_json(silent=True), request.remote_addr)
+        return jsonify(body), status
+    except PoolTimeout as e:
+        print(f"[BUSY] {e}")
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
         return jsonify({'success': False, 'error': 'Internal server error'}), 500
 
 # ═══════════════════════════════════════════════════════════════
@@ -280,26 +959,29 @@ def create_user():
         if not username or not password:
             return jsonify({'success': False, 'error': 'Username and password required'}), 400
 
-        conn = get_db()
-        cursor = conn.cursor()
-
-        # Проверяем что username не занят
-        cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-        if cursor.fetchone():
-            conn.close()
-            return jsonify({'success': False, 'error': 'Username already exists'}), 400
-
         password_hash = hash_password(password)
-        expires_at = (datetime.now() + timedelta(days=duration_days)).isoformat()
+        expires = datetime.now() + timedelta(days=duration_days)
+        expires_at = expires.isoformat()
 
-        cursor.execute("""
-            INSERT INTO users (username, password_hash, license_key, expires_at)
-            VALUES (?, ?, ?, ?)
-        """, (username, password_hash, license_key, expires_at))
+        with get_db() as conn:
+            cursor = conn.cursor()
 
-        user_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+            # Проверяем что username не занят
+            cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
+            if cursor.fetchone():
+                return jsonify({'success': False, 'error': 'Username already exists'}), 400
+
+            cursor.execute("""
+                INSERT INTO users (username, password_hash, license_key, expires_at, expires_ts,
+                                   created_at, created_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (username, password_hash, license_key, expires_at, int(expires.timestamp()),
+                  *creation_stamp()))
+
+            user_id = cursor.lastrowid
+            user_cache.invalidate(conn, [username])
+            conn.commit()
+        username_filter.add([username])
 
         print(f"[ADMIN] New user created: {username} (ID: {user_id})")
 
@@ -313,15 +995,272 @@ def create_user():
             }
         }), 200
 
+    except (PoolTimeout, HasherBusy) as e:
+        print(f"[BUSY] {e}")
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def generate_license_key():
+    return f"RULIX-{secrets.token_urlsafe(8).upper()}"
+
+def chunked(items, size=500):
+    """Кусками - SQLite ограничивает число параметров в запросе"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def find_existing_usernames(conn, usernames):
+    existing = set()
+    for chunk in chunked(usernames):
+        placeholders = ",".join("?" * len(chunk))
+        existing.update(row[0] for row in conn.execute(
+            f"SELECT username FROM users WHERE username IN ({placeholders})", chunk
+        ))
+    return existing
+
+def mark_duplicate(result):
+    username = result['username']
+    result.clear()
+    result.update(username=username, status='duplicate', error='Username already exists')
+
+@app.route('/api/admin/bulk_create', methods=['POST'])
+def bulk_create():
+    """Массовое создание пользователей одной транзакцией
+
+    {"users": [{"username", "password"?, "duration_days"?, "license_key"?}, ...]}
+    или {"count": N, "prefix": "user", "duration_days": 30} - логины и пароли генерируются
+    """
+    try:
+        data = request.get_json()
+
+        admin_token = data.get('admin_token')
+        if admin_token != API_SECRET:
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+        default_days = data.get('duration_days', 30)
+
+        if 'count' in data:
+            try:
+                count = int(data['count'])
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'error': 'count must be a number'}), 400
+            # До генерации: count = 10**9 не должен строить список
+            if not 0 < count <= BULK_CREATE_MAX:
+                return jsonify({'success': False, 'error': f'Between 1 and {BULK_CREATE_MAX} users per request'}), 400
+            prefix = data.get('prefix', 'user')
+            if (not isinstance(prefix, str) or not 0 < len(prefix) <= BULK_PREFIX_MAX_LENGTH
+                    or not set(prefix) <= USERNAME_CHARS):
+                return jsonify({'success': False, 'error': f'prefix must be 1-{BULK_PREFIX_MAX_LENGTH} '
+                                                           f'letters, digits, "_", "." or "-"'}), 400
+            entries = [{'username': f"{prefix}_{secrets.token_hex(4)}"} for _ in range(count)]
+        else:
+            entries = data.get('users')
+            if not isinstance(entries, list):
+                return jsonify({'success': False, 'error': 'users list or count required'}), 400
+
+        if not 0 < len(entries) <= BULK_CREATE_MAX:
+            return jsonify({'success': False, 'error': f'Between 1 and {BULK_CREATE_MAX} users per request'}), 400
+
+        # Проверка строк и дубликаты внутри самой пачки
+        results = []
+        pending = []
+        seen = set()
+        for entry in entries:
+            username = entry.get('username') if isinstance(entry, dict) else None
+            if not username or not isinstance(username, str):
+                results.append({'username': username, 'status': 'invalid', 'error': 'Username required'})
+                continue
+            if username in seen:
+                results.append({'username': username, 'status': 'duplicate', 'error': 'Duplicate in request'})
+                continue
+            seen.add(username)
+
+            try:
+                days = int(entry.get('duration_days', default_days))
+            except (TypeError, ValueError):
+                results.append({'username': username, 'status': 'invalid', 'error': 'duration_days must be a number'})
+                continue
+
+            result = {
+                'username': username,
+                'status': 'created',
+                'license_key': entry.get('license_key') or generate_license_key(),
+                'expires_at': (datetime.now() + timedelta(days=days)).isoformat()
+            }
+            password = entry.get('password')
+            if not password:
+                password = secrets.token_urlsafe(9)
+                result['password'] = password
+            results.append(result)
+            pending.append((result, password))
+
+        # Уже занятые логины отсеиваем до KDF, чтобы не считать хеши зря
+        with get_db() as conn:
+            existing = find_existing_usernames(conn, [r['username'] for r, _ in pending])
+
+        for result, _ in pending:
+            if result['username'] in existing:
+                mark_duplicate(result)
+        pending = [(r, p) for r, p in pending if r['status'] == 'created']
+
+        hashes = password_hasher.hash_many([p for _, p in pending])
+
+        with get_db() as conn:
+            # Блокировка записи сразу: проверка и вставка атомарны
+            conn.execute("BEGIN IMMEDIATE")
+
+            existing = find_existing_usernames(conn, [r['username'] for r, _ in pending])
+            created_at, created_ts = creation_stamp()
+            rows = []
+            for (result, _), password_hash in zip(pending, hashes):
+                if result['username'] in existing:
+                    mark_duplicate(result)
+                    continue
+                expires_ts = int(datetime.fromisoformat(result['expires_at']).timestamp())
+                rows.append((result['username'], password_hash, result['license_key'],
+                             result['expires_at'], expires_ts, created_at, created_ts))
+
+            conn.executemany("""
+                INSERT INTO users (username, password_hash, license_key, expires_at, expires_ts,
+                                   created_at, created_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+
+            ids = {}
+            for chunk in chunked([row[0] for row in rows]):
+                placeholders = ",".join("?" * len(chunk))
+                ids.update(conn.execute(
+                    f"SELECT username, id FROM users WHERE username IN ({placeholders})", chunk
+                ).fetchall())
+            user_cache.invalidate(conn, [row[0] for row in rows])
+            conn.commit()
+        username_filter.add([row[0] for row in rows])
+
+        for result in results:
+            if result['status'] == 'created':
+                result['id'] = ids[result['username']]
+
+        created = sum(1 for r in results if r['status'] == 'created')
+        print(f"[ADMIN] Bulk create: {created} created, {len(results) - created} skipped")
+
+        return jsonify({
+            'success': True,
+            'created': created,
+            'failed': len(results) - created,
+            'results': results
+        }), 200
+
+    except (PoolTimeout, HasherBusy) as e:
+        print(f"[BUSY] {e}")
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
     except Exception as e:
         print(f"[ERROR] {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# created_ts - только для курсора, в ответ не попадает
+USER_LIST_COLUMNS = "id, username, license_key, expires_at, is_active, created_at, created_ts"
+
+def user_time_columns(epoch):
+    """(колонка срока, колонка создания): числовые после миграции"""
+    return ('expires_ts', 'created_ts') if epoch else ('expires_at', 'created_at')
+
+def time_bound(moment, epoch):
+    """Локальное datetime -> значение для сравнения с колонкой срока"""
+    return int(moment.timestamp()) if epoch else moment.isoformat()
+
+def user_row_to_dict(row):
+    return {
+        'id': row[0],
+        'username': row[1],
+        'license_key': row[2],
+        'expires_at': row[3],
+        'is_active': bool(row[4]),
+        'created_at': row[5]
+    }
+
+def encode_cursor(created_at, user_id):
+    raw = json.dumps([created_at, user_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        created_at, user_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    return created_at, int(user_id)
+
+def cursor_created(value, epoch):
+    """Курсор, выданный до переключения на числа (или после), тоже годится:
+    created_at - это CURRENT_TIMESTAMP, то есть UTC"""
+    try:
+        if epoch and isinstance(value, str):
+            return int(datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp())
+        if not epoch and isinstance(value, int) and not isinstance(value, bool):
+            return datetime.fromtimestamp(value, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    except (ValueError, OverflowError, OSError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(value, int if epoch else str) or isinstance(value, bool):
+        raise ValueError('Invalid cursor')
+    return value
+
+def build_user_filters(data, epoch):
+    """Фильтры списка -> (WHERE часть, параметры). ValueError на кривой ввод"""
+    where = []
+    params = []
+    expires_col, _ = user_time_columns(epoch)
+    now = datetime.now()
+
+    if data.get('active') is not None:
+        where.append("is_active = ?")
+        params.append(1 if data['active'] else 0)
+
+    if data.get('expired') is not None:
+        where.append(f"{expires_col} < ?" if data['expired'] else f"{expires_col} >= ?")
+        params.append(time_bound(now, epoch))
+
+    if data.get('expiring_within_days') is not None:
+        days = int(data['expiring_within_days'])
+        if days < 0:
+            raise ValueError('expiring_within_days must be >= 0')
+        where.append(f"{expires_col} >= ? AND {expires_col} < ?")
+        params.extend([time_bound(now, epoch), time_bound(now + timedelta(days=days), epoch)])
+
+    prefix = data.get('username_prefix')
+    if prefix:
+        # Диапазон по уникальному индексу username вместо LIKE
+        where.append("username >= ? AND username < ?")
+        params.extend([prefix, prefix + '\U0010ffff'])
+
+    return where, params
+
+def stream_users_ndjson(where, params, epoch):
+    """Все подходящие пользователи построчно, память не растет с размером таблицы"""
+    _, created_col = user_time_columns(epoch)
+    sql = f"SELECT {USER_LIST_COLUMNS} FROM users"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {created_col} DESC, id DESC"
+
+    with get_db() as conn:
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(500)
+            if not rows:
+                break
+            yield ''.join(json.dumps(user_row_to_dict(row), ensure_ascii=False) + '\n' for row in rows)
+
 @app.route('/api/admin/list_users', methods=['POST'])
 def list_users():
-    """Список всех пользователей"""
+    """Список пользователей постранично (keyset) или целиком в NDJSON
+
+    Параметры: limit, cursor, active, expired, expiring_within_days,
+    username_prefix, format ("json" | "ndjson")
+    """
     try:
         data = request.get_json()
 
@@ -329,34 +1268,514 @@ def list_users():
         if admin_token != API_SECRET:
             return jsonify({'success': False, 'error': 'Unauthorized'}), 403
 
-        conn = get_db()
-        cursor = conn.cursor()
+        # Один раз на запрос: флаг может смениться посреди обработки
+        epoch = users_migration.done()
+        _, created_col = user_time_columns(epoch)
+
+        try:
+            where, params = build_user_filters(data, epoch)
+            limit = min(max(int(data.get('limit', LIST_PAGE_DEFAULT)), 1), LIST_PAGE_MAX)
+            cursor_value = data.get('cursor')
+            after = None
+            if cursor_value:
+                created, user_id = decode_cursor(cursor_value)
+                after = (cursor_created(created, epoch), user_id)
+        except (ValueError, TypeError) as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        if data.get('format') == 'ndjson':
+            return Response(
+                stream_with_context(stream_users_ndjson(where, params, epoch)),
+                mimetype='application/x-ndjson'
+            )
+
+        if after:
+            where.append(f"({created_col}, id) < (?, ?)")
+            params.extend(after)
+
+        sql = f"SELECT {USER_LIST_COLUMNS} FROM users"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {created_col} DESC, id DESC LIMIT ?"
+
+        with get_db() as conn:
+            # На одну строку больше - чтобы знать, есть ли следующая страница
+            rows = conn.execute(sql, params + [limit + 1]).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][6 if epoch else 5], rows[-1][0])
+
+        users = [user_row_to_dict(row) for row in rows]
+
+        return jsonify({'success': True, 'users': users, 'next_cursor': next_cursor}), 200
+
+    except (PoolTimeout, HasherBusy) as e:
+        print(f"[BUSY] {e}")
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        cursor.execute("""
-            SELECT id, username, license_key, expires_at, is_active, created_at
-            FROM users
-            ORDER BY created_at DESC
-        """)
-
-        users = []
-        for row in cursor.fetchall():
-            users.append({
-                'id': row[0],
-                'username': row[1],
-                'license_key': row[2],
-                'expires_at': row[3],
-                'is_active': bool(row[4]),
-                'created_at': row[5]
-            })
+def search_hit_to_dict(key, row):
+    """Строка user_search.ROW_COLUMNS -> пользователь + hwid и поле, которое совпало"""
+    user = user_row_to_dict(row[:3] + row[4:])
+    user['hwid'] = row[3]
+    user['match'] = SEARCH_FIELDS[key[1]] if key[0] < 3 else None
+    return user
+
+@app.route('/api/admin/search', methods=['POST'])
+def admin_search():
+    """Поиск по части username, license_key или hwid (от 3 символов, регистр
+    не важен). Параметры: query, limit, cursor. Сначала точные совпадения,
+    потом по началу поля, потом остальные. Триграммный индекс - без прохода по users"""
+    try:
+        data = request.get_json(silent=True) or {}
 
-        conn.close()
+        if data.get('admin_token') != API_SECRET:
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+        try:
+            query = data.get('query')
+            if not isinstance(query, str):
+                raise ValueError('query is required')
+            limit = min(max(int(data.get('limit', SEARCH_PAGE_DEFAULT)), 1), SEARCH_MAX_MATCHES)
+            after = None
+            if data.get('cursor'):
+                rank, user_id = decode_cursor(data['cursor'])
+                if (not isinstance(rank, list) or len(rank) != 3
+                        or not all(type(value) is int for value in rank)):
+                    raise ValueError('Invalid cursor')
+                after = (*rank, user_id)
+            # На одну строку больше - чтобы знать, есть ли следующая страница
+            hits, total, truncated = user_search.search(query, limit + 1, after)
+        except (ValueError, TypeError) as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        next_cursor = None
+        if len(hits) > limit:
+            hits = hits[:limit]
+            key = hits[-1][0]
+            next_cursor = encode_cursor(list(key[:3]), key[3])
+
+        return jsonify({
+            'success': True,
+            'query': query.strip(),
+            'users': [search_hit_to_dict(key, row) for key, row in hits],
+            'total': total,
+            'truncated': truncated,
+            # False - индекс еще заполняется, часть старых пользователей не найдется
+            'complete': user_search.done(),
+            'next_cursor': next_cursor
+        }), 200
+
+    except PoolTimeout as e:
+        print(f"[BUSY] {e}")
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/admin/disable_user', methods=['POST'])
+def disable_user():
+    """Отключение/включение аккаунта, отключение сразу отзывает его сессии"""
+    try:
+        data = request.get_json()
+
+        admin_token = data.get('admin_token')
+        if admin_token != API_SECRET:
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+        username = data.get('username')
+        disabled = bool(data.get('disabled', True))
+
+        if not username:
+            return jsonify({'success': False, 'error': 'Username required'}), 400
 
-        return jsonify({'success': True, 'users': users}), 200
+        with get_db() as conn:
+            cursor = conn.cursor()
 
+            cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
+            row = cursor.fetchone()
+            if not row:
+                return jsonify({'success': False, 'error': 'User not found'}), 404
+
+            user_id = row[0]
+            cursor.execute("UPDATE users SET is_active = ? WHERE id = ?",
+                           (0 if disabled else 1, user_id))
+            if disabled:
+                revocations.revoke(conn, user_id)
+            user_cache.invalidate(conn, [username])
+            conn.commit()
+
+        print(f"[ADMIN] User {'disabled' if disabled else 'enabled'}: {username} (ID: {user_id})")
+
+        return jsonify({
+            'success': True,
+            'user': {'id': user_id, 'username': username, 'is_active': not disabled}
+        }), 200
+
+    except PoolTimeout as e:
+        print(f"[BUSY] {e}")
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
     except Exception as e:
         print(f"[ERROR] {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# (время, тело ответа) последней сводки этого воркера
+stats_cache = {'at': 0.0, 'body': None}
+stats_lock = threading.Lock()
+
+def login_window_stats(conn, since):
+    total, failed = conn.execute("""
+        SELECT COUNT(*), COALESCE(SUM(success = 0), 0) FROM login_attempts
+        WHERE timestamp >= ?
+    """, (since,)).fetchone()
+    return {
+        'total': total,
+        'failed': failed,
+        'success_rate': round((total - failed) / total, 4) if total else None
+    }
+
+def collect_stats():
+    """Счетчики только по покрывающим индексам (строки users и login_attempts не читаются)"""
+    now = datetime.now()
+    epoch = users_migration.done()
+    expires_col, _ = user_time_columns(epoch)
+    now_bound = time_bound(now, epoch)
+    utc_now = datetime.now(timezone.utc)
+
+    def utc_ago(**delta):
+        return (utc_now - timedelta(**delta)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def count_users(where, *params):
+        return conn.execute(f"SELECT COUNT(*) FROM users WHERE {where}", params).fetchone()[0]
+
+    with get_db() as conn:
+        # Отдельные диапазоны по индексу быстрее одного прохода с SUM(CASE)
+        total = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        disabled = count_users("is_active = 0")
+        expired = count_users(f"is_active = 1 AND {expires_col} < ?", now_bound)
+        expiring = {
+            f"{days}d": count_users(f"is_active = 1 AND {expires_col} >= ? AND {expires_col} < ?",
+                                    now_bound, time_bound(now + timedelta(days=days), epoch))
+            for days in (1, 7, 30)
+        }
+
+        day_ago = utc_ago(days=1)
+        top_ips = conn.execute("""
+            SELECT ip_address, COUNT(*) AS failures
+            FROM login_attempts INDEXED BY idx_login_attempts_time
+            WHERE timestamp >= ? AND success = 0
+            GROUP BY ip_address ORDER BY failures DESC LIMIT ?
+        """, (day_ago, STATS_TOP_IPS)).fetchall()
+
+        return {
+            'success': True,
+            'generated_at': now.isoformat(timespec='seconds'),
+            'users': {
+                'total': total,
+                'active': total - disabled - expired,
+                'expired': expired,
+                'disabled': disabled,
+                'expiring': expiring
+            },
+            'logins': {
+                'last_hour': login_window_stats(conn, utc_ago(hours=1)),
+                'last_day': login_window_stats(conn, day_ago)
+            },
+            'top_failing_ips': [{'ip': ip, 'failures': count} for ip, count in top_ips]
+        }
+
+@app.route('/api/admin/stats', methods=['POST'])
+def admin_stats():
+    """Сводка для админа: лицензии, входы за час/сутки, топ IP с ошибками"""
+    try:
+        data = request.get_json(silent=True) or {}
+
+        if data.get('admin_token') != API_SECRET:
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+        # Один пересчет на воркер за STATS_CACHE_TTL, даже если бот жмет часто
+        with stats_lock:
+            if stats_cache['body'] is None or time.monotonic() - stats_cache['at'] >= STATS_CACHE_TTL:
+                stats_cache['body'] = collect_stats()
+                stats_cache['at'] = time.monotonic()
+            body = stats_cache['body']
+
+        return jsonify(body), 200
+
+    except PoolTimeout as e:
+        print(f"[BUSY] {e}")
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/admin/expiring', methods=['POST'])
+def admin_expiring():
+    """Активные пользователи, у которых лицензия истекает в ближайшие days дней,
+    по сроку (раньше - первыми). Параметры: days, limit, cursor.
+    Диапазон по индексу (is_active, expires_ts) - без сортировки и полного прохода"""
+    try:
+        data = request.get_json(silent=True) or {}
+
+        if data.get('admin_token') != API_SECRET:
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+        epoch = users_migration.done()
+        expires_col, _ = user_time_columns(epoch)
+        now = datetime.now()
+
+        try:
+            days = int(data.get('days', 7))
+            if days < 0:
+                raise ValueError('days must be >= 0')
+            limit = min(max(int(data.get('limit', LIST_PAGE_DEFAULT)), 1), LIST_PAGE_MAX)
+            after = None
+            if data.get('cursor'):
+                expires, user_id = decode_cursor(data['cursor'])
+                if not isinstance(expires, int if epoch else str) or isinstance(expires, bool):
+                    raise ValueError('Invalid cursor')
+                after = (expires, user_id)
+        except (ValueError, TypeError) as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        where = f"is_active = 1 AND {expires_col} >= ? AND {expires_col} < ?"
+        params = [time_bound(now, epoch), time_bound(now + timedelta(days=days), epoch)]
+
+        with get_db() as conn:
+            # Всего в окне - только на первой странице, по тому же индексу
+            total = None
+            if after is None:
+                total = conn.execute(f"SELECT COUNT(*) FROM users WHERE {where}", params).fetchone()[0]
+            else:
+                where += f" AND ({expires_col}, id) > (?, ?)"
+                params.extend(after)
+            rows = conn.execute(f"""
+                SELECT {USER_LIST_COLUMNS}, {expires_col} FROM users
+                WHERE {where} ORDER BY {expires_col}, id LIMIT ?
+            """, params + [limit + 1]).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][7], rows[-1][0])
+
+        return jsonify({
+            'success': True,
+            'generated_at': now.isoformat(timespec='seconds'),
+            'days': days,
+            'total': total,
+            'users': [user_row_to_dict(row) for row in rows],
+            'next_cursor': next_cursor
+        }), 200
+
+    except PoolTimeout as e:
+        print(f"[BUSY] {e}")
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/admin/backup', methods=['POST'])
+def admin_backup():
+    """Резервная копия БД. action: start - новая копия в фоне, verify - проверка
+    копии name (по умолчанию последней) в фоне, status - идет ли копия и список копий"""
+    try:
+        data = request.get_json(silent=True) or {}
+
+        if data.get('admin_token') != API_SECRET:
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+        action = data.get('action', 'status')
+        if action == 'start':
+            name = backup_job.start()
+            if name is None:
+                return jsonify({'success': False, 'error': 'Backup already running',
+                                **backup_job.status()}), 409
+            return jsonify({'success': True, 'name': name}), 202
+
+        if action == 'verify':
+            name = backup_job.start_verify(data.get('name'))
+            if name is None:
+                return jsonify({'success': False, 'error': 'Snapshot not found'}), 404
+            return jsonify({'success': True, 'name': name}), 202
+
+        if action != 'status':
+            return jsonify({'success': False, 'error': 'Unknown action'}), 400
+        return jsonify({'success': True, **backup_job.status()}), 200
+
+    except PoolTimeout as e:
+        print(f"[BUSY] {e}")
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus (сумма по всем воркерам)"""
+    authorized = request.headers.get('Authorization', '') == f"Bearer {API_SECRET}"
+    if request.remote_addr not in METRICS_ALLOWED_IPS and not authorized:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/pool_stats', methods=['POST'])
+def pool_stats():
+    """Счетчики пула соединений (для подбора DB_POOL_SIZE)"""
+    data = request.get_json()
+
+    if data.get('admin_token') != API_SECRET:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    return jsonify({
+        'success': True,
+        'pool': db_pool.stats(),
+        'audit': audit_writer.stats(),
+        'passwords': password_hasher.stats(),
+        'revoked_sessions': revocations.size(),
+        'user_cache': user_cache.stats(),
+        'maintenance': maintenance_job.stats(),
+        'username_filter': username_filter.stats(),
+        'search': user_search.stats(),
+        'backup': backup_job.stats(),
+        'replication': replica.stats() if replica else replication_source.stats(),
+        'profiler': profiler.stats(),
+        'rate_limit': {'ip': ip_limiter.stats(), 'user': user_limiter.stats()}
+    }), 200
+
+@app.route('/api/admin/profile', methods=['POST'])
+def admin_profile():
+    """Профиль всех воркеров узла за seconds секунд (снимок стеков раз в interval_ms)
+    в формате folded stacks: flamegraph.pl profile.folded > profile.svg.
+    idle: true - со стеками ждущих потоков. Ответ приходит, когда окно закончилось"""
+    data = request.get_json(silent=True) or {}
+
+    if data.get('admin_token') != API_SECRET:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    try:
+        seconds = float(data.get('seconds', 10))
+        interval = float(data.get('interval_ms', PROFILE_DEFAULT_INTERVAL * 1000)) / 1000
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'seconds and interval_ms must be numbers'}), 400
+
+    window = profiler.request(seconds, interval, bool(data.get('idle')))
+    if window is None:
+        return jsonify({'success': False, 'error': 'Profiling already running', **profiler.stats()}), 409
+
+    # Воркеры замечают окно за poll_interval и пишут стеки сразу после него.
+    # Event.wait, а не sleep: ждущий поток профиль считает простаивающим
+    threading.Event().wait(window['until'] - time.time() + profiler.poll_interval * 3)
+    text, workers, samples = profiler.collect(window)
+    print(f"[ADMIN] Profile {window['id']}: {workers} workers, {samples} samples")
+
+    return Response(text, mimetype='text/plain', headers={
+        'X-Rulix-Profile-Workers': str(workers),
+        'X-Rulix-Profile-Samples': str(samples),
+    })
+
+@app.route('/api/admin/slow_requests', methods=['POST'])
+def admin_slow_requests():
+    """Самые медленные запросы всех воркеров за SLOW_REQUEST_WINDOW: этапы и SQL"""
+    data = request.get_json(silent=True) or {}
+
+    if data.get('admin_token') != API_SECRET:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    try:
+        limit = min(max(int(data.get('limit', SLOW_REQUEST_LOG_SIZE)), 1), 1000)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'limit must be a number'}), 400
+
+    return jsonify({
+        'success': True,
+        'window': SLOW_REQUEST_WINDOW,
+        'requests': slow_log.collect(PROFILE_DIR, limit)
+    }), 200
+
+# ═══════════════════════════════════════════════════════════════
+# РЕПЛИКАЦИЯ (запросы реплик к primary)
+# ═══════════════════════════════════════════════════════════════
+
+def replication_denied():
+    """Ответ-ошибка, если запрос не от реплики или этот узел не primary"""
+    if request.headers.get('Authorization', '') != f"Bearer {API_SECRET}":
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    if NODE_ROLE != 'primary':
+        return jsonify({'success': False, 'error': f'Not a primary ({NODE_ROLE})'}), 409
+    return None
+
+@app.route('/api/replication/changes', methods=['POST'])
+def replication_changes():
+    """Журнал изменений после seq after (long poll до wait секунд)"""
+    denied = replication_denied()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(replication_source.changes(int(data.get('after', 0)), int(data.get('limit') or 0),
+                                                  float(data.get('wait') or 0))), 200
+    except ResyncRequired as e:
+        return jsonify({'success': False, 'error': str(e)}), 410
+    except PoolTimeout as e:
+        print(f"[BUSY] {e}")
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
+
+@app.route('/api/replication/snapshot', methods=['POST'])
+def replication_snapshot():
+    """Страница таблицы для новой реплики"""
+    denied = replication_denied()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(replication_source.snapshot(data.get('table'), int(data.get('after_id', 0)),
+                                                   int(data.get('limit') or 0))), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except PoolTimeout as e:
+        print(f"[BUSY] {e}")
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
+
+@app.route('/api/replication/login_writes', methods=['POST'])
+def replication_login_writes():
+    """Привязка HWID / перехеширование после входа на реплике"""
+    denied = replication_denied()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    try:
+        saved = save_login_writes(int(data['user_id']), data['username'], data.get('hwid'),
+                                  data.get('new_hash'), data.get('stored_hash'))
+        return jsonify({'success': True, 'saved': saved}), 200
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Missing required fields'}), 400
+    except PoolTimeout as e:
+        print(f"[BUSY] {e}")
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
+
+@app.route('/api/replication/audit', methods=['POST'])
+def replication_audit():
+    """Пачка login_attempts с реплики (уже с временем записи)"""
+    denied = replication_denied()
+    if denied:
+        return denied
+    rows = (request.get_json(silent=True) or {}).get('rows')
+    if not isinstance(rows, list) or not all(isinstance(row, list) and len(row) == 5 for row in rows):
+        return jsonify({'success': False, 'error': 'rows must be [username, success, hwid, ip, timestamp]'}), 400
+    try:
+        with get_db() as conn:
+            conn.executemany(AUDIT_INSERT_SQL, rows)
+            conn.commit()
+        return jsonify({'success': True, 'written': len(rows)}), 200
+    except PoolTimeout as e:
+        print(f"[BUSY] {e}")
+        return jsonify({'success': False, 'error': 'Server busy, try again'}), 503
+
 # ═══════════════════════════════════════════════════════════════
 # ЗАПУСК
 # ═══════════════════════════════════════════════════════════════
@@ -373,11 +1792,21 @@ if __name__ == '__main__':
     init_database()
 
     print(f"[INFO] Database: {DB_PATH}")
+    print(f"[INFO] Node role: {NODE_ROLE}" + (f", primary {PRIMARY_URL}" if replica else ""))
+    print(f"[INFO] DB pool: {DB_POOL_SIZE} connections (WAL)")
+    print(f"[INFO] Password KDF: scrypt n={password_hasher.n} r={password_hasher.r} p={password_hasher.p}")
+    print(f"[INFO] User cache: {USER_CACHE_SIZE} users, TTL {USER_CACHE_TTL}s")
+    print(f"[INFO] Audit log: batched, {AUDIT_BATCH_SIZE} rows / {AUDIT_FLUSH_INTERVAL}s")
+    print(f"[INFO] Login history: {LOGIN_ATTEMPTS_RETENTION_DAYS} days in DB, older in {LOGIN_ARCHIVE_DIR}")
+    if BACKUP_ENABLED:
+        print(f"[INFO] Backups: every {BACKUP_INTERVAL // 3600}h to {BACKUP_DIR}, keep {BACKUP_KEEP}")
     print(f"[INFO] API Secret: {'*' * len(API_SECRET)}")
     print()
-    print("[SECURITY] Rate limiting enabled")
+    print(f"[SECURITY] Rate limiting enabled ({RATE_LIMIT_BACKEND}, {MAX_ATTEMPTS}/IP, {MAX_USER_ATTEMPTS}/user per {LOCKOUT_TIME}s)")
     print("[SECURITY] HMAC signature verification enabled")
+    print(f"[SECURITY] Signed session tokens, TTL {SESSION_TOKEN_TTL}s")
     print("[ADMIN] Admin API enabled for Telegram bot")
+    print("[INFO] Prometheus metrics at /metrics")
     print()
     print("="*60)
     print()
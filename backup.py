@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Backup
+Онлайн копии rulix_auth.db без остановки сервера
+
+Копия снимается через SQLite online backup API небольшими шагами
+(pages_per_step страниц, между шагами пауза). Исходное соединение держит
+одну читающую транзакцию на всю копию: в WAL она не мешает писателям,
+а копия получается согласованной на момент начала и не начинается заново
+от чужих записей. Пока копия идет, checkpoint не может дойти до конца и
+WAL растет - после копии он догоняется обычным порядком.
+
+Результат: <backup_dir>/rulix_auth-ГГГГММДД-ЧЧММСС.db.gz и рядом .json
+(размеры, sha256, число пользователей, результат проверки). Хранятся
+последние keep копий.
+
+Проверка (verify) распаковывает копию во временный файл и делает
+PRAGMA integrity_check - в фоновом потоке с пониженным приоритетом или
+отдельным процессом на другой машине:
+    python backup.py --once
+    python backup.py --list
+    python backup.py --verify latest
+    python backup.py --verify server_data/backups/rulix_auth-20260101-000000.db.gz
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import secrets
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+from maintenance import acquire_lease, release_lease, lease_holder
+
+LEASE_NAME = "backup_lease"
+PROGRESS_NAME = "backup_progress"
+SNAPSHOT_PREFIX = "rulix_auth-"
+SNAPSHOT_SUFFIX = ".db.gz"
+CHUNK_SIZE = 1 << 20
+
+
+def lower_thread_priority(niceness=10):
+    """Потоки копии и проверки уступают CPU потокам запросов (Linux: nice на поток)"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except (AttributeError, OSError):
+        pass
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def manifest_path(snapshot):
+    return snapshot.with_name(snapshot.name[:-len(SNAPSHOT_SUFFIX)] + ".json")
+
+
+def read_manifest(snapshot):
+    try:
+        return json.loads(manifest_path(snapshot).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(snapshot, manifest):
+    path = manifest_path(snapshot)
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def verify_snapshot(snapshot, work_dir=None):
+    """Распаковка во временный файл + integrity_check.
+    -> {"ok": ..., "sha256_ok": ..., "integrity": ..., "users": ...}"""
+    snapshot = Path(snapshot)
+    manifest = read_manifest(snapshot) or {}
+    started = time.perf_counter()
+    result = {"at": datetime.now().isoformat(timespec="seconds")}
+
+    expected = manifest.get("sha256")
+    result["sha256_ok"] = file_sha256(snapshot) == expected if expected else None
+
+    work_dir = Path(work_dir or snapshot.parent)
+    tmp = work_dir / f".verify-{os.getpid()}-{secrets.token_hex(4)}.db"
+    try:
+        with gzip.open(snapshot, "rb") as src, open(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+        conn = sqlite3.connect(f"file:{tmp}?mode=ro", uri=True)
+        try:
+            problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+            result["integrity"] = "ok" if problems == ["ok"] else problems[:20]
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            result["users"] = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] \
+                if "users" in tables else None
+        finally:
+            conn.close()
+    except (OSError, EOFError, zlib.error, sqlite3.DatabaseError) as e:
+        result["integrity"] = [f"{type(e).__name__}: {e}"]
+        result["users"] = None
+    finally:
+        tmp.unlink(missing_ok=True)
+
+    result["ok"] = (result["integrity"] == "ok" and result["sha256_ok"] is not False
+                    and result["users"] is not None
+                    and manifest.get("users") in (None, result["users"]))
+    result["duration_s"] = round(time.perf_counter() - started, 2)
+
+    if manifest:
+        manifest["verified"] = result
+        write_manifest(snapshot, manifest)
+    return result
+
+
+class BackupJob:
+    """Копии по расписанию + по запросу админа
+
+    Поток стартует в каждом воркере; копию делает тот, кто взял аренду
+    backup_lease в maintenance_state, остальные видят свежий манифест
+    и ждут следующего интервала.
+    """
+
+    def __init__(self, pool, db_path, backup_dir, interval=6 * 3600, keep=14,
+                 pages_per_step=256, pause=0.01, compresslevel=3, lease_ttl=600,
+                 check_interval=60, verify_after=True):
+        self.pool = pool
+        self.db_path = Path(db_path)
+        self.backup_dir = Path(backup_dir)
+        self.interval = interval
+        self.keep = keep
+        self.pages_per_step = pages_per_step  # страниц за один шаг backup API
+        self.pause = pause                    # между шагами, сек
+        self.compresslevel = compresslevel
+        self.lease_ttl = lease_ttl            # продлевается, пока копия идет
+        self.check_interval = check_interval
+        self.verify_after = verify_after      # проверять каждую новую копию
+
+        self._owner = f"{os.getpid()}-{secrets.token_hex(4)}"
+        self._pid = None
+        self._lock = threading.Lock()
+        self._running = None        # имя копии, которую делает этот процесс
+        self._verifying = set()
+        self._progress = None
+        self._lease_renewed = 0.0
+        self._stats = {"backups": 0, "verified": 0, "last_duration": None, "last_error": None}
+
+    # ───────────────────────────────────────────────────────────
+    # Расписание
+    # ───────────────────────────────────────────────────────────
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._owner = f"{os.getpid()}-{secrets.token_hex(4)}"
+            self._running = None
+            threading.Thread(target=self._run, name="backup-scheduler", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(min(self.check_interval, self.interval))
+            try:
+                if self._due():
+                    self.start()
+            except Exception as e:
+                self._stats["last_error"] = str(e)
+                print(f"[BACKUP] Scheduler: {e}")
+
+    def _due(self):
+        latest = self.latest()
+        if latest is None:
+            return True
+        manifest = read_manifest(latest) or {}
+        return time.time() - manifest.get("finished_ts", latest.stat().st_mtime) >= self.interval
+
+    # ───────────────────────────────────────────────────────────
+    # Копия
+    # ───────────────────────────────────────────────────────────
+
+    def _claim(self):
+        """Аренда + имя новой копии, None если копия уже идет"""
+        with self._lock:
+            if self._running or not acquire_lease(self.pool, LEASE_NAME, self._owner, self.lease_ttl):
+                return None
+            self._running = SNAPSHOT_PREFIX + datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+            return self._running
+
+    def start(self):
+        """Копия в фоновом потоке -> имя снимка или None, если копия уже идет"""
+        name = self._claim()
+        if name is not None:
+            threading.Thread(target=self._run_backup, args=(name,), name="backup", daemon=True).start()
+        return name
+
+    def run_once(self):
+        """Копия в текущем потоке -> путь к ней (None - занято или ошибка)"""
+        name = self._claim()
+        return self._run_backup(name) if name is not None else None
+
+    def _run_backup(self, name):
+        lower_thread_priority()
+        snapshot = None
+        try:
+            snapshot = self.backup(name)
+            if self.verify_after:
+                self._set_progress(name, "verify")
+                self._verify(snapshot)
+        except Exception as e:
+            self._stats["last_error"] = str(e)
+            print(f"[BACKUP] {name} failed: {e}")
+        finally:
+            with self._lock:
+                self._running = None
+                self._progress = None
+            try:
+                release_lease(self.pool, LEASE_NAME, self._owner)
+                with self.pool.connection() as conn:
+                    conn.execute("DELETE FROM maintenance_state WHERE name = ?", (PROGRESS_NAME,))
+                    conn.commit()
+            except Exception as e:
+                print(f"[BACKUP] Lease release failed: {e}")
+        return snapshot
+
+    def backup(self, name):
+        """Копия -> путь к .db.gz. Вызывать под арендой"""
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        started = time.perf_counter()
+        started_at = datetime.now().isoformat(timespec="seconds")
+        raw = self.backup_dir / f".{name}.db.tmp"
+        snapshot = self.backup_dir / (name + SNAPSHOT_SUFFIX)
+        packed = snapshot.with_name(snapshot.name + ".tmp")
+
+        try:
+            steps = self._copy(name, raw)
+
+            dst = sqlite3.connect(str(raw), isolation_level=None)
+            try:
+                # Одиночный файл без -wal рядом
+                dst.execute("PRAGMA journal_mode = DELETE")
+                page_size = dst.execute("PRAGMA page_size").fetchone()[0]
+                pages = dst.execute("PRAGMA page_count").fetchone()[0]
+                users, max_id = dst.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM users").fetchone()
+            finally:
+                dst.close()
+
+            self._set_progress(name, "compress")
+            with open(raw, "rb") as src, gzip.open(packed, "wb", compresslevel=self.compresslevel) as out:
+                shutil.copyfileobj(src, out, CHUNK_SIZE)
+            with open(packed, "rb") as f:
+                os.fsync(f.fileno())
+            db_bytes = raw.stat().st_size
+            os.replace(packed, snapshot)
+        finally:
+            raw.unlink(missing_ok=True)
+            packed.unlink(missing_ok=True)
+
+        duration = round(time.perf_counter() - started, 2)
+        write_manifest(snapshot, {
+            "name": name,
+            "file": snapshot.name,
+            "started_at": started_at,
+            "finished_ts": time.time(),
+            "duration_s": duration,
+            "steps": steps,
+            "pages": pages,
+            "page_size": page_size,
+            "db_bytes": db_bytes,
+            "file_bytes": snapshot.stat().st_size,
+            "sha256": file_sha256(snapshot),
+            "users": users,
+            "max_user_id": max_id,
+            "verified": None,
+        })
+        self._stats["backups"] += 1
+        self._stats["last_duration"] = duration
+        self._stats["last_error"] = None
+        print(f"[BACKUP] {snapshot.name}: {users} users, {db_bytes // 1024} KB -> "
+              f"{snapshot.stat().st_size // 1024} KB in {duration}s ({steps} steps)")
+        self.prune()
+        return snapshot
+
+    def _copy(self, name, raw):
+        """backup API шагами по pages_per_step -> число шагов"""
+        src = sqlite3.connect(str(self.db_path), isolation_level=None, check_same_thread=False)
+        dst = sqlite3.connect(str(raw))
+        steps = 0
+
+        def progress(status, remaining, total):
+            nonlocal steps
+            steps += 1
+            self._progress = {"name": name, "stage": "copy", "pages": total - remaining, "total": total}
+            if time.monotonic() - self._lease_renewed >= 5:
+                self._set_progress(name, "copy", total - remaining, total)
+            time.sleep(self.pause)
+
+        try:
+            src.execute("PRAGMA busy_timeout = 5000")
+            # Снимок на все время копии: без него каждая чужая запись
+            # начинала бы копию сначала
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            src.backup(dst, pages=self.pages_per_step, progress=progress)
+            src.execute("COMMIT")
+        finally:
+            dst.close()
+            src.close()
+        return steps
+
+    def _set_progress(self, name, stage, pages=None, total=None):
+        """Прогресс для status() из других воркеров + продление аренды"""
+        self._progress = {"name": name, "stage": stage, "pages": pages, "total": total}
+        self._lease_renewed = time.monotonic()
+        acquire_lease(self.pool, LEASE_NAME, self._owner, self.lease_ttl)
+        with self.pool.connection() as conn:
+            conn.execute("""
+                INSERT INTO maintenance_state (name, value) VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET value = excluded.value
+            """, (PROGRESS_NAME, json.dumps(self._progress)))
+            conn.commit()
+
+    def prune(self):
+        for snapshot in self.snapshots()[self.keep:]:
+            snapshot.unlink(missing_ok=True)
+            manifest_path(snapshot).unlink(missing_ok=True)
+
+    # ───────────────────────────────────────────────────────────
+    # Проверка
+    # ───────────────────────────────────────────────────────────
+
+    def start_verify(self, name=None):
+        """Проверка копии в фоновом потоке -> имя или None, если копии нет"""
+        snapshot = self.find(name)
+        if snapshot is None:
+            return None
+        with self._lock:
+            if snapshot.name not in self._verifying:
+                self._verifying.add(snapshot.name)
+                threading.Thread(target=self._verify_thread, args=(snapshot,),
+                                 name="backup-verify", daemon=True).start()
+        return snapshot.name[:-len(SNAPSHOT_SUFFIX)]
+
+    def _verify_thread(self, snapshot):
+        lower_thread_priority()
+        try:
+            self._verify(snapshot)
+        except Exception as e:
+            self._stats["last_error"] = str(e)
+            print(f"[BACKUP] Verify {snapshot.name} failed: {e}")
+        finally:
+            with self._lock:
+                self._verifying.discard(snapshot.name)
+
+    def _verify(self, snapshot):
+        result = verify_snapshot(snapshot)
+        self._stats["verified"] += 1
+        print(f"[BACKUP] Verify {snapshot.name}: {'OK' if result['ok'] else 'FAILED'} "
+              f"(integrity {result['integrity'] if result['integrity'] == 'ok' else 'errors'}, "
+              f"{result['users']} users, {result['duration_s']}s)")
+        return result
+
+    # ───────────────────────────────────────────────────────────
+    # Список и состояние
+    # ───────────────────────────────────────────────────────────
+
+    def snapshots(self):
+        """Копии, новые первыми"""
+        if not self.backup_dir.exists():
+            return []
+        return sorted(self.backup_dir.glob(f"{SNAPSHOT_PREFIX}*{SNAPSHOT_SUFFIX}"), reverse=True)
+
+    def latest(self):
+        snapshots = self.snapshots()
+        return snapshots[0] if snapshots else None
+
+    def find(self, name=None):
+        if not name or name == "latest":
+            return self.latest()
+        name = Path(name).name
+        if not name.endswith(SNAPSHOT_SUFFIX):
+            name += SNAPSHOT_SUFFIX
+        snapshot = self.backup_dir / name
+        return snapshot if snapshot.exists() else None
+
+    def status(self, limit=5):
+        holder = lease_holder(self.pool, LEASE_NAME)
+        progress = self._progress
+        if holder and progress is None:
+            with self.pool.connection() as conn:
+                row = conn.execute("SELECT value FROM maintenance_state WHERE name = ?",
+                                   (PROGRESS_NAME,)).fetchone()
+            progress = json.loads(row[0]) if row else None
+        return {
+            "running": holder is not None,
+            "progress": progress if holder else None,
+            "verifying": sorted(self._verifying),
+            "snapshots": [read_manifest(s) or {"file": s.name} for s in self.snapshots()[:limit]],
+            "total_snapshots": len(self.snapshots()),
+        }
+
+    def stats(self):
+        result = dict(self._stats)
+        result["running"] = self._running
+        return result
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rulix database backup")
+    parser.add_argument("--once", action="store_true", help="сделать копию сейчас")
+    parser.add_argument("--list", action="store_true", help="список копий")
+    parser.add_argument("--verify", metavar="FILE", help="проверить копию (путь, имя или latest)")
+    args = parser.parse_args()
+
+    if args.verify and Path(args.verify).exists():
+        # Копия, унесенная на другую машину: настройки сервера не нужны
+        print(json.dumps(verify_snapshot(args.verify), ensure_ascii=False, indent=1))
+        raise SystemExit(0)
+
+    # Настройки и пул - те же, что у сервера
+    import auth_server as server
+
+    job = server.backup_job
+    if args.once:
+        server.init_database()
+        if job.run_once() is None:
+            raise SystemExit("[BACKUP] Backup failed or another one is running")
+    if args.verify:
+        snapshot = job.find(args.verify)
+        if snapshot is None:
+            raise SystemExit(f"[BACKUP] No snapshot {args.verify}")
+        print(json.dumps(verify_snapshot(snapshot), ensure_ascii=False, indent=1))
+    if args.list or not (args.once or args.verify):
+        for manifest in job.status(limit=job.keep)["snapshots"]:
+            verified = manifest.get("verified") or {}
+            print(f"{manifest.get('file')}  {manifest.get('users')} users  "
+                  f"{manifest.get('file_bytes', 0) // 1024} KB  "
+                  f"verified: {verified.get('ok', '-')}")
@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Auth Benchmark
+Нагрузочный тест login / create_user / list_users
+
+Примеры:
+    python bench_auth.py --users 10000
+    python bench_auth.py --users 1000000 --mode gunicorn --workers 4 --threads 8 --concurrency 64
+    python bench_auth.py --mode uvicorn --workers 4 --concurrency 512
+    python bench_auth.py --mode url --url http://10.0.0.5:5000 --workdir /srv/rulix --reuse
+    python bench_auth.py --mode gunicorn --workers 2 --replicas 2 --concurrency 64
+
+Данные создаются в --workdir (по умолчанию временная папка): сервер
+запускается с этой папкой как текущей, поэтому server_data/ у него свой.
+Результат пишется в JSON (--output), чтобы сравнивать прогоны между собой.
+
+--replicas N: сервер из --workdir запускается как primary, рядом N реплик
+(каждая в --workdir/replica-<i>, порты --port+1 ...), запросы идут на
+реплики по кругу. Замер стартует, когда все реплики свежие.
+"""
+
+import argparse
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import requests
+
+REPO_DIR = Path(__file__).resolve().parent
+
+BENCH_PASSWORD = "bench-password"
+SCENARIOS = ["login_success", "login_failed", "login_unknown", "rate_limited_flood", "create_user",
+             "list_users", "check_batch"]
+CHECK_BATCH_SIZE = 50  # мест в одном check_batch
+
+
+# ═══════════════════════════════════════════════════════════════
+# ПОДГОТОВКА БД
+# ═══════════════════════════════════════════════════════════════
+
+def seed_database(server, users, attempts_per_user, batch=50000):
+    """N пользователей + история login_attempts. Один хеш пароля на всех:
+    KDF на каждого из миллионов пользователей занял бы часы"""
+    server.init_database()
+    password_hash = server.hash_password(BENCH_PASSWORD)
+
+    conn = sqlite3.connect(str(server.DB_PATH))
+    conn.execute("PRAGMA synchronous = OFF")
+
+    existing = conn.execute("SELECT COUNT(*) FROM users WHERE username LIKE 'bench_%'").fetchone()[0]
+    if existing >= users:
+        print(f"[BENCH] Database already has {existing} bench users")
+        conn.close()
+        return
+
+    print(f"[BENCH] Seeding {users} users, {users * attempts_per_user} login attempts...")
+    started = time.perf_counter()
+    now = datetime.now()
+    rng = random.Random(42)
+
+    def user_rows():
+        for i in range(existing, users):
+            created = now - timedelta(days=rng.uniform(0, 365))
+            expires = now + timedelta(days=rng.uniform(-60, 365))
+            hwid = f"HWID-{i:08d}" if rng.random() < 0.7 else None
+            # Числовые колонки сразу, иначе триггер пересчитает каждую строку
+            yield (f"bench_{i:08d}", password_hash, f"RULIX-BENCH{i:08d}", hwid,
+                   expires.isoformat(), 1 if rng.random() < 0.95 else 0,
+                   created.strftime("%Y-%m-%d %H:%M:%S"), int(expires.timestamp()),
+                   int(created.replace(tzinfo=timezone.utc).timestamp()))
+
+    def attempt_rows():
+        for _ in range(users * attempts_per_user):
+            i = rng.randrange(users)
+            ts = datetime.utcnow() - timedelta(seconds=rng.uniform(0, 90 * 86400))
+            yield (f"bench_{i:08d}", 1 if rng.random() < 0.9 else 0, f"HWID-{i:08d}",
+                   f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}",
+                   ts.strftime("%Y-%m-%d %H:%M:%S"))
+
+    def insert(sql, rows):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= batch:
+                conn.executemany(sql, chunk)
+                conn.commit()
+                chunk = []
+        if chunk:
+            conn.executemany(sql, chunk)
+            conn.commit()
+
+    insert("""
+        INSERT INTO users (username, password_hash, license_key, hwid, expires_at, is_active, created_at,
+                           expires_ts, created_ts)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, user_rows())
+    insert("""
+        INSERT INTO login_attempts (username, success, hwid, ip_address, timestamp)
+        VALUES (?, ?, ?, ?, ?)
+    """, attempt_rows())
+
+    conn.execute("ANALYZE")
+    conn.close()
+    print(f"[BENCH] Seeded in {time.perf_counter() - started:.1f}s")
+
+
+def pick_login_users(server, count):
+    """Активные, не истекшие пользователи (с их HWID) для успешных входов"""
+    conn = sqlite3.connect(str(server.DB_PATH))
+    rows = conn.execute("""
+        SELECT username, hwid FROM users
+        WHERE username LIKE 'bench_%' AND is_active = 1 AND expires_at > ?
+        LIMIT ?
+    """, (datetime.now().isoformat(), count)).fetchall()
+    conn.close()
+    return [(username, hwid or f"HWID-{username[6:]}") for username, hwid in rows]
+
+
+# ═══════════════════════════════════════════════════════════════
+# КЛИЕНТЫ
+# ═══════════════════════════════════════════════════════════════
+
+class InProcessClient:
+    """Flask test_client, свой на каждый поток"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def post(self, path, body, ip):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post(path, json=body, environ_base={"REMOTE_ADDR": ip})
+        return response.status_code
+
+
+class HttpClient:
+    """Настоящий HTTP (gunicorn или внешний сервер). IP у всех запросов один.
+    Несколько адресов - каждый поток клиента ходит на свой, по кругу"""
+
+    def __init__(self, *base_urls):
+        self.base_urls = [url.rstrip("/") for url in base_urls]
+        self._local = threading.local()
+        self._next = itertools.count()
+
+    def post(self, path, body, ip):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            self._local.base_url = self.base_urls[next(self._next) % len(self.base_urls)]
+        return session.post(self._local.base_url + path, json=body, timeout=30).status_code
+
+
+def node_env(role, primary_url=None):
+    env = dict(os.environ, RULIX_NODE_ROLE=role)
+    if primary_url:
+        env["RULIX_PRIMARY_URL"] = primary_url
+    return env
+
+
+def start_server(mode, workdir, port, workers, threads, env=None):
+    if mode == "gunicorn":
+        return start_gunicorn(workdir, port, workers, threads, env)
+    return start_uvicorn(workdir, port, workers, env)
+
+
+def start_replicas(mode, workdir, count, port, workers, threads, primary_url, timeout=600):
+    """-> [(process, url)] когда все реплики догнали primary"""
+    env = node_env("replica", primary_url)
+    started = []
+    try:
+        for i in range(1, count + 1):
+            replica_dir = workdir / f"replica-{i}"
+            replica_dir.mkdir(exist_ok=True)
+            subprocess.run([sys.executable, "-c", "import auth_server; auth_server.init_database()"],
+                           cwd=replica_dir, env=dict(env, PYTHONPATH=str(REPO_DIR)),
+                           check=True, stdout=subprocess.DEVNULL)
+            started.append(start_server(mode, replica_dir, port + i, workers, threads, env))
+
+        begin = time.perf_counter()
+        pending = [url for _, url in started]
+        while pending:
+            if time.perf_counter() - begin > timeout:
+                raise RuntimeError(f"replicas not fresh after {timeout}s: {', '.join(pending)}")
+            # Поток применения в воркере стартует по первому запросу к нему
+            pending = [url for url in pending
+                       if not requests.get(f"{url}/api/health", timeout=5).json().get("replica_fresh")]
+            time.sleep(0.2)
+        print(f"[BENCH] {count} replicas fresh in {time.perf_counter() - begin:.1f}s")
+        return started
+    except BaseException:
+        for process, _ in started:
+            process.terminate()
+        raise
+
+
+def start_gunicorn(workdir, port, workers, threads, env=None):
+    cmd = [
+        sys.executable, "-m", "gunicorn",
+        "--chdir", str(workdir),
+        "--pythonpath", str(REPO_DIR),
+        "-k", "gthread", "-w", str(workers), "--threads", str(threads),
+        "-b", f"127.0.0.1:{port}",
+        "--log-level", "warning",
+        "auth_server:app",
+    ]
+    return wait_for_server(subprocess.Popen(cmd, env=env), port, "gunicorn")
+
+
+def start_uvicorn(workdir, port, workers, env=None):
+    cmd = [
+        sys.executable, "-m", "uvicorn",
+        "--app-dir", str(REPO_DIR),
+        "--workers", str(workers),
+        "--host", "127.0.0.1", "--port", str(port),
+        "--log-level", "warning",
+        "auth_asgi:app",
+    ]
+    return wait_for_server(subprocess.Popen(cmd, cwd=workdir, env=env), port, "uvicorn")
+
+
+def wait_for_server(process, port, name):
+    url = f"http://127.0.0.1:{port}"
+
+    for _ in range(100):
+        try:
+            if requests.get(f"{url}/api/health", timeout=1).status_code == 200:
+                return process, url
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.1)
+
+    process.terminate()
+    raise RuntimeError(f"{name} did not start")
+
+
+# ═══════════════════════════════════════════════════════════════
+# СЦЕНАРИИ
+# ═══════════════════════════════════════════════════════════════
+
+def make_scenarios(server, login_users):
+    secret = server.API_SECRET.encode()
+
+    def signed(username, password, hwid):
+        payload = f"{username}:{password}:{hwid}"
+        return {
+            "username": username,
+            "password": password,
+            "hwid": hwid,
+            "signature": hmac.new(secret, payload.encode(), hashlib.sha256).hexdigest(),
+        }
+
+    def random_ip(rng):
+        return f"172.{rng.randrange(16, 32)}.{rng.randrange(256)}.{rng.randrange(256)}"
+
+    def login_success(client, rng):
+        username, hwid = rng.choice(login_users)
+        return client.post("/api/auth/login", signed(username, BENCH_PASSWORD, hwid), random_ip(rng))
+
+    def login_failed(client, rng):
+        username, hwid = rng.choice(login_users)
+        return client.post("/api/auth/login", signed(username, "wrong-password", hwid), random_ip(rng))
+
+    def login_unknown(client, rng):
+        # Перебор по утекшей базе: логинов нет, IP каждый раз новый
+        username = f"stuffing_{rng.getrandbits(48):012x}"
+        return client.post("/api/auth/login", signed(username, "hunter2", "HWID-X"), random_ip(rng))
+
+    def rate_limited_flood(client, rng):
+        # Один IP - после MAX_ATTEMPTS почти все ответы 429
+        body = signed("bench_flood", "x", "x")
+        body["signature"] = "0" * 64
+        return client.post("/api/auth/login", body, "192.0.2.1")
+
+    def create_user(client, rng):
+        return client.post("/api/admin/create_user", {
+            "admin_token": server.API_SECRET,
+            "username": f"bench_new_{uuid.uuid4().hex[:12]}",
+            "password": "bench-new",
+            "duration_days": 30,
+        }, "127.0.0.1")
+
+    def check_batch(client, rng):
+        # Лицензия bench пользователя выводится из username (см. seed_database)
+        checks = [{"username": username, "hwid": hwid, "license_key": f"RULIX-BENCH{username[6:]}"}
+                  for username, hwid in rng.sample(login_users, min(CHECK_BATCH_SIZE, len(login_users)))]
+        timestamp = int(time.time())
+        payload = server.check_batch_payload(timestamp, checks)
+        return client.post("/api/auth/check_batch", {
+            "checks": checks,
+            "timestamp": timestamp,
+            "signature": hmac.new(secret, payload.encode(), hashlib.sha256).hexdigest(),
+        }, random_ip(rng))
+
+    def list_users(client, rng):
+        body = {"admin_token": server.API_SECRET, "limit": 50}
+        choice = rng.random()
+        if choice < 0.25:
+            body["active"] = True
+        elif choice < 0.5:
+            body["expiring_within_days"] = 7
+        elif choice < 0.75:
+            body["username_prefix"] = f"bench_{rng.randrange(100):02d}"
+        return client.post("/api/admin/list_users", body, "127.0.0.1")
+
+    return {
+        "login_success": login_success,
+        "login_failed": login_failed,
+        "login_unknown": login_unknown,
+        "rate_limited_flood": rate_limited_flood,
+        "create_user": create_user,
+        "list_users": list_users,
+        "check_batch": check_batch,
+    }
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def run_scenario(name, fn, client, total, concurrency, seed):
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker(worker_id):
+        rng = random.Random(seed * 1000 + worker_id)
+        local_latencies = []
+        local_statuses = {}
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    break
+            started = time.perf_counter()
+            try:
+                status = fn(client, rng)
+            except Exception as e:
+                status = type(e).__name__
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items()
+                 if not isinstance(status, int) or status >= 500)
+
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "errors": errors,
+        "status_counts": {str(k): v for k, v in sorted(statuses.items(), key=lambda kv: str(kv[0]))},
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else None,
+    }
+
+
+# ═══════════════════════════════════════════════════════════════
+# ЗАПУСК
+# ═══════════════════════════════════════════════════════════════
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rulix auth benchmark")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--attempts-per-user", type=int, default=5)
+    parser.add_argument("--mode", choices=["inprocess", "gunicorn", "uvicorn", "url"], default="inprocess")
+    parser.add_argument("--url", help="адрес сервера для --mode url")
+    parser.add_argument("--workers", type=int, default=4, help="воркеры gunicorn / uvicorn")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn потоки на воркер")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--replicas", type=int, default=0,
+                        help="запустить primary + N реплик и нагружать реплики (gunicorn / uvicorn)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000, help="запросов на сценарий")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--workdir", help="папка с server_data (по умолчанию временная)")
+    parser.add_argument("--reuse", action="store_true", help="использовать уже существующую БД в --workdir")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.replicas and args.mode not in ("gunicorn", "uvicorn"):
+        parser.error("--replicas requires --mode gunicorn or uvicorn")
+
+    output = Path(args.output).resolve()
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="rulix_bench_")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    # Сервер берет пути относительно текущей папки
+    os.chdir(workdir)
+    sys.path.insert(0, str(REPO_DIR))
+    if args.replicas:
+        # init_database в seed_database создаст триггеры журнала изменений
+        os.environ["RULIX_NODE_ROLE"] = "primary"
+    import auth_server as server
+
+    if server.DB_PATH.exists() and not args.reuse:
+        raise SystemExit(f"[BENCH] {workdir / server.DB_PATH} already exists, "
+                         f"pass --reuse or use an empty --workdir")
+
+    seed_database(server, args.users, args.attempts_per_user)
+    login_users = pick_login_users(server, 5000)
+    if not login_users:
+        raise SystemExit("[BENCH] No active bench users to log in with")
+
+    process = None
+    replicas = []
+    if args.mode == "inprocess":
+        client = InProcessClient(server.app)
+    elif args.mode in ("gunicorn", "uvicorn"):
+        process, url = start_server(args.mode, workdir, args.port, args.workers, args.threads,
+                                    node_env(server.NODE_ROLE))
+        if args.replicas:
+            try:
+                replicas = start_replicas(args.mode, workdir, args.replicas, args.port,
+                                          args.workers, args.threads, url)
+            except BaseException:
+                process.terminate()
+                raise
+            client = HttpClient(*[replica_url for _, replica_url in replicas])
+        else:
+            client = HttpClient(url)
+    else:
+        if not args.url:
+            parser.error("--mode url requires --url")
+        client = HttpClient(args.url)
+
+    print(f"[BENCH] Mode: {args.mode}, concurrency {args.concurrency}, {args.requests} requests per scenario")
+    functions = make_scenarios(server, login_users)
+    results = {}
+    try:
+        for i, name in enumerate(scenarios):
+            result = run_scenario(name, functions[name], client, args.requests,
+                                  args.concurrency, args.seed + i)
+            results[name] = result
+            print(f"  {name:20} {result['rps']:>9} req/s   p50 {result['p50_ms']:>8} ms   "
+                  f"p95 {result['p95_ms']:>8} ms   p99 {result['p99_ms']:>8} ms   {result['status_counts']}")
+    finally:
+        for replica_process, _ in replicas:
+            replica_process.terminate()
+            replica_process.wait(10)
+        if process:
+            process.terminate()
+            process.wait(10)
+        if args.mode == "inprocess":
+            server.audit_writer.close()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "workdir": str(workdir),
+        },
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "scenarios": results,
+    }
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"[BENCH] Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Bot API Client
+HTTP клиент бота к auth_server: keep-alive, повторы, circuit breaker
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Эти коды означают "сервер перегружен/перезапускается" - можно повторить
+RETRY_STATUSES = {502, 503, 504}
+
+
+class ApiUnavailable(requests.exceptions.ConnectionError):
+    """Сервер недоступен (circuit breaker открыт или кончились повторы)"""
+
+
+class CircuitBreaker:
+    """После threshold ошибок подряд не ходим на сервер cooldown секунд,
+    затем пропускаем один пробный запрос (half-open)"""
+
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._failures >= self.threshold:
+                if self._opened_at is None:
+                    print(f"[API] Circuit opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return "open"
+            return "half-open"
+
+
+class EndpointStats:
+    """Задержки одного эндпоинта: счетчики + последние samples для перцентилей"""
+
+    def __init__(self, samples=500):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=samples)
+
+    def snapshot(self):
+        recent = sorted(self.recent)
+
+        def pct(q):
+            return round(recent[min(len(recent) - 1, int(q * len(recent)))] * 1000, 1) if recent else None
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "retries": self.retries,
+            "avg_ms": round(self.total / self.count * 1000, 1) if self.count else None,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "max_ms": round(self.max * 1000, 1),
+        }
+
+
+class ApiClient:
+    """POST /api/admin/* с admin_token
+
+    Повторяются только idempotent вызовы (чтение): create при повторе мог бы
+    создать пользователя дважды.
+    """
+
+    def __init__(self, base_url, admin_token, timeout=(3.05, 10), retries=3,
+                 backoff=0.3, max_backoff=5.0, pool_size=10,
+                 breaker_threshold=5, breaker_cooldown=30.0):
+        self.base_url = base_url.rstrip("/")
+        self.admin_token = admin_token
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _record(self, endpoint, elapsed, error, retries):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, EndpointStats())
+            stats.count += 1
+            stats.retries += retries
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.recent.append(elapsed)
+            if error:
+                stats.errors += 1
+
+    def _sleep_backoff(self, attempt):
+        # Full jitter: случайно от 0 до экспоненты, чтобы повторы не шли волной
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def post(self, endpoint, payload=None, idempotent=False, timeout=None):
+        """-> requests.Response. ApiUnavailable если сервер недоступен"""
+        if not self.breaker.allow():
+            raise ApiUnavailable("Auth server unavailable (circuit open)")
+
+        body = {"admin_token": self.admin_token, **(payload or {})}
+        attempts = self.retries + 1 if idempotent else 1
+        started = time.perf_counter()
+
+        for attempt in range(attempts):
+            try:
+                response = self.session.post(f"{self.base_url}/{endpoint}", json=body,
+                                             timeout=timeout or self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.breaker.failure()
+                if attempt + 1 < attempts and self.breaker.allow():
+                    self._sleep_backoff(attempt)
+                    continue
+                self._record(endpoint, time.perf_counter() - started, True, attempt)
+                raise ApiUnavailable(str(e)) from e
+
+            if response.status_code in RETRY_STATUSES:
+                self.breaker.failure()
+                if attempt + 1 < attempts and self.breaker.allow():
+                    self._sleep_backoff(attempt)
+                    continue
+            else:
+                self.breaker.success()
+
+            self._record(endpoint, time.perf_counter() - started,
+                         response.status_code >= 500, attempt)
+            return response
+
+    def metrics(self):
+        with self._lock:
+            result = {name: stats.snapshot() for name, stats in self._stats.items()}
+        return {"circuit": self.breaker.state, "endpoints": result}
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Bot Outbox
+Очередь исходящих сообщений бота с учетом лимитов Telegram
+
+Telegram пропускает от бота примерно 30 сообщений/с всего, 1/с в один чат
+(короткие всплески допустимы) и 20/мин в группу, сверх этого отвечает 429 с
+retry_after. send() только ставит сообщение в очередь, отправляет его
+отдельный поток через token bucket: общий и на каждый чат. Чаты
+обслуживаются по кругу, так что длинный дайджест одному админу не
+задерживает остальных. На 429 чат замолкает на retry_after секунд, и это же
+сообщение уходит первым, порядок внутри чата сохраняется.
+
+Поток один: порядок сообщений в чате важнее скорости, а ответы на команды
+идут мимо очереди (bot.reply_to в потоках обработчиков).
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import requests
+from telebot.apihelper import ApiException, ApiTelegramException
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity про запас"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Сколько ждать до одного токена"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class Outbox:
+    def __init__(self, bot, global_rate=25.0, chat_rate=1.0, group_rate=20 / 60,
+                 chat_burst=3, max_queue=1000, max_attempts=5, error_backoff=2.0):
+        self.bot = bot
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.error_backoff = error_backoff
+
+        self._cond = threading.Condition()
+        self._pid = None
+        self._chats = OrderedDict()     # chat_id -> deque([text, kwargs, попытка]), порядок = очередь чатов
+        self._buckets = {}              # chat_id -> TokenBucket
+        self._paused_until = {}         # chat_id -> monotonic, после 429
+        self._global = TokenBucket(global_rate, global_rate, time.monotonic())
+        self._queued = 0
+        self._in_flight = 0
+        self._next_prune = 0.0
+        self._stats = {"sent": 0, "rate_limited": 0, "retried": 0, "dropped": 0, "failed": 0}
+
+    # ───────────────────────────────────────────────────────────
+    # Постановка в очередь
+    # ───────────────────────────────────────────────────────────
+
+    def send(self, chat_id, text, **kwargs):
+        """Не ждет отправки. False если очередь полна (сообщение отброшено)"""
+        self.ensure_started()
+        with self._cond:
+            if self._queued >= self.max_queue:
+                self._stats["dropped"] += 1
+                return False
+            self._chats.setdefault(chat_id, deque()).append([text, kwargs, 0])
+            self._queued += 1
+            self._cond.notify()
+        return True
+
+    def send_many(self, chat_id, texts, **kwargs):
+        """Несколько сообщений подряд в один чат -> сколько поставлено"""
+        return sum(1 for text in texts if self.send(chat_id, text, **kwargs))
+
+    def wait_idle(self, timeout=None):
+        """Дождаться, пока очередь опустеет. -> True если опустела"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queued or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 1.0)
+        return True
+
+    def stats(self):
+        with self._cond:
+            result = dict(self._stats)
+            result["queued"] = self._queued
+            result["chats"] = len(self._chats)
+            result["paused_chats"] = sum(1 for until in self._paused_until.values()
+                                         if until > time.monotonic())
+        return result
+
+    # ───────────────────────────────────────────────────────────
+    # Фоновый поток
+    # ───────────────────────────────────────────────────────────
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="bot-outbox", daemon=True).start()
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательный id - группа или канал
+            rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.chat_burst, now)
+        return bucket
+
+    def _pick(self, now):
+        """-> (chat_id, None) кому можно отправить сейчас или (None, сколько ждать)"""
+        if not self._chats:
+            return None, None
+        wait = self._global.delay(now)
+        if wait > 0:
+            return None, wait
+        wait = None
+        for chat_id in self._chats:
+            delay = max(self._paused_until.get(chat_id, 0.0) - now,
+                        self._bucket(chat_id, now).delay(now))
+            if delay <= 0:
+                return chat_id, None
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _prune(self, now):
+        """Полные ведра и истекшие паузы чатов без сообщений - как будто их нет"""
+        self._buckets = {chat_id: bucket for chat_id, bucket in self._buckets.items()
+                         if chat_id in self._chats or not bucket.full(now)}
+        self._paused_until = {chat_id: until for chat_id, until in self._paused_until.items()
+                              if until > now}
+        self._next_prune = now + 60
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if now >= self._next_prune:
+                        self._prune(now)
+                    chat_id, wait = self._pick(now)
+                    if chat_id is not None:
+                        break
+                    self._cond.wait(wait)
+
+                messages = self._chats[chat_id]
+                item = messages.popleft()
+                if messages:
+                    self._chats.move_to_end(chat_id)
+                else:
+                    del self._chats[chat_id]
+                self._global.take(now)
+                self._bucket(chat_id, now).take(now)
+                self._queued -= 1
+                self._in_flight += 1
+
+            try:
+                self._deliver(chat_id, item)
+            except Exception as e:
+                # Поток один на процесс: умри он - очередь встала бы навсегда
+                with self._cond:
+                    self._stats["failed"] += 1
+                print(f"[OUTBOX] Message to {chat_id} failed: {e!r}")
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def _deliver(self, chat_id, item):
+        text, kwargs, attempt = item
+        try:
+            self.bot.send_message(chat_id, text, **kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+                with self._cond:
+                    self._stats["rate_limited"] += 1
+                self._retry(chat_id, item, retry_after)
+            elif e.error_code >= 500:
+                self._retry(chat_id, item, self.error_backoff * (attempt + 1))
+            else:
+                # 400 (кривой текст), 403 (бот заблокирован) - повтор не поможет
+                with self._cond:
+                    self._stats["failed"] += 1
+                print(f"[OUTBOX] Message to {chat_id} rejected: {e.description}")
+        except (ApiException, requests.exceptions.RequestException) as e:
+            # ApiHTTPException / ApiInvalidJSONException: не JSON в ответе,
+            # например 502 страница прокси
+            print(f"[OUTBOX] Message to {chat_id} failed: {e}")
+            self._retry(chat_id, item, self.error_backoff * (attempt + 1))
+        else:
+            with self._cond:
+                self._stats["sent"] += 1
+
+    def _retry(self, chat_id, item, delay):
+        """То же сообщение первым в своем чате, чат молчит delay секунд"""
+        item[2] += 1
+        with self._cond:
+            if item[2] >= self.max_attempts:
+                self._stats["failed"] += 1
+                print(f"[OUTBOX] Message to {chat_id} dropped after {item[2]} attempts")
+                return
+            self._stats["retried"] += 1
+            self._chats.setdefault(chat_id, deque()).appendleft(item)
+            self._queued += 1
+            self._paused_until[chat_id] = max(self._paused_until.get(chat_id, 0.0),
+                                              time.monotonic() + delay)
+            self._cond.notify()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Bot Webhook
+Прием обновлений Telegram по webhook вместо long polling
+
+Telegram сам присылает POST с Update на публичный HTTPS адрес (nginx ->
+локальный слушатель). Слушатель отвечает сразу, а команда выполняется в
+ограниченном пуле потоков. Если пул занят, отвечаем 503 - Telegram
+доставит обновление позже. Повторную доставку того же update_id (Telegram
+повторяет, если не дождался ответа) отбрасываем.
+"""
+
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class UpdateDeduplicator:
+    """Последние max_size увиденных update_id"""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def first_seen(self, update_id):
+        with self._lock:
+            if update_id in self._seen:
+                return False
+            self._seen[update_id] = None
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return True
+
+    def forget(self, update_id):
+        """Обновление не приняли - повторная доставка должна пройти"""
+        with self._lock:
+            self._seen.pop(update_id, None)
+
+
+class WebhookServer:
+    """HTTP слушатель webhook + пул обработки команд
+
+    bot должен быть с threaded=False: обработчики выполняются прямо в
+    потоках этого пула, и пул - единственная очередь команд.
+    """
+
+    def __init__(self, bot, listen, port, path, secret_token=None, workers=8,
+                 max_pending=256, dedup_size=10000, max_body=1 << 20):
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.max_pending = max_pending
+        self.max_body = max_body
+
+        self.dedup = UpdateDeduplicator(dedup_size)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bot-webhook")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.failed = 0
+        self.handle_time = 0.0
+        self.max_handle_time = 0.0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > server.max_body:
+                    self._reply(413)
+                    return
+                body = self.rfile.read(length)
+                self._reply(server.handle(self.path, self.headers.get(SECRET_HEADER), body))
+
+            def _reply(self, status):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((listen, port), Handler)
+        self.httpd.daemon_threads = True
+
+    def handle(self, path, secret, body):
+        """Один POST от Telegram -> HTTP статус ответа"""
+        if path != self.path:
+            return 404
+        if self.secret_token and not hmac.compare_digest(secret or "", self.secret_token):
+            return 403
+        try:
+            update = types.Update.de_json(json.loads(body))
+        except (ValueError, TypeError, KeyError):
+            return 400
+
+        with self._lock:
+            if not self.dedup.first_seen(update.update_id):
+                self.duplicates += 1
+                return 200
+            # Занято - пусть Telegram повторит позже
+            if self._pending >= self.max_pending:
+                self.dedup.forget(update.update_id)
+                self.rejected += 1
+                return 503
+            self._pending += 1
+            self.received += 1
+
+        self._executor.submit(self._process, update, time.perf_counter())
+        return 200
+
+    def _process(self, update, received_at):
+        try:
+            self.bot.process_new_updates([update])
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            print(f"[WEBHOOK] Update {update.update_id} failed: {e}")
+        finally:
+            elapsed = time.perf_counter() - received_at
+            with self._lock:
+                self._pending -= 1
+                self.handle_time += elapsed
+                self.max_handle_time = max(self.max_handle_time, elapsed)
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            done = self.received - self._pending
+            return {
+                "received": self.received,
+                "pending": self._pending,
+                "duplicates": self.duplicates,
+                "rejected": self.rejected,
+                "failed": self.failed,
+                "avg_ms": round(self.handle_time / done * 1000, 1) if done else None,
+                "max_ms": round(self.max_handle_time * 1000, 1),
+            }
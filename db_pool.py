@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix DB Pool
+Потокобезопасный пул SQLite соединений (WAL)
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# ═══════════════════════════════════════════════════════════════
+# НАСТРОЙКИ ПО УМОЛЧАНИЮ
+# ═══════════════════════════════════════════════════════════════
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",      # в WAL режиме безопасно и без fsync на каждый commit
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -16000,         # ~16 MB на соединение
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+
+class PoolTimeout(Exception):
+    """Пул пуст и свободное соединение не появилось за отведенное время"""
+
+
+class ConnectionPool:
+    """Пул соединений к одному файлу БД
+
+    Соединения создаются лениво до max_size. Когда все заняты,
+    acquire() ждет не дольше timeout секунд и бросает PoolTimeout.
+    После fork (gunicorn --preload) пул сам пересоздается в дочернем процессе.
+    trace(sql) - sqlite3 trace callback для каждого соединения.
+    """
+
+    def __init__(self, db_path, max_size=8, timeout=2.0, pragmas=None,
+                 cached_statements=256, trace=None):
+        self.db_path = str(db_path)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = dict(DEFAULT_PRAGMAS, **(pragmas or {}))
+        self.cached_statements = cached_statements
+        self.trace = trace
+
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._in_use = 0
+        self._stats = {"hits": 0, "misses": 0, "waits": 0, "timeouts": 0,
+                       "wait_time": 0.0}
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.pragmas["busy_timeout"] / 1000.0,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        if self.trace is not None:
+            conn.set_trace_callback(self.trace)
+        return conn
+
+    def _check_fork(self):
+        # Соединения SQLite нельзя переносить через fork
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+    def acquire(self):
+        self._check_fork()
+
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._stats["hits"] += 1
+                self._in_use += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+                self._in_use += 1
+                self._stats["misses"] += 1
+            else:
+                self._stats["waits"] += 1
+
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                    self._in_use -= 1
+                raise
+
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout(f"No free DB connection after {self.timeout}s")
+
+        with self._lock:
+            self._stats["wait_time"] += time.perf_counter() - started
+            self._in_use += 1
+        return conn
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            # Соединение родительского процесса - просто выбрасываем
+            return
+
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    def discard(self, conn):
+        """Закрыть сломанное соединение и освободить его слот"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        if self._pid == os.getpid():
+            with self._lock:
+                self._in_use -= 1
+                self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            try:
+                self.release(conn)
+            except sqlite3.Error:
+                # rollback не прошел - соединение в неизвестном состоянии
+                self.discard(conn)
+            raise
+        self.release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+            result.update({
+                "size": self._created,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+            })
+        result["wait_time"] = round(result["wait_time"], 6)
+        return result
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Maintenance
+Обслуживание login_attempts: почасовые сводки, архив, incremental VACUUM
+
+Цикл (раз в interval секунд, в одном процессе из всех воркеров):
+    1. rollup  - новые строки login_attempts складываются в
+                 login_stats_user_hourly / login_stats_ip_hourly
+    2. archive - строки старше retention_days (уже учтенные в сводках)
+                 уходят в <archive_dir>/login_attempts/ГГГГ/ММ/<дата>_<id>.jsonl.gz
+                 и удаляются из БД
+    3. vacuum  - освободившиеся страницы возвращаются ОС небольшими шагами
+
+Каждый шаг - короткая транзакция, между ними пауза, так что вход и аудит
+ждут записи не дольше одного шага.
+
+Запуск вручную:
+    python maintenance.py --once
+    python maintenance.py --enable-incremental-vacuum   # один раз, при остановленном сервере
+"""
+
+import gzip
+import json
+import os
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+SCHEMA_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_login_attempts_user ON login_attempts (username, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_login_attempts_ip ON login_attempts (ip_address, timestamp)",
+    # Покрывающий для /api/admin/stats: счетчики за час/сутки и топ IP без чтения таблицы
+    "CREATE INDEX IF NOT EXISTS idx_login_attempts_time ON login_attempts (timestamp, success, ip_address)",
+    """
+    CREATE TABLE IF NOT EXISTS login_stats_user_hourly (
+        username TEXT NOT NULL,
+        hour TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        failures INTEGER NOT NULL,
+        PRIMARY KEY (username, hour)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS login_stats_ip_hourly (
+        ip_address TEXT NOT NULL,
+        hour TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        failures INTEGER NOT NULL,
+        PRIMARY KEY (ip_address, hour)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS maintenance_state (
+        name TEXT PRIMARY KEY,
+        value
+    )
+    """,
+)
+
+# Час в формате timestamp: "ГГГГ-ММ-ДД ЧЧ:00:00"
+HOUR_SQL = "substr(timestamp, 1, 13) || ':00:00'"
+
+ROLLUP_SQL = """
+    INSERT INTO {table} ({column}, hour, attempts, failures)
+    SELECT COALESCE({column}, ''), {hour}, COUNT(*), SUM(success = 0)
+    FROM login_attempts
+    WHERE id > ? AND id <= ?
+    GROUP BY 1, 2
+    ON CONFLICT({column}, hour) DO UPDATE SET
+        attempts = attempts + excluded.attempts,
+        failures = failures + excluded.failures
+"""
+
+ARCHIVE_COLUMNS = ("id", "username", "success", "hwid", "ip_address", "timestamp")
+
+
+def ensure_schema(conn):
+    """Индексы и таблицы сводок (вызывается из init_database)"""
+    for sql in SCHEMA_SQL:
+        conn.execute(sql)
+    conn.commit()
+
+
+def acquire_lease(pool, name, owner, ttl):
+    """Аренда строки maintenance_state: одна задача на все воркеры.
+    Хранится как "owner:до_когда", просроченную может забрать любой"""
+    now = time.time()
+    with pool.connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT value FROM maintenance_state WHERE name = ?", (name,)).fetchone()
+        if row:
+            holder, _, until = row[0].rpartition(":")
+            if holder != owner and float(until) > now:
+                conn.rollback()
+                return False
+        conn.execute("""
+            INSERT INTO maintenance_state (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = excluded.value
+        """, (name, f"{owner}:{now + ttl}"))
+        conn.commit()
+    return True
+
+
+def release_lease(pool, name, owner):
+    with pool.connection() as conn:
+        conn.execute("DELETE FROM maintenance_state WHERE name = ? AND value LIKE ? || ':%'",
+                     (name, owner))
+        conn.commit()
+
+
+def lease_holder(pool, name):
+    """-> владелец действующей аренды или None"""
+    with pool.connection() as conn:
+        row = conn.execute("SELECT value FROM maintenance_state WHERE name = ?", (name,)).fetchone()
+    if not row:
+        return None
+    holder, _, until = row[0].rpartition(":")
+    return holder if float(until) > time.time() else None
+
+
+def _utc_cutoff(days):
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class MaintenanceJob:
+    """Фоновое обслуживание login_attempts
+
+    Поток стартует в каждом воркере, но работает только владелец аренды
+    (строка lease в maintenance_state): остальные раз в interval проверяют,
+    не истекла ли она.
+    """
+
+    def __init__(self, pool, archive_dir, retention_days=30, interval=600,
+                 rollup_batch=50000, archive_batch=20000, vacuum_step=500,
+                 vacuum_min_free=1000, pause=0.05):
+        self.pool = pool
+        self.archive_dir = Path(archive_dir)
+        self.retention_days = retention_days
+        self.interval = interval
+        self.rollup_batch = rollup_batch
+        self.archive_batch = archive_batch
+        self.vacuum_step = vacuum_step          # страниц за один шаг
+        self.vacuum_min_free = vacuum_min_free  # меньше свободных страниц - не трогаем
+        self.pause = pause                      # между шагами, сек
+
+        self._owner = f"{os.getpid()}-{secrets.token_hex(4)}"
+        self._pid = None
+        self._lock = threading.Lock()
+        self._warned_vacuum = False
+        self._stats = {"runs": 0, "rolled_up": 0, "archived": 0, "archive_files": 0,
+                       "vacuumed_pages": 0, "last_run": None, "last_duration": None,
+                       "last_error": None}
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._owner = f"{os.getpid()}-{secrets.token_hex(4)}"
+            threading.Thread(target=self._run, name="maintenance", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                if self._acquire_lease():
+                    self.run_once()
+            except Exception as e:
+                self._stats["last_error"] = str(e)
+                print(f"[MAINTENANCE] Run failed: {e}")
+
+    def _acquire_lease(self):
+        # На два интервала: умерший владелец освобождает ее сам
+        return acquire_lease(self.pool, "lease", self._owner, 2 * self.interval)
+
+    # ───────────────────────────────────────────────────────────
+    # Шаги
+    # ───────────────────────────────────────────────────────────
+
+    def run_once(self):
+        started = time.perf_counter()
+        rolled_up = self.rollup()
+        archived = self.archive()
+        vacuumed = self.vacuum()
+
+        stats = self._stats
+        stats["runs"] += 1
+        stats["last_run"] = datetime.now().isoformat(timespec="seconds")
+        stats["last_duration"] = round(time.perf_counter() - started, 3)
+        stats["last_error"] = None
+        if rolled_up or archived or vacuumed:
+            print(f"[MAINTENANCE] Rolled up {rolled_up}, archived {archived}, "
+                  f"vacuumed {vacuumed} pages in {stats['last_duration']}s")
+        return {"rolled_up": rolled_up, "archived": archived, "vacuumed_pages": vacuumed}
+
+    def rollup(self):
+        """Почасовые сводки по новым строкам (по id, пачками)"""
+        total = 0
+        while True:
+            with self.pool.connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT value FROM maintenance_state WHERE name = 'rollup_last_id'"
+                ).fetchone()
+                last_id = row[0] if row else 0
+                max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM login_attempts").fetchone()[0]
+                upper = min(max_id, last_id + self.rollup_batch)
+                if upper <= last_id:
+                    conn.rollback()
+                    return total
+
+                for table, column in (("login_stats_user_hourly", "username"),
+                                      ("login_stats_ip_hourly", "ip_address")):
+                    conn.execute(ROLLUP_SQL.format(table=table, column=column, hour=HOUR_SQL),
+                                 (last_id, upper))
+                count = conn.execute(
+                    "SELECT COUNT(*) FROM login_attempts WHERE id > ? AND id <= ?", (last_id, upper)
+                ).fetchone()[0]
+                conn.execute("""
+                    INSERT INTO maintenance_state (name, value) VALUES ('rollup_last_id', ?)
+                    ON CONFLICT(name) DO UPDATE SET value = excluded.value
+                """, (upper,))
+                conn.commit()
+            total += count
+            self._stats["rolled_up"] += count
+            time.sleep(self.pause)
+
+    def archive(self):
+        """Старые строки -> gzip файлы по датам, затем DELETE
+
+        Файл называется по дате и первому id пачки и пишется целиком до
+        удаления строк: если процесс упал между ними, следующий запуск
+        выберет ту же пачку и перезапишет тот же файл.
+        """
+        cutoff = _utc_cutoff(self.retention_days)
+        total = 0
+        after_id = 0
+        while True:
+            with self.pool.connection() as conn:
+                row = conn.execute(
+                    "SELECT value FROM maintenance_state WHERE name = 'rollup_last_id'"
+                ).fetchone()
+                rolled_up_to = row[0] if row else 0
+                rows = conn.execute(f"""
+                    SELECT {', '.join(ARCHIVE_COLUMNS)} FROM login_attempts
+                    WHERE id > ? AND id <= ? AND timestamp < ?
+                    ORDER BY id LIMIT ?
+                """, (after_id, rolled_up_to, cutoff, self.archive_batch)).fetchall()
+            if not rows:
+                return total
+
+            by_date = {}
+            for item in rows:
+                by_date.setdefault(item[5][:10], []).append(item)
+            for date, items in by_date.items():
+                self._write_archive(date, items)
+
+            first_id, last_id = rows[0][0], rows[-1][0]
+            with self.pool.connection() as conn:
+                conn.execute("""
+                    DELETE FROM login_attempts
+                    WHERE id >= ? AND id <= ? AND timestamp < ?
+                """, (first_id, last_id, cutoff))
+                conn.commit()
+
+            total += len(rows)
+            self._stats["archived"] += len(rows)
+            after_id = last_id
+            time.sleep(self.pause)
+
+    def _write_archive(self, date, rows):
+        directory = self.archive_dir / "login_attempts" / date[:4] / date[5:7]
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{date}_{rows[0][0]}.jsonl.gz"
+        tmp = path.with_suffix(".tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(dict(zip(ARCHIVE_COLUMNS, row)), ensure_ascii=False))
+                f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self._stats["archive_files"] += 1
+
+    def vacuum(self):
+        """PRAGMA incremental_vacuum небольшими шагами (нужен auto_vacuum = INCREMENTAL)"""
+        total = 0
+        with self.pool.connection() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                if not self._warned_vacuum:
+                    self._warned_vacuum = True
+                    print("[MAINTENANCE] auto_vacuum is not INCREMENTAL, free pages stay in the file. "
+                          "Run: python maintenance.py --enable-incremental-vacuum")
+                return 0
+
+        while True:
+            with self.pool.connection() as conn:
+                free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if free < self.vacuum_min_free:
+                    return total
+                # execute() сделал бы один sqlite3_step - это одна страница,
+                # executescript выполняет pragma до конца
+                conn.executescript(f"PRAGMA incremental_vacuum({self.vacuum_step})")
+                freed = free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if freed <= 0:
+                return total
+            total += freed
+            self._stats["vacuumed_pages"] += freed
+            time.sleep(self.pause)
+
+    def stats(self):
+        return dict(self._stats)
+
+
+def enable_incremental_vacuum(db_path):
+    """Переключение существующей БД: нужен полный VACUUM (блокирует БД)"""
+    import sqlite3
+    conn = sqlite3.connect(str(db_path), isolation_level=None)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    started = time.perf_counter()
+    conn.execute("VACUUM")
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    conn.close()
+    print(f"[MAINTENANCE] auto_vacuum = {mode} (2 = INCREMENTAL), VACUUM took "
+          f"{time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rulix login_attempts maintenance")
+    parser.add_argument("--once", action="store_true", help="один цикл rollup/archive/vacuum")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="перевести БД на auto_vacuum=INCREMENTAL (полный VACUUM)")
+    args = parser.parse_args()
+
+    # Настройки и пул - те же, что у сервера
+    import auth_server as server
+
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum(server.DB_PATH)
+    if args.once or not args.enable_incremental_vacuum:
+        server.init_database()
+        print(server.maintenance_job.run_once())
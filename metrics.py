@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Metrics
+Счетчики, гистограммы и gauge в формате Prometheus
+
+Запись идет в шард текущего потока без блокировок. Фоновый поток каждого
+процесса раз в flush_interval сбрасывает снимок в <directory>/<pid>_<старт>.json,
+а /metrics складывает снимки всех gunicorn воркеров.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+# Снимки умерших процессов старше этого удаляются, сек
+STALE_SNAPSHOT_AGE = 24 * 3600
+
+# Границы гистограмм задержек, сек
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _Shard:
+    """Данные одного потока: пишет только он сам"""
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+class StageClock:
+    """Замер этапов одного запроса: clock.lap("select") - время с прошлой отметки"""
+    __slots__ = ("_metrics", "_name", "_last", "laps")
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+        self._last = time.perf_counter()
+        self.laps = []
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self._metrics.observe(self._name, elapsed, stage=stage)
+        self.laps.append((stage, elapsed))
+
+    def skip(self):
+        """Пропустить время с прошлой отметки (не относится ни к одному этапу)"""
+        self._last = time.perf_counter()
+
+
+class _Timer:
+    __slots__ = ("_metrics", "_name", "_labels", "_started")
+
+    def __init__(self, metrics, name, labels):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._metrics.observe(self._name, time.perf_counter() - self._started, **self._labels)
+
+
+class Metrics:
+    def __init__(self, directory=None, flush_interval=2.0, buckets=DEFAULT_BUCKETS):
+        self.directory = Path(directory) if directory else None
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+
+        self._meta = {}          # имя -> (тип, описание)
+        self._gauges = {}        # имя -> функция () -> число или {labels: число}
+        self._label_cache = {}
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        self._pid = None
+        self._started_at = None
+
+    # ───────────────────────────────────────────────────────────
+    # Объявление
+    # ───────────────────────────────────────────────────────────
+
+    def counter(self, name, help_text):
+        self._meta[name] = ("counter", help_text)
+
+    def histogram(self, name, help_text):
+        self._meta[name] = ("histogram", help_text)
+
+    def gauge(self, name, help_text, callback):
+        """callback вызывается при сбросе снимка, возвращает число
+        или dict {(("label", "value"), ...): число}"""
+        self._meta[name] = ("gauge", help_text)
+        self._gauges[name] = callback
+
+    # ───────────────────────────────────────────────────────────
+    # Горячий путь
+    # ───────────────────────────────────────────────────────────
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None or self._pid != os.getpid():
+            shard = self._new_shard()
+        return shard
+
+    def _new_shard(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # После fork шарды и поток сброса родителя не наши
+                self._shards = []
+                self._pid = os.getpid()
+                self._started_at = time.time()
+                if self.directory:
+                    threading.Thread(target=self._flush_loop, name="metrics-flush",
+                                     daemon=True).start()
+            shard = _Shard()
+            self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _labels(self, labels):
+        if not labels:
+            return ""
+        key = tuple(sorted(labels.items()))
+        rendered = self._label_cache.get(key)
+        if rendered is None:
+            rendered = ",".join(f'{k}="{v}"' for k, v in key)
+            self._label_cache[key] = rendered
+        return rendered
+
+    def inc(self, name, value=1, **labels):
+        counters = self._shard().counters
+        key = (name, self._labels(labels))
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        histograms = self._shard().histograms
+        key = (name, self._labels(labels))
+        hist = histograms.get(key)
+        if hist is None:
+            # [счетчики по корзинам..., +Inf, сумма]
+            hist = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                hist[i] += 1
+                break
+        else:
+            hist[len(self.buckets)] += 1
+        hist[-1] += seconds
+
+    def timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    def stage_clock(self, name):
+        return StageClock(self, name)
+
+    # ───────────────────────────────────────────────────────────
+    # Снимки
+    # ───────────────────────────────────────────────────────────
+
+    def snapshot(self):
+        """Данные этого процесса в виде, пригодном для JSON"""
+        self._shard()
+        counters = {}
+        histograms = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for (name, labels), value in dict(shard.counters).items():
+                key = f"{name}|{labels}"
+                counters[key] = counters.get(key, 0) + value
+            for (name, labels), hist in dict(shard.histograms).items():
+                key = f"{name}|{labels}"
+                merged = histograms.setdefault(key, [0] * len(hist))
+                for i, value in enumerate(list(hist)):
+                    merged[i] += value
+
+        gauges = {}
+        for name, callback in self._gauges.items():
+            try:
+                value = callback()
+            except Exception as e:
+                print(f"[METRICS] Gauge {name} failed: {e}")
+                continue
+            if isinstance(value, dict):
+                for labels, item in value.items():
+                    gauges[f"{name}|{self._labels(dict(labels))}"] = item
+            else:
+                gauges[f"{name}|"] = value
+
+        return {"pid": os.getpid(), "started_at": self._started_at, "written_at": time.time(),
+                "counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def _flush_loop(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[METRICS] Flush failed: {e}")
+            time.sleep(self.flush_interval)
+
+    def flush(self):
+        snapshot = self.snapshot()
+        path = self.directory / f"{snapshot['pid']}_{int(snapshot['started_at'])}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(snapshot))
+        os.replace(tmp, path)
+
+    def _collect(self):
+        """Снимки всех процессов (свой - свежий, остальные - из файлов)"""
+        own = self.snapshot()
+        snapshots = [own]
+        if not self.directory or not self.directory.exists():
+            return snapshots
+
+        for path in self.directory.glob("*.json"):
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            if data["pid"] == own["pid"]:
+                continue
+            if not _pid_alive(data["pid"]):
+                if data["written_at"] < time.time() - STALE_SNAPSHOT_AGE:
+                    path.unlink(missing_ok=True)
+                    continue
+                # Счетчики умершего воркера продолжают входить в сумму,
+                # а его gauge уже не актуальны
+                data["gauges"] = {}
+            snapshots.append(data)
+        return snapshots
+
+    # ───────────────────────────────────────────────────────────
+    # Формат Prometheus
+    # ───────────────────────────────────────────────────────────
+
+    def render(self):
+        counters = {}
+        histograms = {}
+        gauges = {}
+        for data in self._collect():
+            for key, value in data["counters"].items():
+                counters[key] = counters.get(key, 0) + value
+            for key, hist in data["histograms"].items():
+                merged = histograms.setdefault(key, [0] * len(hist))
+                for i, value in enumerate(hist):
+                    merged[i] += value
+            for key, value in data["gauges"].items():
+                name, labels = key.split("|", 1)
+                pid_label = f'pid="{data["pid"]}"'
+                gauges[f"{name}|{labels + ',' if labels else ''}{pid_label}"] = value
+
+        lines = []
+        for name, (kind, help_text) in sorted(self._meta.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            if kind == "counter":
+                for key, value in sorted(counters.items()):
+                    metric, labels = key.split("|", 1)
+                    if metric == name:
+                        lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+            elif kind == "gauge":
+                for key, value in sorted(gauges.items()):
+                    metric, labels = key.split("|", 1)
+                    if metric == name:
+                        lines.append(f"{name}{{{labels}}} {value}")
+
+            else:
+                for key, hist in sorted(histograms.items()):
+                    metric, labels = key.split("|", 1)
+                    if metric != name:
+                        continue
+                    prefix = labels + "," if labels else ""
+                    cumulative = 0
+                    for bound, count in zip(self.buckets, hist):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                    cumulative += hist[len(self.buckets)]
+                    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+                    suffix = f"{{{labels}}}" if labels else ""
+                    lines.append(f"{name}_sum{suffix} {hist[-1]}")
+                    lines.append(f"{name}_count{suffix} {cumulative}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Passwords
+Хеширование паролей scrypt + кеш успешных проверок
+
+Формат хеша в users.password_hash:
+    scrypt$<n>$<r>$<p>$<salt b64>$<hash b64>
+Старые строки - 64 hex символа (sha256 без соли), перехешируются при входе.
+
+Бенчмарк:
+    python passwords.py [секунд на набор параметров]
+"""
+
+import base64
+import hashlib
+import heapq
+import hmac
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+SCHEME = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+# Наборы параметров (n, r, p). Память на хеш = 128 * r * n байт
+PARAM_SETS = {
+    "interactive": (2 ** 14, 8, 1),   # 16 MB
+    "default": (2 ** 15, 8, 1),       # 32 MB
+    "strong": (2 ** 16, 8, 1),        # 64 MB
+}
+
+
+class HasherBusy(Exception):
+    """Слишком много KDF задач в очереди"""
+
+
+def _b64encode(raw):
+    return base64.b64encode(raw).decode().rstrip("=")
+
+
+def _b64decode(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _is_legacy(stored):
+    return len(stored) == 64 and all(c in "0123456789abcdef" for c in stored)
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * r * n, dklen=KEY_BYTES
+    )
+
+
+def make_hash(password, n, r, p):
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _scrypt(password, salt, n, r, p)
+    return f"{SCHEME}${n}${r}${p}${_b64encode(salt)}${_b64encode(digest)}"
+
+
+def check_hash(password, stored):
+    """Проверка пароля против хеша любой версии -> (ok, (n, r, p) или None)"""
+    if _is_legacy(stored):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored), None
+
+    try:
+        scheme, n, r, p, salt, digest = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+    except ValueError:
+        return False, None
+    if scheme != SCHEME:
+        return False, None
+
+    candidate = _scrypt(password, _b64decode(salt), n, r, p)
+    return hmac.compare_digest(candidate, _b64decode(digest)), (n, r, p)
+
+
+# ═══════════════════════════════════════════════════════════════
+# КЕШ ПРОВЕРОК
+# ═══════════════════════════════════════════════════════════════
+
+class VerificationCache:
+    """LRU с TTL для недавно успешных проверок (только положительные)
+
+    Ключ - HMAC от (username, пароль, хранимый хеш): сам пароль в памяти
+    не хранится, а смена хеша в БД автоматически делает запись бесполезной.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._key = secrets.token_bytes(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, username, password, stored):
+        msg = "\0".join((username, password, stored)).encode()
+        return hmac.new(self._key, msg, hashlib.sha256).digest()
+
+    def contains(self, username, password, stored):
+        key = self._digest(username, password, stored)
+        now = time.monotonic()
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is not None and expires > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True
+            if expires is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False
+
+    def add(self, username, password, stored):
+        key = self._digest(username, password, stored)
+        with self._lock:
+            self._entries[key] = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits,
+                    "misses": self.misses}
+
+
+# ═══════════════════════════════════════════════════════════════
+# ХЕШЕР
+# ═══════════════════════════════════════════════════════════════
+
+class _DelayedResults:
+    """Future с результатом через delay секунд - один поток на все ожидания"""
+
+    def __init__(self):
+        self._heap = []
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._heap = []
+            threading.Thread(target=self._run, name="kdf-delay", daemon=True).start()
+
+    def submit(self, delay, result):
+        self._ensure_started()
+        future = Future()
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._seq, future, result))
+            self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, future, result = heapq.heappop(self._heap)
+            future.set_result(result)
+
+
+class PasswordHasher:
+    """scrypt с пулом потоков (hashlib.scrypt отпускает GIL)
+
+    max_pending ограничивает число KDF задач в работе и в очереди,
+    при переполнении бросается HasherBusy вместо роста задержки.
+    """
+
+    def __init__(self, params=PARAM_SETS["default"], workers=4, max_pending=64,
+                 timeout=10.0, cache_size=10000, cache_ttl=300):
+        self.n, self.r, self.p = params
+        self.timeout = timeout
+        self.cache = VerificationCache(cache_size, cache_ttl) if cache_size else None
+
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="kdf")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        # Фиктивный хеш для несуществующих пользователей: время ответа
+        # не должно выдавать, есть такой логин или нет
+        self._dummy = make_hash(secrets.token_urlsafe(16), self.n, self.r, self.p)
+
+        # Отказ без KDF ждет столько, сколько сейчас шла бы проверка:
+        # процессорное время одного KDF (EWMA, начальное - замер при старте)
+        # на все задачи впереди, деленное на число ядер, что их считают
+        self._parallel = max(1, min(workers, os.cpu_count() or 1))
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        started = time.thread_time()
+        check_hash(secrets.token_urlsafe(8), self._dummy)
+        self._kdf_time = time.thread_time() - started
+        self._delayed = _DelayedResults()
+
+    def _submit(self, fn, *args):
+        """-> concurrent.futures.Future (async режим ждет его без потока)"""
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many pending password hash jobs")
+        try:
+            future = self._executor.submit(self._timed, fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        self._track(future)
+        return future
+
+    def _track(self, future):
+        with self._lock:
+            self._in_flight += 1
+
+        def done(_):
+            self._slots.release()
+            with self._lock:
+                self._in_flight -= 1
+
+        future.add_done_callback(done)
+
+    def _timed(self, fn, *args):
+        # Время процессора потока, а не по часам: от соседних задач не растет
+        started = time.thread_time()
+        try:
+            return fn(*args)
+        finally:
+            self._kdf_time += (time.thread_time() - started - self._kdf_time) * 0.05
+
+    def _run(self, fn, *args):
+        return self._submit(fn, *args).result(self.timeout)
+
+    def expected_verify_time(self):
+        """Сколько заняла бы проверка, поставленная сейчас"""
+        with self._lock:
+            queued = self._in_flight
+        return self._kdf_time * max(1.0, (queued + 1) / self._parallel)
+
+    def hash(self, password):
+        return self._run(make_hash, password, self.n, self.r, self.p)
+
+    def hash_many(self, passwords):
+        """Пачка хешей (массовое создание): ждет свободные слоты, а не падает"""
+        futures = []
+        for password in passwords:
+            if not self._slots.acquire(timeout=self.timeout):
+                raise HasherBusy("Too many pending password hash jobs")
+            future = self._executor.submit(self._timed, make_hash, password, self.n, self.r, self.p)
+            self._track(future)
+            futures.append(future)
+        return [future.result(self.timeout) for future in futures]
+
+    def submit_verify(self, username, password, stored):
+        """-> Future[(ok, needs_rehash)]"""
+        if self.cache and self.cache.contains(username, password, stored):
+            future = Future()
+            future.set_result((True, False))
+            return future
+
+        outer = Future()
+
+        def done(inner):
+            try:
+                ok, params = inner.result()
+            except BaseException as e:
+                outer.set_exception(e)
+                return
+            if ok and self.cache:
+                self.cache.add(username, password, stored)
+            outer.set_result((ok, ok and params != (self.n, self.r, self.p)))
+
+        self._submit(check_hash, password, stored).add_done_callback(done)
+        return outer
+
+    def verify(self, username, password, stored):
+        """-> (ok, needs_rehash)"""
+        return self.submit_verify(username, password, stored).result(self.timeout)
+
+    def remember(self, username, password, stored):
+        """Положить в кеш только что записанный хеш (после перехеширования)"""
+        if self.cache:
+            self.cache.add(username, password, stored)
+
+    def submit_dummy_verify(self, password):
+        """Та же работа что и verify() для неизвестного пользователя -> Future[(False, False)]"""
+        outer = Future()
+
+        def done(inner):
+            exc = inner.exception()
+            if exc is not None:
+                outer.set_exception(exc)
+            else:
+                outer.set_result((False, False))
+
+        self._submit(check_hash, password, self._dummy).add_done_callback(done)
+        return outer
+
+    def submit_delayed_reject(self):
+        """Отказ без KDF (логин точно не существует) -> Future[(False, False)]
+        через время, которое заняла бы проверка (+-10%), чтобы время не выдавало ответ"""
+        delay = self.expected_verify_time() * (0.9 + secrets.randbelow(2001) / 10000)
+        return self._delayed.submit(delay, (False, False))
+
+    def dummy_verify(self, password):
+        self.submit_dummy_verify(password).result(self.timeout)
+        return False
+
+    def stats(self):
+        result = {"params": {"n": self.n, "r": self.r, "p": self.p},
+                  "kdf_ms": round(self._kdf_time * 1000, 1),
+                  "in_flight": self._in_flight}
+        if self.cache:
+            result["cache"] = self.cache.stats()
+        return result
+
+
+# ═══════════════════════════════════════════════════════════════
+# БЕНЧМАРК
+# ═══════════════════════════════════════════════════════════════
+
+def benchmark(seconds=2.0):
+    """Входов в секунду на одно ядро для каждого набора параметров"""
+    password = "benchmark-password"
+    results = {}
+
+    for name, (n, r, p) in PARAM_SETS.items():
+        stored = make_hash(password, n, r, p)
+        count = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            check_hash(password, stored)
+            count += 1
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            "n": n, "r": r, "p": p,
+            "memory_mb": 128 * r * n // (1024 * 1024),
+            "ms_per_login": round(elapsed / count * 1000, 2),
+            "logins_per_sec_per_core": round(count / elapsed, 1),
+        }
+
+    cache = VerificationCache()
+    cache.add("user", password, "stored")
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        cache.contains("user", password, "stored")
+        count += 1
+    elapsed = time.perf_counter() - started
+    results["cache_hit"] = {
+        "ms_per_login": round(elapsed / count * 1000, 4),
+        "logins_per_sec_per_core": round(count / elapsed, 1),
+    }
+    return results
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+
+    print(f"[BENCH] scrypt, {seconds}s per parameter set, single thread")
+    print()
+    for name, row in benchmark(seconds).items():
+        params = f"n={row['n']} r={row['r']} p={row['p']} ({row['memory_mb']} MB)" if "n" in row else "verification cache hit"
+        print(f"  {name:12} {params:32} {row['ms_per_login']:>9} ms  "
+              f"{row['logins_per_sec_per_core']:>10} logins/s/core")
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Profiler
+Профилирование по запросу и журнал самых медленных запросов
+
+SamplingProfiler: админ пишет в <directory>/control.json окно (до какого
+времени и с каким шагом). Поток-наблюдатель каждого воркера раз в
+poll_interval смотрит только mtime этого файла, так что без профилирования
+цена - один stat() в полсекунды. Во время окна тот же поток раз в шаг
+снимает стеки всех потоков через sys._current_frames() и в конце пишет
+<id>.<pid>.folded. Склеенные файлы всех воркеров - формат "стек;стек N",
+который понимают flamegraph.pl, speedscope и inferno.
+
+SlowRequestLog: на каждый запрос - объект с началом и списком SQL (трейс
+соединений пула пишет в него через contextvar), в конце - одно сравнение
+с самым быстрым из уже сохраненных. Хранятся size самых медленных за
+последние window секунд. Наблюдатель сбрасывает их в slow.<pid>.json, чтобы
+любой воркер мог отдать общий список.
+"""
+
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+# Запрос, который сейчас обрабатывается в этом контексте (поток или задача asyncio)
+current_trace = contextvars.ContextVar("rulix_request_trace", default=None)
+
+# Строковые и blob литералы в SQL из трейса: там хеши паролей, HWID, ключи
+SQL_LITERAL_RE = re.compile(r"[xX]?'(?:[^']|'')*'")
+
+# Лист стека, на котором поток ничего не делает, а ждет. Еще простаивает
+# фоновый поток, у которого лист - сама функция потока: она в time.sleep
+# или другом C вызове между итерациями своего цикла
+IDLE_FRAMES = {
+    "threading.py:wait", "threading.py:_wait_for_tstate_lock", "queue.py:get",
+    "selectors.py:select", "socket.py:accept", "thread.py:_worker",
+    "socketserver.py:serve_forever", "connection.py:_recv",
+}
+
+SNAPSHOT_MAX_AGE = 120        # сек, снимок старше - воркер умер (окно профиля до 60 с)
+PROFILE_FILES_MAX_AGE = 86400
+
+
+def _write_atomic(path, text):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+class RequestTrace:
+    __slots__ = ("endpoint", "started", "stages", "sql", "sql_dropped")
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = None
+        self.sql = []
+        self.sql_dropped = 0
+
+
+class SlowRequestLog:
+    def __init__(self, size=50, window=900, max_sql=50, exclude=()):
+        self.size = size
+        self.window = window
+        self.max_sql = max_sql
+        self.exclude = set(exclude)
+
+        self._heap = []             # (длительность, порядковый, запись), сверху самый быстрый
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._floor = 0.0           # быстрее этого в полный журнал не попасть...
+        self._floor_until = 0.0     # ...пока не устареет самая старая запись
+        self.version = 0            # меняется при каждом изменении (для сброса на диск)
+
+    # ───────────────────────────────────────────────────────────
+    # Горячий путь
+    # ───────────────────────────────────────────────────────────
+
+    def begin(self, endpoint):
+        if not self.size or endpoint in self.exclude:
+            return None
+        trace = RequestTrace(endpoint)
+        current_trace.set(trace)
+        return trace
+
+    def attach_stages(self, laps):
+        """Этапы запроса: список (этап, сек) из StageClock, дополняется по ходу"""
+        trace = current_trace.get()
+        if trace is not None:
+            trace.stages = laps
+
+    def trace_sql(self, statement):
+        """sqlite3 set_trace_callback для соединений пула"""
+        trace = current_trace.get()
+        if trace is None:
+            return
+        if len(trace.sql) < self.max_sql:
+            trace.sql.append((time.perf_counter(), statement))
+        else:
+            trace.sql_dropped += 1
+
+    def finish(self, trace, status):
+        if trace is None:
+            return
+        current_trace.set(None)
+        duration = time.perf_counter() - trace.started
+        if duration <= self._floor and time.time() < self._floor_until:
+            return
+
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            if len(self._heap) >= self.size and duration <= self._heap[0][0]:
+                self._update_floor()
+                return
+            entry = (duration, next(self._seq), self._record(trace, status, duration, now))
+            if len(self._heap) >= self.size:
+                heapq.heapreplace(self._heap, entry)
+            else:
+                heapq.heappush(self._heap, entry)
+            self._update_floor()
+            self.version += 1
+
+    def _record(self, trace, status, duration, now):
+        # Разбор только для тех, кто попал в журнал
+        return {
+            "at": datetime.fromtimestamp(now - duration).isoformat(timespec="milliseconds"),
+            "pid": os.getpid(),
+            "endpoint": trace.endpoint,
+            "status": status,
+            "duration_ms": round(duration * 1000, 2),
+            "stages": [[stage, round(elapsed * 1000, 2)] for stage, elapsed in trace.stages or ()],
+            "sql": [[round((at - trace.started) * 1000, 2), SQL_LITERAL_RE.sub("?", " ".join(statement.split()))]
+                    for at, statement in trace.sql],
+            "sql_dropped": trace.sql_dropped,
+            "_expires": now + self.window,
+        }
+
+    def _expire(self, now):
+        if any(entry[2]["_expires"] <= now for entry in self._heap):
+            self._heap = [entry for entry in self._heap if entry[2]["_expires"] > now]
+            heapq.heapify(self._heap)
+            self.version += 1
+
+    def _update_floor(self):
+        if len(self._heap) >= self.size:
+            self._floor = self._heap[0][0]
+            self._floor_until = min(entry[2]["_expires"] for entry in self._heap)
+        else:
+            self._floor = 0.0
+
+    # ───────────────────────────────────────────────────────────
+    # Чтение
+    # ───────────────────────────────────────────────────────────
+
+    def records(self):
+        """Записи этого процесса, самые медленные первыми"""
+        with self._lock:
+            self._expire(time.time())
+            entries = sorted(self._heap, reverse=True)
+        return [{k: v for k, v in record.items() if k != "_expires"} for _, _, record in entries]
+
+    def write_snapshot(self, directory):
+        directory.mkdir(parents=True, exist_ok=True)
+        _write_atomic(directory / f"slow.{os.getpid()}.json", json.dumps(self.records()))
+
+    def collect(self, directory, limit=None):
+        """Записи всех живых воркеров (по их снимкам) + свежие свои"""
+        records = self.records()
+        now = time.time()
+        for path in Path(directory).glob("slow.*.json"):
+            try:
+                if path.name == f"slow.{os.getpid()}.json" or now - path.stat().st_mtime > SNAPSHOT_MAX_AGE:
+                    continue
+                records.extend(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue
+        records.sort(key=lambda record: record["duration_ms"], reverse=True)
+        return records[:limit or self.size]
+
+
+class SamplingProfiler:
+    def __init__(self, directory, slow_log=None, poll_interval=0.5, snapshot_interval=5.0,
+                 max_duration=60, min_interval=0.001):
+        self.directory = Path(directory)
+        self.slow_log = slow_log
+        self.poll_interval = poll_interval
+        self.snapshot_interval = snapshot_interval
+        self.max_duration = max_duration
+        self.min_interval = min_interval
+
+        self._pid = None
+        self._lock = threading.Lock()
+        self._labels = {}           # code -> "файл:функция"
+        self._done = set()          # id окон, уже снятых этим процессом
+        self.last_error = None
+
+    @property
+    def control_path(self):
+        return self.directory / "control.json"
+
+    # ───────────────────────────────────────────────────────────
+    # Управление (админский запрос)
+    # ───────────────────────────────────────────────────────────
+
+    def request(self, seconds, interval, idle=False):
+        """Окно профилирования для всех воркеров -> dict окна или None, если уже идет.
+        idle=True - оставить и стеки ждущих потоков"""
+        seconds = min(max(float(seconds), 0.1), self.max_duration)
+        interval = max(float(interval), self.min_interval)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            current = self._read_control()
+            if current and current["until"] > time.time():
+                return None
+            self._cleanup()
+            window = {"id": f"{int(time.time())}-{os.getpid()}", "until": time.time() + seconds,
+                      "interval": interval, "idle": bool(idle)}
+            _write_atomic(self.control_path, json.dumps(window))
+        return window
+
+    def collect(self, window):
+        """Склеить стеки всех воркеров -> (текст folded, воркеров, снимков)"""
+        counts = Counter()
+        workers = samples = 0
+        for path in self.directory.glob(f"{window['id']}.*.folded"):
+            try:
+                lines = path.read_text().splitlines()
+            except OSError:
+                continue
+            workers += 1
+            for line in lines:
+                if line.startswith("# samples "):
+                    samples += int(line.split()[2])
+                    continue
+                stack, _, count = line.rpartition(" ")
+                if stack:
+                    counts[stack] += int(count)
+        text = "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+        return text, workers, samples
+
+    def _read_control(self):
+        try:
+            return json.loads(self.control_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _cleanup(self):
+        now = time.time()
+        for path in self.directory.glob("*.folded"):
+            try:
+                if now - path.stat().st_mtime > PROFILE_FILES_MAX_AGE:
+                    path.unlink()
+            except OSError:
+                pass
+
+    # ───────────────────────────────────────────────────────────
+    # Наблюдатель и сэмплер (в каждом воркере)
+    # ───────────────────────────────────────────────────────────
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._done = set()
+            threading.Thread(target=self._run, name="profiler", daemon=True).start()
+
+    def _run(self):
+        seen_mtime = None
+        next_snapshot = 0.0
+        written_version = None
+        written_at = 0.0
+        while True:
+            try:
+                try:
+                    mtime = self.control_path.stat().st_mtime
+                except FileNotFoundError:
+                    mtime = None
+                if mtime != seen_mtime:
+                    seen_mtime = mtime
+                    window = self._read_control()
+                    if window and window["id"] not in self._done and window["until"] > time.time():
+                        self._done.add(window["id"])
+                        self._profile(window)
+
+                # Снимок журнала медленных: не чаще snapshot_interval, при изменении
+                # или когда mtime пора обновить ("воркер жив")
+                now = time.monotonic()
+                if self.slow_log is not None and self.slow_log.size and now >= next_snapshot:
+                    if self.slow_log.version != written_version or now - written_at >= SNAPSHOT_MAX_AGE / 4:
+                        written_version = self.slow_log.version
+                        written_at = now
+                        self.slow_log.write_snapshot(self.directory)
+                    next_snapshot = now + self.snapshot_interval
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[PROFILER] {e}")
+            time.sleep(self.poll_interval)
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+        return label
+
+    def _profile(self, window):
+        me = threading.get_ident()
+        counts = Counter()
+        names = {}
+        samples = 0
+        interval = window["interval"]
+        keep_idle = window.get("idle", False)
+        print(f"[PROFILER] Sampling every {interval * 1000:.1f}ms until "
+              f"{datetime.fromtimestamp(window['until']).isoformat(timespec='seconds')}")
+
+        while time.time() < window["until"]:
+            if samples % 100 == 0:
+                # Имена потоков без номеров: одинаковые пулы в разных воркерах склеиваются
+                names = {thread.ident: re.sub(r"\d+", "N", thread.name) for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                if not keep_idle and (stack[0] in IDLE_FRAMES or
+                                      (len(stack) > 1 and stack[1] == "threading.py:run")):
+                    continue
+                stack.append(names.get(ident, "thread"))
+                counts[";".join(reversed(stack))] += 1
+            samples += 1
+            time.sleep(interval)
+
+        lines = [f"# samples {samples}"] + [f"{stack} {count}" for stack, count in counts.items()]
+        _write_atomic(self.directory / f"{window['id']}.{os.getpid()}.folded", "\n".join(lines) + "\n")
+        print(f"[PROFILER] {samples} samples, {len(counts)} distinct stacks")
+
+    def stats(self):
+        window = self._read_control()
+        return {
+            "running": bool(window and window["until"] > time.time()),
+            "window": window,
+            "last_error": self.last_error,
+        }
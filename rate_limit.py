@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Rate Limit
+Скользящее окно (sliding window counter) с вытеснением по TTL/LRU
+
+На каждый ключ хранится только (начало окна, счетчик текущего окна,
+счетчик прошлого окна, время последнего обращения) - O(1) памяти.
+Оценка числа попыток за последние window секунд:
+    prev * (1 - доля прошедшего текущего окна) + curr
+
+Бэкенды:
+    MemoryBackend - в памяти процесса
+    SQLiteBackend - отдельный файл SQLite, общий для всех gunicorn воркеров
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryBackend:
+    """Состояние в памяти процесса (LRU с жестким лимитом записей)"""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def hit(self, key, window_start, window, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = (window_start, 1, 0, now)
+            else:
+                start, curr, prev, _ = entry
+                if start == window_start:
+                    entry = (start, curr + 1, prev, now)
+                elif start == window_start - window:
+                    entry = (window_start, 1, curr, now)
+                else:
+                    entry = (window_start, 1, 0, now)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def reset(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def evict_expired(self, older_than):
+        with self._lock:
+            # Самые старые обращения в начале OrderedDict
+            while self._entries:
+                key, entry = next(iter(self._entries.items()))
+                if entry[3] >= older_than:
+                    break
+                del self._entries[key]
+                self._evictions += 1
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._entries)
+            evictions = self._evictions
+        # dict слот + ключ (~50 байт) + кортеж из 4 чисел
+        entry_size = 100 + sys.getsizeof((0, 0, 0, 0.0))
+        return {"backend": "memory", "entries": entries,
+                "max_entries": self.max_entries,
+                "memory_bytes": entries * entry_size,
+                "evictions": evictions}
+
+
+class SQLiteBackend:
+    """Общее состояние в отдельном файле SQLite (WAL)
+
+    Счетчики - не ценные данные, поэтому synchronous=OFF: потеря последних
+    изменений при падении машины допустима, fsync на каждую попытку - нет.
+    """
+
+    def __init__(self, db_path, max_entries=100000):
+        self.db_path = str(db_path)
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                window_start INTEGER NOT NULL,
+                curr INTEGER NOT NULL,
+                prev INTEGER NOT NULL,
+                touched REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_rate_limits_touched ON rate_limits (touched)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limit_meta (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT window_start, curr, prev, touched FROM rate_limits WHERE key = ?",
+            (key,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def hit(self, key, window_start, window, now):
+        # В UPSERT все выражения SET видят старые значения строки
+        self._conn().execute("""
+            INSERT INTO rate_limits (key, window_start, curr, prev, touched)
+            VALUES (?1, ?2, 1, 0, ?4)
+            ON CONFLICT(key) DO UPDATE SET
+                prev = CASE
+                    WHEN window_start = ?2 THEN prev
+                    WHEN window_start = ?2 - ?3 THEN curr
+                    ELSE 0 END,
+                curr = CASE WHEN window_start = ?2 THEN curr + 1 ELSE 1 END,
+                window_start = ?2,
+                touched = ?4
+        """, (key, window_start, window, now))
+
+    def reset(self, key):
+        self._conn().execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+    def evict_expired(self, older_than):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            evicted = conn.execute(
+                "DELETE FROM rate_limits WHERE touched < ?", (older_than,)
+            ).rowcount
+
+            over = conn.execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0] - self.max_entries
+            if over > 0:
+                evicted += conn.execute("""
+                    DELETE FROM rate_limits WHERE key IN (
+                        SELECT key FROM rate_limits ORDER BY touched LIMIT ?
+                    )
+                """, (over,)).rowcount
+
+            if evicted:
+                conn.execute("""
+                    INSERT INTO rate_limit_meta (name, value) VALUES ('evictions', ?)
+                    ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+                """, (evicted,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def stats(self):
+        conn = self._conn()
+        entries = conn.execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+        row = conn.execute("SELECT value FROM rate_limit_meta WHERE name = 'evictions'").fetchone()
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return {"backend": "sqlite", "entries": entries,
+                "max_entries": self.max_entries,
+                "memory_bytes": page_count * page_size,
+                "evictions": row[0] if row else 0}
+
+
+# ═══════════════════════════════════════════════════════════════
+# ЛИМИТЕР
+# ═══════════════════════════════════════════════════════════════
+
+class RateLimiter:
+    """Не больше limit неудачных попыток за window секунд на ключ"""
+
+    def __init__(self, backend, limit, window, evict_interval=30.0):
+        self.backend = backend
+        self.limit = limit
+        self.window = int(window)
+        self.evict_interval = evict_interval
+        self._next_evict = 0.0
+
+    def _estimate(self, entry, now):
+        if entry is None:
+            return 0.0, 0.0
+        start, curr, prev, _ = entry
+        current_start = int(now) - int(now) % self.window
+        if start == current_start - self.window:
+            prev, curr = curr, 0
+        elif start != current_start:
+            return 0.0, 0.0
+
+        elapsed = (now - current_start) / self.window
+        count = prev * (1.0 - elapsed) + curr
+
+        # Через сколько секунд оценка опустится ниже лимита
+        if curr >= self.limit:
+            retry_after = self.window - (now - current_start)
+        elif prev:
+            retry_after = max(0.0, self.window * (1.0 - (self.limit - curr) / prev) - (now - current_start))
+        else:
+            retry_after = 0.0
+        return count, retry_after
+
+    def check(self, key):
+        """-> (разрешено, через сколько секунд можно снова)"""
+        now = time.time()
+        count, retry_after = self._estimate(self.backend.get(key), now)
+        if count >= self.limit:
+            return False, max(1, int(retry_after) + 1)
+        return True, 0
+
+    def hit(self, key):
+        now = time.time()
+        self.backend.hit(key, int(now) - int(now) % self.window, self.window, now)
+        if now >= self._next_evict:
+            self._next_evict = now + self.evict_interval
+            # Через два окна состояние ключа в любом случае обнуляется
+            self.backend.evict_expired(now - 2 * self.window)
+
+    def reset(self, key):
+        self.backend.reset(key)
+
+    def stats(self):
+        return dict(self.backend.stats(), limit=self.limit, window=self.window)
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Replication
+Несколько узлов: primary пишет, replica обслуживает вход по локальной копии
+
+primary: триггеры пишут каждое изменение users и session_revocations в
+replication_log (номер seq растет в порядке commit - писатель в SQLite
+один). Реплики забирают журнал через /api/replication/changes (long poll):
+в ответе текущие строки измененных id, так что применять их можно
+повторно и в любом порядке внутри пачки.
+
+replica: один воркер на узле (аренда replica_lease) применяет пачки в
+локальную БД, каждую одной транзакцией вместе с номером seq. Новая реплика
+(или отставшая дальше, чем хранится журнал) сначала копирует таблицы
+целиком через /api/replication/snapshot, потом догоняет журнал с номера,
+снятого до копии.
+
+Свежесть: после ответа "больше изменений нет" реплика знает, что ее данные
+не старше момента, когда primary их прочитал. Если с этого момента прошло
+больше max_staleness (primary недоступен, реплика догоняет), вход и
+проверки уходят на primary целиком, а при недоступном primary - 503.
+
+Запись с реплики идет на primary: админские маршруты проксируются,
+привязка HWID и перехеширование при входе - /api/replication/login_writes,
+аудит - пачками в /api/replication/audit. Rate limit у каждого узла свой.
+"""
+
+import os
+import secrets
+import threading
+import time
+
+import requests
+
+from maintenance import acquire_lease
+
+# Таблица -> ключ строки
+TABLES = {"users": "id", "session_revocations": "user_id"}
+
+LOG_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS replication_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        changed_at REAL NOT NULL
+    )
+"""
+
+NOW_SQL = "(julianday('now') - 2440587.5) * 86400.0"
+
+LEASE_NAME = "replica_lease"
+FORWARDED_IP_HEADER = "X-Rulix-Client-IP"
+
+
+def trigger_statements(table, key):
+    for event, ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        name = f"replication_{table}_{event.lower()}"
+        yield name, f"""
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO replication_log (tbl, row_id, changed_at)
+                VALUES ('{table}', {ref}.{key}, {NOW_SQL});
+            END
+        """
+
+
+def prepare(conn, role):
+    """Журнал и триггеры (init_database). Триггеры только на primary:
+    на реплике и одиночном узле журнал никто не читает"""
+    conn.execute(LOG_TABLE_SQL)
+    for table, key in TABLES.items():
+        for name, sql in trigger_statements(table, key):
+            if role == "primary":
+                conn.execute(sql)
+            else:
+                conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.commit()
+
+
+def _state(conn, name):
+    row = conn.execute("SELECT value FROM maintenance_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_state(conn, name, value):
+    conn.execute("""
+        INSERT INTO maintenance_state (name, value) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET value = excluded.value
+    """, (name, value))
+
+
+def _last_seq(conn):
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'replication_log'").fetchone()
+    return row[0] if row else 0
+
+
+class ResyncRequired(Exception):
+    """Реплика отстала дальше журнала (или primary восстановлен из копии)"""
+
+
+class PrimaryUnavailable(Exception):
+    """primary не ответил или ответил ошибкой"""
+
+
+# ═══════════════════════════════════════════════════════════════
+# PRIMARY
+# ═══════════════════════════════════════════════════════════════
+
+class ReplicationSource:
+    def __init__(self, pool, batch_size=5000, max_wait=10.0, retention=86400,
+                 prune_interval=60, poll_step=0.05):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.max_wait = max_wait            # предел long poll, сек
+        self.retention = retention          # сколько хранить журнал, сек
+        self.prune_interval = prune_interval
+        self.poll_step = poll_step
+
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"changes_requests": 0, "snapshot_requests": 0, "rows_sent": 0,
+                       "resyncs": 0, "pruned": 0}
+
+    def changes(self, after, limit=None, wait=0.0):
+        """Изменения после seq after -> {"seq", "more", "waited", "tables": {...}}"""
+        limit = min(limit or self.batch_size, self.batch_size)
+        started = time.monotonic()
+        deadline = started + min(max(wait, 0.0), self.max_wait)
+        self._maybe_prune()
+
+        while True:
+            with self.pool.connection() as conn:
+                last = _last_seq(conn)
+            if last != after or time.monotonic() >= deadline:
+                break
+            time.sleep(self.poll_step)
+        waited = time.monotonic() - started
+
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                pruned = _state(conn, "replication_pruned_seq") or 0
+                if after < pruned or after > _last_seq(conn):
+                    with self._lock:
+                        self._stats["resyncs"] += 1
+                    raise ResyncRequired(f"seq {after} is outside the log ({pruned}..{_last_seq(conn)})")
+                log = conn.execute("""
+                    SELECT seq, tbl, row_id FROM replication_log
+                    WHERE seq > ? ORDER BY seq LIMIT ?
+                """, (after, limit)).fetchall()
+                ids = {}
+                for _, table, row_id in log:
+                    ids.setdefault(table, set()).add(row_id)
+                tables = {table: self._rows(conn, table, sorted(row_ids))
+                          for table, row_ids in ids.items() if table in TABLES}
+            finally:
+                conn.rollback()
+
+        with self._lock:
+            self._stats["changes_requests"] += 1
+            self._stats["rows_sent"] += sum(len(t["rows"]) for t in tables.values())
+        return {
+            "seq": log[-1][0] if log else after,
+            "more": len(log) == limit,
+            "waited": round(waited, 3),
+            "tables": tables,
+        }
+
+    def _rows(self, conn, table, row_ids):
+        """Текущие строки id -> {"columns", "rows", "deleted"}"""
+        key = TABLES[table]
+        columns, rows = None, []
+        for start in range(0, len(row_ids), 500):
+            chunk = row_ids[start:start + 500]
+            cursor = conn.execute(f"SELECT * FROM {table} WHERE {key} IN ({','.join('?' * len(chunk))})",
+                                  chunk)
+            columns = [d[0] for d in cursor.description]
+            rows.extend(cursor.fetchall())
+        found = {row[columns.index(key)] for row in rows} if rows else set()
+        return {"columns": columns or [], "rows": rows,
+                "deleted": [row_id for row_id in row_ids if row_id not in found]}
+
+    def snapshot(self, table, after_id=0, limit=None):
+        """Страница таблицы по ключу + seq, с которого потом догонять журнал"""
+        if table not in TABLES:
+            raise ValueError(f"unknown table {table}")
+        limit = min(limit or self.batch_size, self.batch_size)
+        key = TABLES[table]
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                seq = _last_seq(conn)
+                cursor = conn.execute(f"SELECT * FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?",
+                                      (after_id, limit))
+                rows = cursor.fetchall()
+                columns = [d[0] for d in cursor.description]
+            finally:
+                conn.rollback()
+        with self._lock:
+            self._stats["snapshot_requests"] += 1
+            self._stats["rows_sent"] += len(rows)
+        return {"seq": seq, "columns": columns, "rows": rows}
+
+    def _maybe_prune(self):
+        now = time.time()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + self.prune_interval
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            upto = conn.execute("SELECT MAX(seq) FROM replication_log WHERE changed_at < ?",
+                                (now - self.retention,)).fetchone()[0]
+            if upto is None:
+                conn.rollback()
+                return
+            deleted = conn.execute("DELETE FROM replication_log WHERE seq <= ?", (upto,)).rowcount
+            # Реплика, которая еще не дошла до upto, должна скопировать таблицы заново
+            _set_state(conn, "replication_pruned_seq", upto)
+            conn.commit()
+        with self._lock:
+            self._stats["pruned"] += deleted
+
+    def stats(self):
+        with self.pool.connection() as conn:
+            last = _last_seq(conn)
+        with self._lock:
+            return dict(self._stats, seq=last)
+
+
+# ═══════════════════════════════════════════════════════════════
+# REPLICA
+# ═══════════════════════════════════════════════════════════════
+
+class ReplicaApplier:
+    """Применение журнала primary + пересылка записи на primary
+
+    on_users_changed(conn, usernames) вызывается в транзакции применения
+    (инвалидация кеша пользователей в воркерах реплики).
+    """
+
+    def __init__(self, pool, primary_url, token, on_users_changed=None, poll_wait=2.0,
+                 max_staleness=5.0, batch_size=5000, timeout=(3.05, 10), lease_ttl=15,
+                 staleness_check_interval=0.25):
+        self.pool = pool
+        self.primary_url = primary_url.rstrip("/")
+        self.token = token
+        self.on_users_changed = on_users_changed
+        self.poll_wait = poll_wait
+        self.max_staleness = max_staleness
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.lease_ttl = lease_ttl
+        self.staleness_check_interval = staleness_check_interval
+
+        self._owner = f"{os.getpid()}-{secrets.token_hex(4)}"
+        self._pid = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._columns = {}
+        self._synced_at = None
+        self._next_check = 0.0
+        self._stats = {"batches": 0, "rows_applied": 0, "rows_deleted": 0, "bootstraps": 0,
+                       "forwarded": 0, "forward_errors": 0, "last_error": None}
+
+    # ───────────────────────────────────────────────────────────
+    # HTTP к primary
+    # ───────────────────────────────────────────────────────────
+
+    def _session(self):
+        # Свой Session на поток: requests.Session не обещает потокобезопасность
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers["Authorization"] = f"Bearer {self.token}"
+        return session
+
+    def _call(self, endpoint, payload, read_timeout=None):
+        timeout = (self.timeout[0], read_timeout or self.timeout[1])
+        try:
+            response = self._session().post(f"{self.primary_url}/api/replication/{endpoint}",
+                                            json=payload, timeout=timeout)
+        except requests.RequestException as e:
+            raise PrimaryUnavailable(str(e)) from e
+        if response.status_code == 410:
+            raise ResyncRequired(response.json().get("error"))
+        if response.status_code != 200:
+            raise PrimaryUnavailable(f"{endpoint}: HTTP {response.status_code}")
+        return response.json()
+
+    def forward(self, method, path, body, headers, client_ip):
+        """Запрос клиента как есть -> requests.Response (stream)"""
+        headers = {k: v for k, v in headers.items() if k.lower() in ("content-type", "accept")}
+        headers[FORWARDED_IP_HEADER] = client_ip or ""
+        try:
+            response = self._session().request(method, self.primary_url + path, data=body,
+                                               headers=headers, timeout=self.timeout, stream=True)
+        except requests.RequestException as e:
+            with self._lock:
+                self._stats["forward_errors"] += 1
+            raise PrimaryUnavailable(str(e)) from e
+        with self._lock:
+            self._stats["forwarded"] += 1
+        return response
+
+    def forward_login_writes(self, user_id, username, bind_hwid, new_hash, stored_hash):
+        """Привязка HWID / новый хеш на primary -> False если HWID уже другой"""
+        return self._call("login_writes", {
+            "user_id": user_id, "username": username, "hwid": bind_hwid,
+            "new_hash": new_hash, "stored_hash": stored_hash,
+        })["saved"]
+
+    def forward_audit(self, batch):
+        """Синк AuditWriter: пачка строк login_attempts на primary"""
+        self._call("audit", {"rows": batch})
+
+    # ───────────────────────────────────────────────────────────
+    # Свежесть
+    # ───────────────────────────────────────────────────────────
+
+    def staleness(self):
+        """Сколько секунд назад данные реплики точно совпадали с primary (None - ни разу)"""
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.staleness_check_interval
+            with self.pool.connection() as conn:
+                self._synced_at = _state(conn, "replica_synced_at")
+        if self._synced_at is None:
+            return None
+        return max(0.0, time.time() - self._synced_at)
+
+    def fresh(self):
+        staleness = self.staleness()
+        return staleness is not None and staleness <= self.max_staleness
+
+    # ───────────────────────────────────────────────────────────
+    # Применение журнала
+    # ───────────────────────────────────────────────────────────
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._owner = f"{os.getpid()}-{secrets.token_hex(4)}"
+            self._local = threading.local()
+            threading.Thread(target=self._run, name="replica-applier", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                if not acquire_lease(self.pool, LEASE_NAME, self._owner, self.lease_ttl):
+                    time.sleep(self.lease_ttl / 3)
+                    continue
+                with self.pool.connection() as conn:
+                    seq = _state(conn, "replica_seq")
+                if seq is None:
+                    self.bootstrap()
+                    continue
+                self.poll_once(seq)
+                self._stats["last_error"] = None
+            except ResyncRequired as e:
+                print(f"[REPLICA] {e}, copying tables again")
+                self._reset()
+            except Exception as e:
+                self._stats["last_error"] = str(e)
+                print(f"[REPLICA] {e}")
+                time.sleep(1.0)
+
+    def poll_once(self, seq):
+        """Одна пачка журнала -> сколько строк применено"""
+        sent = time.time()
+        data = self._call("changes", {"after": seq, "limit": self.batch_size, "wait": self.poll_wait},
+                          read_timeout=self.poll_wait + self.timeout[1])
+        applied = 0
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if _state(conn, "replica_seq") != seq:
+                # Аренду успел забрать другой воркер
+                conn.rollback()
+                return 0
+            for table, payload in data["tables"].items():
+                applied += self._apply(conn, table, payload["columns"], payload["rows"], payload["deleted"])
+            _set_state(conn, "replica_seq", data["seq"])
+            if not data["more"]:
+                # primary читал журнал не раньше sent + waited
+                _set_state(conn, "replica_synced_at", sent + data["waited"])
+            conn.commit()
+        if not data["more"]:
+            self._synced_at = sent + data["waited"]
+        with self._lock:
+            self._stats["batches"] += 1
+        return applied
+
+    def _apply(self, conn, table, columns, rows, deleted=()):
+        key = TABLES[table]
+        local = self._columns.get(table)
+        if local is None:
+            local = self._columns[table] = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        keep = [i for i, column in enumerate(columns) if column in local]
+        names = [columns[i] for i in keep]
+        usernames = []
+
+        if deleted:
+            if table == "users":
+                for start in range(0, len(deleted), 500):
+                    chunk = list(deleted[start:start + 500])
+                    usernames.extend(row[0] for row in conn.execute(
+                        f"SELECT username FROM users WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+            conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", [(row_id,) for row_id in deleted])
+
+        if rows:
+            # Строка целиком как на primary: старую удаляем, новую вставляем.
+            # Не INSERT OR REPLACE: он убирает конфликтующие строки без DELETE
+            # триггеров, и в индексе поиска (user_search.py) остались бы
+            # старые значения
+            position = columns.index(key)
+            conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", [(row[position],) for row in rows])
+            if table == "users":
+                # Логин мог перейти к другому id
+                index = columns.index("username")
+                conn.executemany("DELETE FROM users WHERE username = ?", [(row[index],) for row in rows])
+                usernames.extend(row[index] for row in rows)
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                [[row[i] for i in keep] for row in rows])
+
+        if usernames and self.on_users_changed:
+            self.on_users_changed(conn, usernames)
+        with self._lock:
+            self._stats["rows_applied"] += len(rows)
+            self._stats["rows_deleted"] += len(deleted)
+        return len(rows) + len(deleted)
+
+    def _reset(self):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM maintenance_state WHERE name IN ('replica_seq', 'replica_synced_at')")
+            conn.commit()
+        self._synced_at = None
+
+    def bootstrap(self):
+        """Копия таблиц целиком, потом журнал с seq, снятого до первой страницы"""
+        started = time.perf_counter()
+        self._reset()
+        with self.pool.connection() as conn:
+            for table in TABLES:
+                conn.execute(f"DELETE FROM {table}")
+            conn.commit()
+
+        start_seq = None
+        total = 0
+        for table, key in TABLES.items():
+            after_id = 0
+            while True:
+                page = self._call("snapshot", {"table": table, "after_id": after_id,
+                                               "limit": self.batch_size})
+                if start_seq is None:
+                    start_seq = page["seq"]
+                rows = page["rows"]
+                if rows:
+                    with self.pool.connection() as conn:
+                        conn.execute("BEGIN IMMEDIATE")
+                        self._apply(conn, table, page["columns"], rows)
+                        conn.commit()
+                    after_id = rows[-1][page["columns"].index(key)]
+                    total += len(rows)
+                # Продлеваем аренду: копия миллиона строк идет дольше lease_ttl
+                acquire_lease(self.pool, LEASE_NAME, self._owner, self.lease_ttl)
+                if len(rows) < self.batch_size:
+                    break
+
+        with self.pool.connection() as conn:
+            _set_state(conn, "replica_seq", start_seq)
+            conn.commit()
+        with self._lock:
+            self._stats["bootstraps"] += 1
+        print(f"[REPLICA] Copied {total} rows from {self.primary_url} in "
+              f"{time.perf_counter() - started:.1f}s, following log from seq {start_seq}")
+
+    def stats(self):
+        staleness = self.staleness()
+        with self.pool.connection() as conn:
+            seq = _state(conn, "replica_seq")
+        with self._lock:
+            return dict(self._stats, seq=seq, primary=self.primary_url,
+                        staleness=round(staleness, 3) if staleness is not None else None,
+                        fresh=staleness is not None and staleness <= self.max_staleness)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Schema Migrations
+users.expires_at / created_at (ISO текст) -> expires_ts / created_ts (unix, INTEGER)
+
+Текстовые колонки остаются для ответов API, но сравнения и сортировки
+идут по числовым: формат текста разный (datetime.isoformat() у expires_at,
+CURRENT_TIMESTAMP в UTC у created_at), а число - одно.
+
+Миграция онлайн:
+    1. prepare() из init_database: ADD COLUMN (мгновенно), индексы и
+       триггеры, которые заполняют числа для строк, вставленных без них
+       (старые воркеры во время выкладки, ручной SQL)
+    2. фоновый поток заполняет существующие строки пачками по id,
+       каждая пачка - короткая транзакция, прогресс в maintenance_state
+    3. когда пачки дошли до MAX(id), ставится флаг users_epoch_done, и
+       запросы переключаются на числовые колонки, а текстовые индексы
+       удаляются
+
+До флага запросы работают по тексту, как раньше.
+"""
+
+import os
+import threading
+import time
+
+# expires_at пишется как локальное время (datetime.now().isoformat()),
+# created_at - CURRENT_TIMESTAMP, то есть UTC
+EXPIRES_TS_SQL = "CAST(strftime('%s', {row}expires_at, 'utc') AS INTEGER)"
+CREATED_TS_SQL = "CAST(strftime('%s', {row}created_at) AS INTEGER)"
+
+TEXT_INDEXES = {
+    "idx_users_created": "users (created_at, id)",
+    "idx_users_expires": "users (expires_at)",
+    "idx_users_active_expires": "users (is_active, expires_at)",
+}
+EPOCH_INDEXES = {
+    "idx_users_created_ts": "users (created_ts, id)",
+    "idx_users_expires_ts": "users (expires_ts)",
+    "idx_users_active_expires_ts": "users (is_active, expires_ts)",
+}
+
+TRIGGERS_SQL = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS users_epoch_insert AFTER INSERT ON users
+    WHEN NEW.expires_ts IS NULL OR NEW.created_ts IS NULL
+    BEGIN
+        UPDATE users SET
+            expires_ts = COALESCE(NEW.expires_ts, {EXPIRES_TS_SQL.format(row='NEW.')}),
+            created_ts = COALESCE(NEW.created_ts, {CREATED_TS_SQL.format(row='NEW.')})
+        WHERE id = NEW.id;
+    END
+    """,
+    # Текст изменили, а число нет (код, который о нем не знает)
+    f"""
+    CREATE TRIGGER IF NOT EXISTS users_epoch_update AFTER UPDATE OF expires_at ON users
+    WHEN NEW.expires_ts IS OLD.expires_ts
+    BEGIN
+        UPDATE users SET expires_ts = {EXPIRES_TS_SQL.format(row='NEW.')}
+        WHERE id = NEW.id;
+    END
+    """,
+)
+
+
+class UsersEpochMigration:
+    def __init__(self, pool, batch_size=2000, pause=0.05, check_interval=5.0):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.pause = pause
+        self.check_interval = check_interval
+
+        self._done = False
+        self._next_check = 0.0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # ───────────────────────────────────────────────────────────
+    # Схема (init_database)
+    # ───────────────────────────────────────────────────────────
+
+    def prepare(self, conn):
+        """Колонки, индексы, триггеры. Быстро при любом размере таблицы,
+        кроме первого построения числовых индексов (по NULL значениям)"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+        for column in ("expires_ts", "created_ts"):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE users ADD COLUMN {column} INTEGER")
+
+        for sql in TRIGGERS_SQL:
+            conn.execute(sql)
+        for name, target in EPOCH_INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+        if not self._read_done(conn):
+            # Пока идет заполнение, запросы работают по тексту
+            for name, target in TEXT_INDEXES.items():
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+            if conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None:
+                self._finish(conn)
+        conn.commit()
+        self._done = self._read_done(conn)
+
+    def _read_done(self, conn):
+        row = conn.execute(
+            "SELECT value FROM maintenance_state WHERE name = 'users_epoch_done'"
+        ).fetchone()
+        return bool(row and row[0])
+
+    def _finish(self, conn):
+        for name in TEXT_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        conn.execute("""
+            INSERT INTO maintenance_state (name, value) VALUES ('users_epoch_done', 1)
+            ON CONFLICT(name) DO UPDATE SET value = excluded.value
+        """)
+
+    # ───────────────────────────────────────────────────────────
+    # Заполнение
+    # ───────────────────────────────────────────────────────────
+
+    def ensure_started(self):
+        """Фоновое заполнение в этом процессе, если миграция не закончена.
+        Несколько процессов сразу - безопасно: прогресс читается в той же
+        транзакции, что и пишется"""
+        if self._done or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="users-epoch-migration",
+                             daemon=True).start()
+
+    def _run(self):
+        try:
+            migrated = 0
+            started = time.perf_counter()
+            while not self._done:
+                count = self.step()
+                migrated += count
+                time.sleep(self.pause)
+            if migrated:
+                print(f"[MIGRATION] users epoch columns: {migrated} rows in "
+                      f"{time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            print(f"[MIGRATION] users epoch columns failed: {e}")
+            self._pid = None
+
+    def step(self):
+        """Одна пачка -> сколько строк обработано"""
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if self._read_done(conn):
+                conn.rollback()
+                self._done = True
+                return 0
+
+            row = conn.execute(
+                "SELECT value FROM maintenance_state WHERE name = 'users_epoch_last_id'"
+            ).fetchone()
+            last_id = row[0] if row else 0
+            max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+            upper = min(max_id, last_id + self.batch_size)
+
+            count = 0
+            finished = upper >= max_id
+            if upper > last_id:
+                count = conn.execute(f"""
+                    UPDATE users SET
+                        expires_ts = COALESCE(expires_ts, {EXPIRES_TS_SQL.format(row='')}),
+                        created_ts = COALESCE(created_ts, {CREATED_TS_SQL.format(row='')})
+                    WHERE id > ? AND id <= ?
+                """, (last_id, upper)).rowcount
+                conn.execute("""
+                    INSERT INTO maintenance_state (name, value) VALUES ('users_epoch_last_id', ?)
+                    ON CONFLICT(name) DO UPDATE SET value = excluded.value
+                """, (upper,))
+            if finished:
+                self._finish(conn)
+            conn.commit()
+        self._done = finished
+        return count
+
+    def done(self):
+        """Закончена ли миграция (в БД проверяется не чаще check_interval)"""
+        if self._done:
+            return True
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.check_interval
+        with self.pool.connection() as conn:
+            self._done = self._read_done(conn)
+        return self._done
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Session Tokens
+Подписанные HMAC токены сессии, проверка без обращения к БД
+
+Формат: v1.<payload b64url>.<подпись b64url>
+payload - компактный JSON: u (user_id), h (hwid), x (лицензия до, unix),
+i (выдан, unix), e (токен до, unix)
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+VERSION = "v1"
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class TokenSigner:
+    """Выпуск и проверка токенов"""
+
+    def __init__(self, secret, ttl=3600):
+        # Отдельный ключ: токен не должен совпадать ни с одной подписью API
+        self._key = hmac.new(secret.encode(), b"rulix-session-token",
+                             hashlib.sha256).digest()
+        self.ttl = ttl
+
+    def _sign(self, body):
+        return hmac.new(self._key, body.encode(), hashlib.sha256).digest()
+
+    def issue(self, user_id, hwid, license_expires):
+        now = int(time.time())
+        claims = {
+            "u": user_id,
+            "h": hwid,
+            "x": int(license_expires),
+            "i": now,
+            "e": min(now + self.ttl, int(license_expires)),
+        }
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        body = f"{VERSION}.{payload}"
+        return f"{body}.{_b64encode(self._sign(body))}"
+
+    def decode(self, token):
+        """-> (claims, None) или (None, причина)"""
+        try:
+            version, payload, signature = token.split(".")
+        except (AttributeError, ValueError):
+            return None, "malformed"
+        if version != VERSION:
+            return None, "malformed"
+
+        try:
+            valid = hmac.compare_digest(self._sign(f"{version}.{payload}"),
+                                        _b64decode(signature))
+        except ValueError:
+            return None, "malformed"
+        if not valid:
+            return None, "bad_signature"
+
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            return None, "malformed"
+
+        now = time.time()
+        if claims["x"] <= now:
+            return None, "license_expired"
+        if claims["e"] <= now:
+            return None, "token_expired"
+        return claims, None
+
+
+# ═══════════════════════════════════════════════════════════════
+# ОТЗЫВ ТОКЕНОВ
+# ═══════════════════════════════════════════════════════════════
+
+class RevocationList:
+    """user_id -> время отзыва. Токены выданные до этого момента недействительны
+
+    Источник правды - таблица session_revocations; фоновый поток раз в
+    refresh_interval секунд подтягивает новые строки, так что проверка
+    токена на запросе идет только по памяти. Записи старше max_age
+    (время жизни токена) больше ничего не отзывают и выбрасываются.
+    """
+
+    def __init__(self, pool, refresh_interval=2.0, max_age=3600):
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+
+        self._revoked = {}
+        self._last_seen = 0.0
+        self._lock = threading.RLock()
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._revoked = {}
+            self._last_seen = 0.0
+            # Первый ответ процесса уже по таблице: на реплике отзывы
+            # приходят только через нее
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[TOKENS] Revocation refresh failed: {e}")
+            threading.Thread(target=self._run, name="token-revocations",
+                             daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[TOKENS] Revocation refresh failed: {e}")
+
+    def refresh(self):
+        since = max(self._last_seen, time.time() - self.max_age)
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+                SELECT user_id, revoked_at FROM session_revocations
+                WHERE revoked_at >= ?
+            """, (since,)).fetchall()
+
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            for user_id, revoked_at in rows:
+                if revoked_at > self._revoked.get(user_id, 0):
+                    self._revoked[user_id] = revoked_at
+                self._last_seen = max(self._last_seen, revoked_at)
+            for user_id in [u for u, t in self._revoked.items() if t < cutoff]:
+                del self._revoked[user_id]
+
+    def revoke(self, conn, user_id):
+        """Записать отзыв в рамках транзакции вызывающего (commit делает он)"""
+        revoked_at = time.time()
+        conn.execute("""
+            INSERT INTO session_revocations (user_id, revoked_at) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET revoked_at = excluded.revoked_at
+        """, (user_id, revoked_at))
+        with self._lock:
+            self._revoked[user_id] = revoked_at
+
+    def is_revoked(self, user_id, issued_at):
+        self._ensure_started()
+        revoked_at = self._revoked.get(user_id)
+        return revoked_at is not None and issued_at <= revoked_at
+
+    def size(self):
+        return len(self._revoked)
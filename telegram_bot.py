@@ -7,10 +7,18 @@ Rulix Admin Telegram Bot
 """
 
 import telebot
-from telebot import types
+from telebot import types, apihelper
 import requests
 import secrets
-from datetime import datetime
+import time
+import csv
+import io
+import threading
+import argparse
+from datetime import datetime, timedelta
+
+from bot_api import ApiClient
+from bot_outbox import Outbox
 
 # ═══════════════════════════════════════════════════════════════
 # КОНФИГУРАЦИЯ
@@ -26,11 +34,62 @@ ADMIN_IDS = [1833222747]  # ← ВСТАВЬ СВОЙ ID
 API_URL = "http://localhost:5000/api"  # ← ИЗМЕНИ НА СВОЙ СЕРВЕР
 API_SECRET = "G_SECRET_KEY_CHANGE_ME_123456789"  # ← ТОТ ЖЕ ЧТО В auth_server
 
+# Клиент API и обработка команд
+API_TIMEOUT = (3.05, 10)      # (connect, read), сек
+API_RETRIES = 3               # только для запросов на чтение
+API_BREAKER_THRESHOLD = 5     # ошибок подряд до паузы
+API_BREAKER_COOLDOWN = 30     # сек паузы
+BOT_WORKERS = 8               # команды обрабатываются параллельно
+
+# Получение обновлений: "polling" - long polling, "webhook" - Telegram сам
+# присылает их на WEBHOOK_URL (HTTPS, nginx -> WEBHOOK_LISTEN:WEBHOOK_PORT)
+BOT_MODE = "polling"
+WEBHOOK_URL = "https://bot.example.com/telegram/webhook"  # ← ПУБЛИЧНЫЙ АДРЕС
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET = None         # None - случайный при каждом запуске
+WEBHOOK_MAX_PENDING = 256     # команд в очереди, больше - 503 и Telegram повторит
+
+# Свой адрес Bot API, например telegram_stub.py для локальной проверки
+TELEGRAM_API_URL = None       # "http://127.0.0.1:8081"
+
+# Исходящие уведомления: лимиты Telegram ~30 сообщений/с всего, 1/с в чат,
+# 20/мин в группу. Ответы на команды идут мимо этой очереди
+OUTBOX_GLOBAL_RATE = 25       # сообщений/с, с запасом
+OUTBOX_CHAT_RATE = 0.5        # сообщений/с в один чат: половина лимита, остальное - ответам
+OUTBOX_CHAT_BURST = 1         # сколько можно подряд без паузы
+OUTBOX_MAX_QUEUE = 1000
+
+# Дайджест истекающих лицензий админам, раз в сутки
+EXPIRY_NOTIFY_ENABLED = True
+EXPIRY_NOTIFY_AT = "10:00"    # местное время
+EXPIRY_NOTIFY_DAYS = 7        # истекают в ближайшие N дней
+EXPIRY_DIGEST_MAX_USERS = 500 # остальные - только числом
+
 # ═══════════════════════════════════════════════════════════════
 # БОТ
 # ═══════════════════════════════════════════════════════════════
 
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
+bot = telebot.TeleBot(TELEGRAM_TOKEN, threaded=True, num_threads=BOT_WORKERS)
+
+api = ApiClient(
+    API_URL,
+    API_SECRET,
+    timeout=API_TIMEOUT,
+    retries=API_RETRIES,
+    pool_size=BOT_WORKERS,
+    breaker_threshold=API_BREAKER_THRESHOLD,
+    breaker_cooldown=API_BREAKER_COOLDOWN,
+)
+
+outbox = Outbox(
+    bot,
+    global_rate=OUTBOX_GLOBAL_RATE,
+    chat_rate=OUTBOX_CHAT_RATE,
+    chat_burst=OUTBOX_CHAT_BURST,
+    max_queue=OUTBOX_MAX_QUEUE,
+)
 
 def is_admin(user_id):
     """Проверка что пользователь админ"""
@@ -54,7 +113,12 @@ def start(message):
 Доступные команды:
 
 📝 /create - Создать пользователя
+📦 /bulkcreate - Создать пачку пользователей
 👥 /list - Список пользователей
+🔎 /find - Найти пользователя
+📊 /stats - Статистика
+⏰ /expiring - Истекающие лицензии
+💾 /backup - Резервная копия БД
 ℹ️ /help - Помощь
 
 Powered by Rulix DLC
@@ -75,7 +139,26 @@ def help_command(message):
   /create player1 pass123 30
   /create testuser qwerty 7
 
-/list - Показать всех пользователей
+/bulkcreate количество [дни] [префикс]
+Или CSV файл (username,password[,дни]) с подписью /bulkcreate [дни]
+В ответ придет CSV с логинами, паролями и лицензиями
+
+/list [фильтр] - Пользователи постранично
+Фильтры: all, active, soon, expired
+
+/find запрос - Поиск по части логина, лицензии или HWID
+Примеры: /find player, /find RULIX-AB12, /find 3F9A0C
+
+/stats - Лицензии, входы за час/сутки, IP с ошибками
+
+/expiring [дни] - Кто истекает в ближайшие дни (по умолчанию 7)
+Такой же дайджест приходит сам раз в сутки
+
+/backup - Сделать копию БД (с проверкой)
+/backup list - Последние копии
+/backup verify [имя] - Проверить копию (по умолчанию последнюю)
+
+/apistats - Задержки запросов к серверу
 
 /help - Эта справка
 """)
@@ -112,17 +195,12 @@ def create_user(message):
         # Отправляем на сервер
         bot.reply_to(message, f"⏳ Создаю пользователя {username}...")
 
-        response = requests.post(
-            f"{API_URL}/admin/create_user",
-            json={
-                "admin_token": API_SECRET,
-                "username": username,
-                "password": password,
-                "duration_days": duration_days,
-                "license_key": license_key
-            },
-            timeout=10
-        )
+        response = api.post("admin/create_user", {
+            "username": username,
+            "password": password,
+            "duration_days": duration_days,
+            "license_key": license_key
+        })
 
         if response.status_code == 200:
             data = response.json()
@@ -156,6 +234,241 @@ def create_user(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Ошибка: {str(e)}")
 
+# ═══════════════════════════════════════════════════════════════
+# МАССОВОЕ СОЗДАНИЕ
+# ═══════════════════════════════════════════════════════════════
+
+BULK_CREATE_MAX = 1000  # как на сервере
+
+def parse_users_csv(raw):
+    """CSV: username,password[,дни] - заголовок необязателен"""
+    users = []
+    for row in csv.reader(io.StringIO(raw.decode('utf-8-sig'))):
+        if not row or not row[0].strip():
+            continue
+        if row[0].strip().lower() == 'username':
+            continue
+
+        user = {'username': row[0].strip()}
+        if len(row) > 1 and row[1].strip():
+            user['password'] = row[1].strip()
+        if len(row) > 2 and row[2].strip():
+            user['duration_days'] = int(row[2])
+        users.append(user)
+    return users
+
+def send_bulk_results(message, payload, passwords):
+    """Создать на сервере и прислать учетки CSV документом"""
+    response = api.post("admin/bulk_create", payload, timeout=(API_TIMEOUT[0], 120))
+
+    if response.status_code != 200:
+        bot.reply_to(message, f"❌ Ошибка сервера: {response.status_code}")
+        return
+
+    data = response.json()
+    if not data.get('success'):
+        bot.reply_to(message, f"❌ Ошибка: {data.get('error')}")
+        return
+
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['username', 'password', 'license_key', 'expires_at', 'status', 'error'])
+    for result in data['results']:
+        password = ''
+        if result['status'] == 'created':
+            password = result.get('password') or passwords.get(result['username'], '')
+        writer.writerow([
+            result.get('username'),
+            password,
+            result.get('license_key', ''),
+            result.get('expires_at', '')[:10],
+            result['status'],
+            result.get('error', '')
+        ])
+
+    document = io.BytesIO(out.getvalue().encode('utf-8'))
+    bot.send_document(
+        message.chat.id,
+        document,
+        visible_file_name=f"rulix_users_{datetime.now():%Y%m%d_%H%M%S}.csv",
+        caption=f"✅ Создано: {data['created']}, пропущено: {data['failed']}",
+        reply_to_message_id=message.message_id
+    )
+
+    print(f"[BOT] Bulk create: {data['created']} users by {message.from_user.username}")
+
+@bot.message_handler(commands=['bulkcreate'])
+def bulk_create(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, "❌ Доступ запрещен")
+        return
+
+    try:
+        parts = message.text.split()
+
+        if len(parts) < 2:
+            bot.reply_to(message, """
+❌ Неправильный формат!
+
+Используй:
+/bulkcreate количество [дни] [префикс]
+
+Или пришли CSV файл (username,password[,дни])
+с подписью /bulkcreate [дни]
+""")
+            return
+
+        count = int(parts[1])
+        duration_days = int(parts[2]) if len(parts) > 2 else 30
+        prefix = parts[3] if len(parts) > 3 else 'user'
+
+        if not 0 < count <= BULK_CREATE_MAX:
+            bot.reply_to(message, f"❌ Количество от 1 до {BULK_CREATE_MAX}")
+            return
+
+        bot.reply_to(message, f"⏳ Создаю {count} пользователей...")
+        send_bulk_results(message, {
+            "count": count,
+            "prefix": prefix,
+            "duration_days": duration_days
+        }, {})
+
+    except ValueError:
+        bot.reply_to(message, "❌ Количество и дни должны быть числами!")
+    except requests.exceptions.ConnectionError:
+        bot.reply_to(message, "❌ Не могу подключиться к серверу!")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Ошибка: {str(e)}")
+
+@bot.message_handler(content_types=['document'],
+                     func=lambda message: (message.caption or '').startswith('/bulkcreate'))
+def bulk_create_csv(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, "❌ Доступ запрещен")
+        return
+
+    try:
+        parts = message.caption.split()
+        duration_days = int(parts[1]) if len(parts) > 1 else 30
+
+        file_info = bot.get_file(message.document.file_id)
+        users = parse_users_csv(bot.download_file(file_info.file_path))
+
+        if not 0 < len(users) <= BULK_CREATE_MAX:
+            bot.reply_to(message, f"❌ В файле должно быть от 1 до {BULK_CREATE_MAX} строк")
+            return
+
+        bot.reply_to(message, f"⏳ Создаю {len(users)} пользователей из файла...")
+        passwords = {u['username']: u['password'] for u in users if 'password' in u}
+        send_bulk_results(message, {
+            "users": users,
+            "duration_days": duration_days
+        }, passwords)
+
+    except (ValueError, csv.Error):
+        bot.reply_to(message, "❌ Не могу разобрать CSV (username,password[,дни])")
+    except requests.exceptions.ConnectionError:
+        bot.reply_to(message, "❌ Не могу подключиться к серверу!")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Ошибка: {str(e)}")
+
+# ═══════════════════════════════════════════════════════════════
+# СПИСОК ПОЛЬЗОВАТЕЛЕЙ (ПОСТРАНИЧНО)
+# ═══════════════════════════════════════════════════════════════
+
+LIST_PAGE_SIZE = 10
+LIST_CACHE_TTL = 30  # сек, сколько держим загруженную страницу
+
+# код фильтра -> (параметры для /admin/list_users, подпись кнопки)
+LIST_FILTERS = {
+    'all': ({}, "Все"),
+    'active': ({'active': True, 'expired': False}, "Активные"),
+    'soon': ({'active': True, 'expiring_within_days': 7}, "Истекают ≤7д"),
+    'expired': ({'expired': True}, "Истекшие"),
+}
+
+# chat_id -> {'filter': код, 'cursors': [курсор каждой открытой страницы]}
+list_sessions = {}
+# (chat_id, фильтр, курсор) -> (время, users, next_cursor)
+list_page_cache = {}
+# команды обрабатываются в нескольких потоках
+list_lock = threading.Lock()
+
+def fetch_users_page(chat_id, filter_code, cursor):
+    """Одна страница с сервера (или из короткого кеша чата)"""
+    key = (chat_id, filter_code, cursor)
+    now = time.monotonic()
+
+    with list_lock:
+        cached = list_page_cache.get(key)
+    if cached and now - cached[0] < LIST_CACHE_TTL:
+        return cached[1], cached[2]
+
+    params, _ = LIST_FILTERS[filter_code]
+    response = api.post("admin/list_users", {
+        "limit": LIST_PAGE_SIZE,
+        "cursor": cursor,
+        **params
+    }, idempotent=True)
+
+    if response.status_code != 200:
+        raise RuntimeError(f"Ошибка сервера: {response.status_code}")
+
+    data = response.json()
+    if not data.get('success'):
+        raise RuntimeError(data.get('error'))
+
+    with list_lock:
+        for stale in [k for k, v in list_page_cache.items() if now - v[0] >= LIST_CACHE_TTL]:
+            del list_page_cache[stale]
+        list_page_cache[key] = (now, data['users'], data.get('next_cursor'))
+
+    return data['users'], data.get('next_cursor')
+
+def list_session_view(chat_id):
+    """-> (фильтр, курсоры) копией или None. Сессию меняют другие потоки,
+    а страницу грузим без list_lock"""
+    with list_lock:
+        session = list_sessions.get(chat_id)
+        return None if session is None else (session['filter'], list(session['cursors']))
+
+def render_users_page(chat_id, filter_code, cursors):
+    """Текст и клавиатура для последней страницы из cursors"""
+    page = len(cursors) - 1
+    users, next_cursor = fetch_users_page(chat_id, filter_code, cursors[-1])
+
+    title = LIST_FILTERS[filter_code][1]
+    result = f"👥 ПОЛЬЗОВАТЕЛИ ({title}), стр. {page + 1}:\n\n"
+
+    if not users:
+        result += "📭 Пользователей нет"
+
+    for user in users:
+        status = "✅" if user['is_active'] else "❌"
+        expires = user['expires_at'][:10]
+
+        result += f"{status} `{user['username']}`\n"
+        result += f"   License: `{user['license_key']}`\n"
+        result += f"   Expires: {expires}\n\n"
+
+    markup = types.InlineKeyboardMarkup()
+
+    nav = []
+    if page > 0:
+        nav.append(types.InlineKeyboardButton("◀️ Назад", callback_data="list:prev"))
+    if next_cursor:
+        nav.append(types.InlineKeyboardButton("Вперед ▶️", callback_data="list:next"))
+    if nav:
+        markup.row(*nav)
+
+    markup.row(*[
+        types.InlineKeyboardButton(("• " if code == filter_code else "") + label,
+                                   callback_data=f"list:filter:{code}")
+        for code, (_, label) in LIST_FILTERS.items()
+    ])
+
+    return result, markup, next_cursor
+
 @bot.message_handler(commands=['list'])
 def list_users(message):
     if not is_admin(message.from_user.id):
@@ -163,54 +476,502 @@ def list_users(message):
         return
 
     try:
-        bot.reply_to(message, "⏳ Загружаю список пользователей...")
+        parts = message.text.split()
+        filter_code = parts[1] if len(parts) > 1 and parts[1] in LIST_FILTERS else 'all'
 
-        response = requests.post(
-            f"{API_URL}/admin/list_users",
-            json={"admin_token": API_SECRET},
-            timeout=10
-        )
+        with list_lock:
+            list_sessions[message.chat.id] = {'filter': filter_code, 'cursors': [None]}
+        text, markup, _ = render_users_page(message.chat.id, filter_code, [None])
 
-        if response.status_code == 200:
-            data = response.json()
+        bot.reply_to(message, text, parse_mode='Markdown', reply_markup=markup)
 
-            if data.get('success'):
-                users = data['users']
+    except requests.exceptions.ConnectionError:
+        bot.reply_to(message, "❌ Не могу подключиться к серверу!")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Ошибка: {str(e)}")
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("list:"))
+def list_users_navigate(call):
+    if not is_admin(call.from_user.id):
+        bot.answer_callback_query(call.id, "❌ Доступ запрещен")
+        return
+
+    chat_id = call.message.chat.id
+    view = list_session_view(chat_id)
+    if view is None:
+        bot.answer_callback_query(call.id, "Список устарел, отправь /list")
+        return
+
+    try:
+        filter_code, cursors = view
+        action = call.data.split(":")
+        if action[1] == 'next':
+            _, next_cursor = fetch_users_page(chat_id, filter_code, cursors[-1])
+            with list_lock:
+                session = list_sessions[chat_id]
+                # Два быстрых нажатия не должны перескочить страницу
+                if next_cursor and session['filter'] == filter_code and session['cursors'] == cursors:
+                    session['cursors'].append(next_cursor)
+        elif action[1] == 'prev':
+            with list_lock:
+                session = list_sessions[chat_id]
+                if len(session['cursors']) > 1:
+                    session['cursors'].pop()
+        elif action[1] == 'filter' and action[2] in LIST_FILTERS:
+            with list_lock:
+                list_sessions[chat_id] = {'filter': action[2], 'cursors': [None]}
+
+        text, markup, _ = render_users_page(chat_id, *list_session_view(chat_id))
+        bot.edit_message_text(text, chat_id, call.message.message_id,
+                              parse_mode='Markdown', reply_markup=markup)
+        bot.answer_callback_query(call.id)
 
-                if not users:
-                    bot.reply_to(message, "📭 Пользователей нет")
-                    return
+    except requests.exceptions.ConnectionError:
+        bot.answer_callback_query(call.id, "❌ Не могу подключиться к серверу!")
+    except telebot.apihelper.ApiTelegramException:
+        # "message is not modified" - та же страница, ничего не делаем
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+
+@bot.message_handler(commands=['stats'])
+def stats(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, "❌ Доступ запрещен")
+        return
 
-                result = "👥 СПИСОК ПОЛЬЗОВАТЕЛЕЙ:\n\n"
+    try:
+        response = api.post("admin/stats", idempotent=True)
+        data = response.json()
+        if response.status_code != 200 or not data.get('success'):
+            bot.reply_to(message, f"❌ Ошибка: {data.get('error', response.status_code)}")
+            return
 
-                for user in users:
-                    status = "✅" if user['is_active'] else "❌"
-                    expires = user['expires_at'][:10]
+        users = data['users']
+        expiring = users['expiring']
+        result = f"📊 СТАТИСТИКА ({data['generated_at'][11:16]})\n\n"
+        result += f"👥 Всего: {users['total']}\n"
+        result += f"   ✅ Активные: {users['active']}\n"
+        result += f"   ⌛ Истекшие: {users['expired']}\n"
+        result += f"   ❌ Отключенные: {users['disabled']}\n\n"
+        result += f"⏰ Истекают: 1д - {expiring['1d']}, 7д - {expiring['7d']}, 30д - {expiring['30d']}\n\n"
 
-                    result += f"{status} **{user['username']}**\n"
-                    result += f"   License: `{user['license_key']}`\n"
-                    result += f"   Expires: {expires}\n\n"
+        for key, title in (('last_hour', 'час'), ('last_day', 'сутки')):
+            logins = data['logins'][key]
+            rate = f"{logins['success_rate'] * 100:.1f}%" if logins['success_rate'] is not None else "-"
+            result += f"🔑 Входы за {title}: {logins['total']}, ошибок {logins['failed']}, успешных {rate}\n"
 
-                # Telegram ограничивает длину сообщения
-                if len(result) > 4000:
-                    result = result[:4000] + "\n\n... (список обрезан)"
+        if data['top_failing_ips']:
+            result += "\n🚨 IP с ошибками за сутки:\n"
+            for item in data['top_failing_ips']:
+                result += f"   `{item['ip'] or '?'}` - {item['failures']}\n"
 
-                bot.reply_to(message, result, parse_mode='Markdown')
+        bot.reply_to(message, result, parse_mode='Markdown')
+
+    except requests.exceptions.ConnectionError:
+        bot.reply_to(message, "❌ Не могу подключиться к серверу!")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Ошибка: {str(e)}")
+
+# ═══════════════════════════════════════════════════════════════
+# ПОИСК ПОЛЬЗОВАТЕЛЕЙ
+# ═══════════════════════════════════════════════════════════════
+
+FIND_PAGE_SIZE = 10
+SEARCH_MAX_MATCHES = 1000  # как на сервере
+FIND_MATCH_LABELS = {'username': "логин", 'license_key': "лицензия", 'hwid': "HWID"}
+
+# chat_id -> {'query': строка, 'cursors': [курсор каждой открытой страницы]}
+find_sessions = {}
+
+def render_find_page(chat_id):
+    """Текст и клавиатура для текущей страницы поиска чата"""
+    session = find_sessions[chat_id]
+    page = len(session['cursors']) - 1
+    response = api.post("admin/search", {
+        "query": session['query'],
+        "limit": FIND_PAGE_SIZE,
+        "cursor": session['cursors'][-1]
+    }, idempotent=True)
+    data = response.json()
+    if response.status_code != 200 or not data.get('success'):
+        raise RuntimeError(data.get('error', response.status_code))
+
+    found = f"больше {SEARCH_MAX_MATCHES}, уточни запрос" if data['truncated'] else str(data['total'])
+    result = f"🔎 ПОИСК `{session['query'].replace('`', '')}`: {found}, стр. {page + 1}\n\n"
+    if not data['complete']:
+        result += "⚠️ Индекс еще строится, найдены не все\n\n"
+    if not data['users']:
+        result += "📭 Ничего не найдено"
+
+    for user in data['users']:
+        status = "✅" if user['is_active'] else "❌"
+        match = FIND_MATCH_LABELS.get(user['match'])
+        result += f"{status} `{user['username']}`" + (f" ({match})" if match else "") + "\n"
+        result += f"   License: `{user['license_key']}`\n"
+        if user['hwid']:
+            result += f"   HWID: `{user['hwid']}`\n"
+        result += f"   Expires: {user['expires_at'][:10]}\n\n"
+
+    markup = types.InlineKeyboardMarkup()
+    nav = []
+    if page > 0:
+        nav.append(types.InlineKeyboardButton("◀️ Назад", callback_data="find:prev"))
+    if data['next_cursor']:
+        nav.append(types.InlineKeyboardButton("Вперед ▶️", callback_data="find:next"))
+    if nav:
+        markup.row(*nav)
+
+    return result, markup, data['next_cursor']
+
+@bot.message_handler(commands=['find'])
+def find_users(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, "❌ Доступ запрещен")
+        return
+
+    parts = message.text.split(maxsplit=1)
+    query = parts[1].strip() if len(parts) > 1 else ""
+    if len(query) < 3:
+        bot.reply_to(message, "❌ Формат: /find часть логина, лицензии или HWID (от 3 символов)")
+        return
+
+    try:
+        find_sessions[message.chat.id] = {'query': query, 'cursors': [None]}
+        text, markup, _ = render_find_page(message.chat.id)
+        bot.reply_to(message, text, parse_mode='Markdown', reply_markup=markup)
+
+    except requests.exceptions.ConnectionError:
+        bot.reply_to(message, "❌ Не могу подключиться к серверу!")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Ошибка: {str(e)}")
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("find:"))
+def find_users_navigate(call):
+    if not is_admin(call.from_user.id):
+        bot.answer_callback_query(call.id, "❌ Доступ запрещен")
+        return
+
+    chat_id = call.message.chat.id
+    session = find_sessions.get(chat_id)
+    if session is None:
+        bot.answer_callback_query(call.id, "Поиск устарел, отправь /find заново")
+        return
+
+    try:
+        action = call.data.split(":")[1]
+        if action == 'next':
+            _, _, next_cursor = render_find_page(chat_id)
+            if next_cursor:
+                session['cursors'].append(next_cursor)
+        elif action == 'prev' and len(session['cursors']) > 1:
+            session['cursors'].pop()
+
+        text, markup, _ = render_find_page(chat_id)
+        bot.edit_message_text(text, chat_id, call.message.message_id,
+                              parse_mode='Markdown', reply_markup=markup)
+        bot.answer_callback_query(call.id)
+
+    except requests.exceptions.ConnectionError:
+        bot.answer_callback_query(call.id, "❌ Не могу подключиться к серверу!")
+    except telebot.apihelper.ApiTelegramException:
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        bot.answer_callback_query(call.id, f"❌ Ошибка: {str(e)}")
+
+# ═══════════════════════════════════════════════════════════════
+# ИСТЕКАЮЩИЕ ЛИЦЕНЗИИ
+# ═══════════════════════════════════════════════════════════════
+
+EXPIRING_PAGE_SIZE = 1000   # как LIST_PAGE_MAX на сервере
+DIGEST_MESSAGE_LIMIT = 3500 # символов в сообщении (Telegram режет на 4096)
+DIGEST_LINE_USERS = 20      # логинов в одной строке дня
+
+def fetch_expiring(days, max_users):
+    """-> (всего в окне, первые max_users по сроку). Сервер идет по индексу срока"""
+    users, cursor, total = [], None, 0
+    while len(users) < max_users:
+        response = api.post("admin/expiring", {
+            "days": days,
+            "limit": min(EXPIRING_PAGE_SIZE, max_users - len(users)),
+            "cursor": cursor
+        }, idempotent=True)
+        data = response.json()
+        if response.status_code != 200 or not data.get('success'):
+            raise RuntimeError(data.get('error', response.status_code))
+        if cursor is None:
+            total = data['total']
+        users.extend(data['users'])
+        cursor = data.get('next_cursor')
+        if not cursor:
+            break
+    return total, users
+
+def format_expiry_digest(days, total, users):
+    """Дайджест по дням истечения -> список сообщений (Markdown)"""
+    today = datetime.now().date()
+    by_day = {}
+    for user in users:
+        by_day.setdefault(user['expires_at'][:10], []).append(user['username'])
+
+    lines = [f"⏰ ИСТЕКАЮТ В БЛИЖАЙШИЕ {days} ДН.: {total}", ""]
+    for day, names in by_day.items():
+        left = (datetime.fromisoformat(day).date() - today).days
+        label = {0: "сегодня", 1: "завтра"}.get(left, f"через {left} дн.")
+        lines.append(f"📅 {day} ({label}) - {len(names)}:")
+        for i in range(0, len(names), DIGEST_LINE_USERS):
+            lines.append(", ".join(f"`{name}`" for name in names[i:i + DIGEST_LINE_USERS]))
+    if total > len(users):
+        lines.append(f"\n…и еще {total - len(users)}, полный список: /list soon")
+
+    messages, current = [], ""
+    for line in lines:
+        if current and len(current) + len(line) + 1 > DIGEST_MESSAGE_LIMIT:
+            messages.append(current)
+            current = ""
+        current += line + "\n"
+    messages.append(current)
+    return messages
+
+def send_expiry_digest(chat_ids, days, skip_empty=False):
+    """Запрос к серверу здесь, отправка - через outbox (не ждет Telegram).
+    -> сколько пользователей истекает"""
+    total, users = fetch_expiring(days, EXPIRY_DIGEST_MAX_USERS)
+    if total == 0 and skip_empty:
+        return 0
+    messages = format_expiry_digest(days, total, users) if total else [f"✅ В ближайшие {days} дн. никто не истекает"]
+    for chat_id in chat_ids:
+        outbox.send_many(chat_id, messages, parse_mode='Markdown')
+    return total
+
+def seconds_until(at):
+    """Сколько до ближайшего "ЧЧ:ММ" по местному времени"""
+    hour, minute = map(int, at.split(":"))
+    now = datetime.now()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+def expiry_notifier():
+    """Фоновый поток: дайджест всем админам раз в сутки в EXPIRY_NOTIFY_AT"""
+    while True:
+        time.sleep(seconds_until(EXPIRY_NOTIFY_AT) + 1)
+        try:
+            total = send_expiry_digest(ADMIN_IDS, EXPIRY_NOTIFY_DAYS, skip_empty=True)
+            print(f"[EXPIRY] Digest: {total} licenses expire within {EXPIRY_NOTIFY_DAYS} days")
+        except Exception as e:
+            print(f"[EXPIRY] Digest failed: {e}")
+
+@bot.message_handler(commands=['expiring'])
+def expiring(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, "❌ Доступ запрещен")
+        return
+
+    try:
+        parts = message.text.split()
+        days = int(parts[1]) if len(parts) > 1 else EXPIRY_NOTIFY_DAYS
+        if days < 0:
+            raise ValueError
+    except ValueError:
+        bot.reply_to(message, "❌ Формат: /expiring [дни]")
+        return
+
+    try:
+        send_expiry_digest([message.chat.id], days)
+    except requests.exceptions.ConnectionError:
+        bot.reply_to(message, "❌ Не могу подключиться к серверу!")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Ошибка: {str(e)}")
+
+# ═══════════════════════════════════════════════════════════════
+# РЕЗЕРВНЫЕ КОПИИ
+# ═══════════════════════════════════════════════════════════════
+
+BACKUP_POLL_INTERVAL = 5    # сек, как часто спрашивать сервер о копии
+BACKUP_WAIT = 1800          # сек, дольше не ждем
+
+def format_snapshot(manifest):
+    verified = manifest.get('verified')
+    if verified is None:
+        check = "не проверена"
+    elif verified['ok']:
+        check = f"✅ проверена {verified['at'][:16]}"
+    else:
+        check = f"❌ проверка не прошла: {verified['integrity']}"
+    size = manifest.get('file_bytes', 0) / 1024 / 1024
+    return (f"`{manifest['file']}`\n"
+            f"   {manifest.get('users')} польз., {size:.1f} MB, {manifest.get('duration_s')}s, {check}")
+
+def find_snapshot(status, name):
+    for manifest in status['snapshots']:
+        if manifest.get('name') == name:
+            return manifest
+    return None
+
+def wait_for_backup(message, name, done):
+    """Фоновый поток: ждем, пока done(status, manifest) не вернет True"""
+    deadline = time.monotonic() + BACKUP_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(BACKUP_POLL_INTERVAL)
+        try:
+            status = api.post("admin/backup", {"action": "status"}, idempotent=True).json()
+        except requests.exceptions.ConnectionError:
+            continue
+        manifest = find_snapshot(status, name)
+        if done(status, manifest):
+            if manifest is None:
+                bot.reply_to(message, f"❌ Копия {name} не получилась, смотри лог сервера")
             else:
-                bot.reply_to(message, f"❌ Ошибка: {data.get('error')}")
+                bot.reply_to(message, "💾 " + format_snapshot(manifest), parse_mode='Markdown')
+            return
+    bot.reply_to(message, f"⌛ Копия {name} не закончилась за {BACKUP_WAIT // 60} мин")
+
+@bot.message_handler(commands=['backup'])
+def backup(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, "❌ Доступ запрещен")
+        return
+
+    parts = message.text.split()
+    action = parts[1] if len(parts) > 1 else 'start'
+
+    try:
+        if action == 'list':
+            data = api.post("admin/backup", {"action": "status"}, idempotent=True).json()
+            if not data['snapshots']:
+                bot.reply_to(message, "Копий еще нет")
+                return
+            result = f"💾 КОПИИ ({data['total_snapshots']})\n\n"
+            if data['running']:
+                result += "⏳ Сейчас идет копия\n\n"
+            result += "\n".join(format_snapshot(m) for m in data['snapshots'])
+            bot.reply_to(message, result, parse_mode='Markdown')
+
+        elif action == 'verify':
+            name = parts[2] if len(parts) > 2 else None
+            before = api.post("admin/backup", {"action": "status"}, idempotent=True).json()
+            response = api.post("admin/backup", {"action": "verify", "name": name})
+            data = response.json()
+            if response.status_code != 202:
+                bot.reply_to(message, f"❌ Ошибка: {data.get('error', response.status_code)}")
+                return
+            previous = (find_snapshot(before, data['name']) or {}).get('verified')
+            bot.reply_to(message, f"⏳ Проверяю {data['name']}...")
+            threading.Thread(target=wait_for_backup, args=(
+                message, data['name'],
+                lambda status, m: m is None or m.get('verified') not in (None, previous),
+            ), daemon=True).start()
+
+        elif action == 'start':
+            response = api.post("admin/backup", {"action": "start"})
+            data = response.json()
+            if response.status_code == 409:
+                bot.reply_to(message, "⏳ Копия уже идет, подожди")
+                return
+            if response.status_code != 202:
+                bot.reply_to(message, f"❌ Ошибка: {data.get('error', response.status_code)}")
+                return
+            bot.reply_to(message, f"⏳ Делаю копию {data['name']}...")
+            # Готово, когда копия проверена (или сервер уже не держит аренду)
+            threading.Thread(target=wait_for_backup, args=(
+                message, data['name'],
+                lambda status, m: not status['running'] or (m is not None and m.get('verified')),
+            ), daemon=True).start()
+
         else:
-            bot.reply_to(message, f"❌ Ошибка сервера: {response.status_code}")
+            bot.reply_to(message, "❌ Используй: /backup, /backup list, /backup verify [имя]")
 
     except requests.exceptions.ConnectionError:
         bot.reply_to(message, "❌ Не могу подключиться к серверу!")
     except Exception as e:
         bot.reply_to(message, f"❌ Ошибка: {str(e)}")
 
+@bot.message_handler(commands=['apistats'])
+def api_stats(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, "❌ Доступ запрещен")
+        return
+
+    metrics = api.metrics()
+    result = f"📡 API: circuit {metrics['circuit']}\n\n"
+
+    if webhook_server is not None:
+        wh = webhook_server.stats()
+        result += f"📨 Webhook: {wh['received']} обновлений, в очереди {wh['pending']}\n"
+        result += f"   дублей {wh['duplicates']}, отклонено {wh['rejected']}, ошибок {wh['failed']}\n"
+        result += f"   avg {wh['avg_ms']} / max {wh['max_ms']} ms\n\n"
+
+    ob = outbox.stats()
+    result += f"📤 Уведомления: отправлено {ob['sent']}, в очереди {ob['queued']}\n"
+    result += f"   429 {ob['rate_limited']}, повторов {ob['retried']}, не доставлено {ob['failed'] + ob['dropped']}\n\n"
+
+    if not metrics['endpoints']:
+        result += "Запросов еще не было"
+
+    for endpoint, stats in sorted(metrics['endpoints'].items()):
+        result += f"`{endpoint}`\n"
+        result += f"   {stats['count']} запросов, ошибок {stats['errors']}, повторов {stats['retries']}\n"
+        result += f"   avg {stats['avg_ms']} / p50 {stats['p50_ms']} / p95 {stats['p95_ms']} / max {stats['max_ms']} ms\n\n"
+
+    bot.reply_to(message, result, parse_mode='Markdown')
+
 # ═══════════════════════════════════════════════════════════════
 # ЗАПУСК
 # ═══════════════════════════════════════════════════════════════
 
+webhook_server = None  # WebhookServer в режиме webhook (для /apistats)
+
+def use_api_url(api_url):
+    """Все запросы telebot (и скачивание файлов) - на api_url вместо api.telegram.org"""
+    api_url = api_url.rstrip('/')
+    apihelper.API_URL = api_url + "/bot{0}/{1}"
+    apihelper.FILE_URL = api_url + "/file/bot{0}/{1}"
+
+def run_polling():
+    # getUpdates не работает, пока зарегистрирован webhook
+    bot.remove_webhook()
+    bot.infinity_polling()
+
+def run_webhook(webhook_url):
+    global webhook_server
+    from bot_webhook import WebhookServer
+
+    # Обработчики выполняются в пуле WebhookServer, а не в пуле telebot
+    bot.threaded = False
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    server = webhook_server = WebhookServer(
+        bot,
+        WEBHOOK_LISTEN,
+        WEBHOOK_PORT,
+        WEBHOOK_PATH,
+        secret_token=secret,
+        workers=BOT_WORKERS,
+        max_pending=WEBHOOK_MAX_PENDING,
+    )
+    bot.set_webhook(
+        url=webhook_url,
+        secret_token=secret,
+        max_connections=BOT_WORKERS,
+        allowed_updates=["message", "callback_query"],
+    )
+    print(f"[INFO] Webhook: {webhook_url} -> http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        server.serve_forever()
+    finally:
+        print(f"[INFO] Webhook stats: {server.stats()}")
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rulix admin Telegram bot")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default=BOT_MODE)
+    parser.add_argument("--webhook-url", default=WEBHOOK_URL)
+    parser.add_argument("--api-url", default=TELEGRAM_API_URL, help="Bot API base URL (telegram_stub.py)")
+    args = parser.parse_args()
+
+    if args.api_url:
+        use_api_url(args.api_url)
+
     print("""
 ╔════════════════════════════════════════════════════════════╗
 ║           RULIX ADMIN TELEGRAM BOT                         ║
@@ -220,9 +981,17 @@ if __name__ == '__main__':
     print(f"[INFO] Bot starting...")
     print(f"[INFO] Authorized admins: {ADMIN_IDS}")
     print(f"[INFO] API URL: {API_URL}")
+    print(f"[INFO] Workers: {BOT_WORKERS}, API retries: {API_RETRIES}")
+    print(f"[INFO] Mode: {args.mode}" + (f", Bot API: {args.api_url}" if args.api_url else ""))
+    if EXPIRY_NOTIFY_ENABLED:
+        threading.Thread(target=expiry_notifier, name="expiry-notifier", daemon=True).start()
+        print(f"[INFO] Expiry digest: daily at {EXPIRY_NOTIFY_AT}, {EXPIRY_NOTIFY_DAYS} days ahead")
     print()
     print("✅ Bot is running!")
     print("   Send /start in Telegram to begin")
     print()
 
-    bot.infinity_polling()
+    if args.mode == "webhook":
+        run_webhook(args.webhook_url)
+    else:
+        run_polling()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Telegram Stub
+Локальная замена Bot API для проверки бота без Telegram
+
+Понимает методы, которые вызывает telegram_bot.py (getUpdates, setWebhook,
+sendMessage, editMessageText, answerCallbackQuery, sendDocument, getFile),
+и доставляет "сообщения админа" боту: через webhook, если бот его
+зарегистрировал, иначе отдает в getUpdates.
+
+    python telegram_stub.py --port 8081
+    # в telegram_bot.py: TELEGRAM_API_URL = "http://127.0.0.1:8081"
+    # или python telegram_bot.py --api-url http://127.0.0.1:8081
+    python telegram_stub.py --port 8081 --send /stats --count 50
+    python telegram_stub.py --port 8081 --chat-limit 1   # 429, как Telegram, сверх 1 сообщения/с в чат
+
+Управление стабом:
+    POST /stub/updates  {"text": "/stats", "from_id": 1833222747, "duplicate": false}
+    GET  /stub/sent     отправленные ботом сообщения
+    GET  /stub/latency  время от доставки команды до ответа бота
+    POST /stub/flood    {"count": 3, "retry_after": 2} - следующие count отправок получат 429
+    POST /stub/fail     {"count": 2, "status": 502} - следующие count отправок получат
+                        status с HTML вместо JSON, как от прокси перед Bot API
+"""
+
+import argparse
+import json
+import threading
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+DEFAULT_ADMIN_ID = 1833222747
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Rulix", "username": "rulix_stub_bot"}
+
+
+SEND_METHODS = {"sendMessage", "sendDocument"}
+
+FAIL_PAGE = b"<html><body><h1>502 Bad Gateway</h1></body></html>"
+
+
+class TelegramStub:
+    def __init__(self, webhook_connections=40, chat_limit=None):
+        self._lock = threading.Lock()
+        self._updates_ready = threading.Condition(self._lock)
+        self._updates = []          # очередь для getUpdates
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._sent_at = {}          # message_id команды -> когда доставлена
+        self.sent = []              # ответы бота
+        self.latencies = []
+        self.files = {}             # file_path -> байты для download_file
+        self.webhook = None         # {"url": ..., "secret_token": ...}
+        self.chat_limit = chat_limit  # сообщений/с в чат, сверх - 429
+        self._chat_sends = {}       # chat_id -> время последних отправок
+        self._flood = 0             # сколько следующих отправок получат 429
+        self._flood_retry_after = 1
+        self._fail = 0              # сколько следующих отправок получат HTML-ошибку
+        self._fail_status = 502
+        self.rate_limited = 0
+        self._delivery = ThreadPoolExecutor(max_workers=webhook_connections,
+                                            thread_name_prefix="stub-webhook")
+        self._session = requests.Session()
+
+    # ───────────────────────────────────────────────────────────
+    # Bot API
+    # ───────────────────────────────────────────────────────────
+
+    def call(self, method, params):
+        handler = getattr(self, "api_" + method, None)
+        if handler is None:
+            return {"ok": False, "error_code": 404, "description": f"Not Found: {method}"}
+        if method in SEND_METHODS:
+            retry_after = self._flood_check(params.get("chat_id"))
+            if retry_after:
+                return {"ok": False, "error_code": 429,
+                        "description": f"Too Many Requests: retry after {retry_after}",
+                        "parameters": {"retry_after": retry_after}}
+        return {"ok": True, "result": handler(params)}
+
+    def _flood_check(self, chat_id):
+        """-> retry_after, если эту отправку надо отклонить"""
+        now = time.monotonic()
+        with self._lock:
+            if self._flood:
+                self._flood -= 1
+                self.rate_limited += 1
+                return self._flood_retry_after
+            if self.chat_limit is None:
+                return None
+            sends = self._chat_sends.setdefault(str(chat_id), deque())
+            while sends and now - sends[0] >= 1.0:
+                sends.popleft()
+            if len(sends) >= self.chat_limit:
+                self.rate_limited += 1
+                return 1
+            sends.append(now)
+            return None
+
+    def flood(self, count, retry_after=1):
+        with self._lock:
+            self._flood = count
+            self._flood_retry_after = retry_after
+
+    def fail(self, count, status=502):
+        with self._lock:
+            self._fail = count
+            self._fail_status = status
+
+    def fail_check(self, method):
+        """-> HTTP статус, если этот вызов должен получить HTML вместо ответа API"""
+        if method not in SEND_METHODS:
+            return None
+        with self._lock:
+            if not self._fail:
+                return None
+            self._fail -= 1
+            return self._fail_status
+
+    def api_getMe(self, params):
+        return BOT_USER
+
+    def api_setWebhook(self, params):
+        with self._lock:
+            self.webhook = {"url": params["url"], "secret_token": params.get("secret_token")} \
+                if params.get("url") else None
+        print(f"[STUB] Webhook: {self.webhook['url'] if self.webhook else 'removed'}")
+        return True
+
+    def api_deleteWebhook(self, params):
+        return self.api_setWebhook({})
+
+    def api_getWebhookInfo(self, params):
+        return {"url": self.webhook["url"] if self.webhook else "", "pending_update_count": len(self._updates)}
+
+    def api_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self._updates_ready:
+            # offset подтверждает все, что до него
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._updates_ready.wait(deadline - time.monotonic())
+            return list(self._updates[:int(params.get("limit") or 100)])
+
+    def api_sendMessage(self, params):
+        return self._record("message", params, text=params.get("text"))
+
+    def api_sendDocument(self, params):
+        return self._record("document", params, text=params.get("caption"))
+
+    def api_editMessageText(self, params):
+        return self._record("edit", params, text=params.get("text"))
+
+    def api_answerCallbackQuery(self, params):
+        return True
+
+    def api_getFile(self, params):
+        file_id = params["file_id"]
+        return {"file_id": file_id, "file_unique_id": file_id, "file_path": f"documents/{file_id}"}
+
+    def _record(self, kind, params, text):
+        now = time.perf_counter()
+        reply_to = params.get("reply_to_message_id")
+        with self._lock:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            self.sent.append({"kind": kind, "chat_id": params.get("chat_id"),
+                              "reply_to": reply_to, "text": text, "at": time.time()})
+            started = self._sent_at.pop(int(reply_to), None) if reply_to else None
+            if started is not None:
+                self.latencies.append(now - started)
+        return {"message_id": message_id, "date": int(time.time()), "from": BOT_USER,
+                "chat": {"id": int(params.get("chat_id") or 0), "type": "private"}, "text": text or ""}
+
+    # ───────────────────────────────────────────────────────────
+    # Обновления для бота
+    # ───────────────────────────────────────────────────────────
+
+    def push_message(self, text, from_id=DEFAULT_ADMIN_ID, duplicate=False):
+        """Сообщение от пользователя -> update_id"""
+        with self._lock:
+            update_id = self._next_update_id
+            message_id = self._next_message_id
+            self._next_update_id += 1
+            self._next_message_id += 1
+        command = text.split()[0] if text.startswith("/") else None
+        update = {"update_id": update_id, "message": {
+            "message_id": message_id, "date": int(time.time()),
+            "chat": {"id": from_id, "type": "private"},
+            "from": {"id": from_id, "is_bot": False, "first_name": "Admin"},
+            "text": text,
+        }}
+        if command:
+            update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+
+        with self._updates_ready:
+            self._sent_at[message_id] = time.perf_counter()
+            webhook = self.webhook
+            if webhook is None:
+                self._updates.append(update)
+                self._updates_ready.notify_all()
+        if webhook is not None:
+            for _ in range(2 if duplicate else 1):
+                self._delivery.submit(self._deliver, webhook, update)
+        return update_id
+
+    def _deliver(self, webhook, update, attempts=5):
+        headers = {}
+        if webhook["secret_token"]:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = webhook["secret_token"]
+        for attempt in range(attempts):
+            try:
+                response = self._session.post(webhook["url"], json=update, headers=headers, timeout=10)
+                if response.status_code == 200:
+                    return
+                print(f"[STUB] Webhook answered {response.status_code} for update {update['update_id']}")
+            except requests.RequestException as e:
+                print(f"[STUB] Webhook delivery failed: {e}")
+            time.sleep(0.5 * (attempt + 1))
+
+    def latency_stats(self, since=0):
+        """Задержки ответов, начиная с since-го"""
+        with self._lock:
+            values = sorted(self.latencies[since:])
+        if not values:
+            return {"count": 0}
+        return {
+            "count": len(values),
+            "p50_ms": round(values[len(values) // 2] * 1000, 1),
+            "p95_ms": round(values[int(len(values) * 0.95)] * 1000, 1),
+            "max_ms": round(values[-1] * 1000, 1),
+        }
+
+
+def make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._dispatch()
+
+        def do_POST(self):
+            self._dispatch()
+
+        def _dispatch(self):
+            url = urllib.parse.urlsplit(self.path)
+            params = dict(urllib.parse.parse_qsl(url.query))
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            content_type = self.headers.get("Content-Type", "")
+            if content_type.startswith("application/json") and body:
+                params.update(json.loads(body))
+            elif content_type.startswith("application/x-www-form-urlencoded"):
+                params.update(urllib.parse.parse_qsl(body.decode()))
+            elif content_type.startswith("multipart/form-data"):
+                params.update(parse_multipart_fields(body, content_type))
+
+            parts = url.path.strip("/").split("/")
+            if parts[0] == "stub":
+                self._stub(parts[1:], params)
+            elif parts[0] == "file":
+                data = stub.files.get("/".join(parts[2:]), b"")
+                self._send(200, data, "application/octet-stream")
+            elif len(parts) == 2 and parts[0].startswith("bot"):
+                fail_status = stub.fail_check(parts[1])
+                if fail_status:
+                    self._send(fail_status, FAIL_PAGE, "text/html")
+                    return
+                result = stub.call(parts[1], params)
+                self._send(200 if result["ok"] else result["error_code"], result)
+            else:
+                self._send(404, {"ok": False})
+
+        def _stub(self, parts, params):
+            if parts == ["updates"]:
+                update_id = stub.push_message(params.get("text", "/start"),
+                                              int(params.get("from_id", DEFAULT_ADMIN_ID)),
+                                              bool(params.get("duplicate")))
+                self._send(200, {"update_id": update_id})
+            elif parts == ["sent"]:
+                self._send(200, stub.sent)
+            elif parts == ["latency"]:
+                self._send(200, stub.latency_stats(int(params.get("since", 0))))
+            elif parts == ["flood"]:
+                stub.flood(int(params.get("count", 1)), int(params.get("retry_after", 1)))
+                self._send(200, {"ok": True})
+            elif parts == ["fail"]:
+                stub.fail(int(params.get("count", 1)), int(params.get("status", 502)))
+                self._send(200, {"ok": True})
+            else:
+                self._send(404, {"ok": False})
+
+        def _send(self, status, payload, content_type="application/json"):
+            body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def parse_multipart_fields(body, content_type):
+    """Только текстовые поля (chat_id, caption, reply_to_message_id), файлы пропускаем"""
+    boundary = content_type.split("boundary=")[-1].encode()
+    fields = {}
+    for part in body.split(b"--" + boundary):
+        head, _, value = part.partition(b"\r\n\r\n")
+        if b"filename=" in head or b'name="' not in head:
+            continue
+        name = head.split(b'name="', 1)[1].split(b'"', 1)[0].decode()
+        fields[name] = value.rstrip(b"\r\n-").decode(errors="replace")
+    return fields
+
+
+def run_burst(base_url, text, count, from_id, timeout=60):
+    """count команд сразу -> задержки ответов бота"""
+    session = requests.Session()
+    started = time.perf_counter()
+    since = session.get(f"{base_url}/stub/latency").json()["count"]
+    for _ in range(count):
+        session.post(f"{base_url}/stub/updates", json={"text": text, "from_id": from_id})
+    while time.perf_counter() - started < timeout:
+        stats = session.get(f"{base_url}/stub/latency", params={"since": since}).json()
+        if stats["count"] >= count:
+            break
+        time.sleep(0.1)
+    print(f"[STUB] {count} x {text}: {json.dumps(stats)}, "
+          f"all answered in {time.perf_counter() - started:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Telegram Bot API stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--send", help="send this command to an already running stub and measure replies")
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--from-id", type=int, default=DEFAULT_ADMIN_ID)
+    parser.add_argument("--chat-limit", type=int, help="messages per second per chat, above that - 429")
+    args = parser.parse_args()
+
+    if args.send:
+        run_burst(f"http://{args.host}:{args.port}", args.send, args.count, args.from_id)
+        return
+
+    stub = TelegramStub(chat_limit=args.chat_limit)
+    httpd = ThreadingHTTPServer((args.host, args.port), make_handler(stub))
+    httpd.daemon_threads = True
+    print(f"[STUB] Telegram Bot API stub on http://{args.host}:{args.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Bot Outbox - проверка против telegram_stub.py
+
+Стаб поднимается на свободном порту, telebot ходит в него по HTTP, 429 и
+502 заказываются через /stub/flood и /stub/fail, как при ручной проверке.
+Время отправки берется из поля "at" в /stub/sent.
+
+    PYTHONPATH=... python -m unittest test_bot_outbox
+"""
+
+import threading
+import time
+import unittest
+from http.server import ThreadingHTTPServer
+
+import requests
+import telebot
+from telebot import apihelper
+
+from bot_outbox import Outbox
+from telegram_stub import TelegramStub, make_handler
+
+EPSILON = 0.05  # запас на планирование потоков, с
+
+
+class OutboxAgainstStubTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.httpd = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(TelegramStub()))
+        cls.httpd.daemon_threads = True
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.httpd.server_address[1]}"
+
+        # Как use_api_url в telegram_bot.py
+        cls.saved_api_url = apihelper.API_URL
+        apihelper.API_URL = cls.base_url + "/bot{0}/{1}"
+
+    @classmethod
+    def tearDownClass(cls):
+        apihelper.API_URL = cls.saved_api_url
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def setUp(self):
+        # Свежий стаб на каждый тест, сервер тот же
+        self.stub = TelegramStub()
+        self.httpd.RequestHandlerClass = make_handler(self.stub)
+        self.bot = telebot.TeleBot("1:stub-token", threaded=False)
+
+    def control(self, name, **params):
+        requests.post(f"{self.base_url}/stub/{name}", json=params, timeout=5).raise_for_status()
+
+    def sent_times(self, chat_id):
+        return [m["at"] for m in self.stub.sent if m["chat_id"] == str(chat_id)]
+
+    def test_retry_after_is_honoured(self):
+        outbox = Outbox(self.bot, chat_rate=10.0)
+        self.control("flood", count=1, retry_after=1)
+
+        started = time.time()
+        outbox.send_many(100, ["first", "second"])
+        self.assertTrue(outbox.wait_idle(timeout=10))
+
+        self.assertEqual([m["text"] for m in self.stub.sent], ["first", "second"])
+        # 429 пришел сразу, повтор - не раньше retry_after
+        self.assertGreaterEqual(self.sent_times(100)[0] - started, 1.0 - EPSILON)
+        stats = outbox.stats()
+        self.assertEqual(stats["rate_limited"], 1)
+        self.assertEqual(stats["sent"], 2)
+        self.assertEqual(stats["failed"], 0)
+
+    def test_chat_and_global_rates(self):
+        global_rate, chat_rate, chat_burst = 4.0, 2.0, 2
+        outbox = Outbox(self.bot, global_rate=global_rate, chat_rate=chat_rate, chat_burst=chat_burst)
+        chats = [201, 202, 203, 204]
+        for chat_id in chats:
+            outbox.send_many(chat_id, [f"{chat_id}-{i}" for i in range(4)])
+        self.assertTrue(outbox.wait_idle(timeout=20))
+        self.assertEqual(len(self.stub.sent), 16)
+        self.assertEqual(self.stub.rate_limited, 0)
+
+        def assert_within(times, rate, burst):
+            # Token bucket: между i-й и j-й отправкой не меньше (j - i - burst + 1) / rate
+            for i in range(len(times)):
+                for j in range(i + 1, len(times)):
+                    self.assertGreaterEqual(times[j] - times[i], (j - i - burst + 1) / rate - EPSILON,
+                                            f"sends {i} and {j} too close: {times}")
+
+        for chat_id in chats:
+            times = self.sent_times(chat_id)
+            self.assertEqual([m["text"] for m in self.stub.sent if m["chat_id"] == str(chat_id)],
+                             [f"{chat_id}-{i}" for i in range(4)])
+            assert_within(times, chat_rate, chat_burst)
+        assert_within(sorted(m["at"] for m in self.stub.sent), global_rate, int(global_rate))
+
+    def test_thread_survives_api_errors(self):
+        outbox = Outbox(self.bot, chat_rate=10.0, error_backoff=0.1)
+        # 502 с HTML: telebot бросает ApiHTTPException, не ApiTelegramException
+        self.control("fail", count=2, status=502)
+        outbox.send_many(300, ["one", "two"])
+        self.assertTrue(outbox.wait_idle(timeout=10))
+        self.assertEqual([m["text"] for m in self.stub.sent], ["one", "two"])
+
+        # Неожиданная ошибка в самом вызове (лишний аргумент - TypeError)
+        outbox.send(300, "broken", no_such_argument=True)
+        outbox.send(300, "three")
+        self.assertTrue(outbox.wait_idle(timeout=10))
+
+        self.assertEqual([m["text"] for m in self.stub.sent], ["one", "two", "three"])
+        stats = outbox.stats()
+        self.assertEqual(stats["retried"], 2)
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(stats["sent"], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
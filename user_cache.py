@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix User Cache
+Строки users по username в памяти процесса (LRU + TTL)
+
+Каждое изменение пользователя пишет username в user_cache_changes в той же
+транзакции, что и сам UPDATE/INSERT. Номер строки (generation) растет
+монотонно. Фоновый поток каждого воркера раз в refresh_interval читает новые
+строки и выбрасывает эти username из своего кеша, так что чужая запись
+доходит до всех воркеров не позже чем через refresh_interval, а своя -
+сразу.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CHANGES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS user_cache_changes (
+        generation INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        changed_at REAL NOT NULL
+    )
+"""
+
+
+class _Entry:
+    __slots__ = ("row", "expires")
+
+    def __init__(self, row, expires):
+        self.row = row
+        self.expires = expires
+
+
+class UserCache:
+    """username -> строка users (кортеж, как ее вернул SELECT)
+
+    Кешируются только найденные пользователи: несуществующие логины
+    не должны вытеснять настоящих.
+    """
+
+    def __init__(self, pool, max_size=50000, ttl=300, refresh_interval=1.0,
+                 retention=3600):
+        self.pool = pool
+        self.max_size = max_size
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        # Сколько хранить строки user_cache_changes. Воркер, который отстал
+        # сильнее, увидит разрыв в generation и очистит кеш целиком
+        self.retention = retention
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None   # последний примененный номер изменения
+        self._epoch = 0           # растет при каждой инвалидации в процессе
+        self._next_prune = 0.0
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._entries = OrderedDict()
+            self._generation = None
+            threading.Thread(target=self._run, name="user-cache",
+                             daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[USER CACHE] Refresh failed: {e}")
+            time.sleep(self.refresh_interval)
+
+    def refresh(self):
+        with self.pool.connection() as conn:
+            if self._generation is None:
+                row = conn.execute(
+                    "SELECT seq FROM sqlite_sequence WHERE name = 'user_cache_changes'"
+                ).fetchone()
+                with self._lock:
+                    self._generation = row[0] if row else 0
+                return
+            rows = conn.execute("""
+                SELECT generation, username FROM user_cache_changes
+                WHERE generation > ? ORDER BY generation
+            """, (self._generation,)).fetchall()
+
+        if not rows:
+            return
+        with self._lock:
+            self._epoch += 1
+            if rows[0][0] != self._generation + 1:
+                # Часть изменений уже удалена - не знаем, кого выбросить
+                self._entries.clear()
+            else:
+                for _, username in rows:
+                    self._entries.pop(username, None)
+            self._generation = rows[-1][0]
+
+    def get(self, username):
+        """-> строка или None (нет в кеше)"""
+        self._ensure_started()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry.expires > now:
+                self._entries.move_to_end(username)
+                self.hits += 1
+                return entry.row
+            if entry is not None:
+                del self._entries[username]
+            self.misses += 1
+            return None
+
+    def load(self, username, loader):
+        """loader(username) -> строка или None; найденную кладем в кеш"""
+        self._ensure_started()
+        epoch = self._epoch
+        row = loader(username)
+        if row is None or self.max_size <= 0:
+            return row
+        with self._lock:
+            # Пока читали, строку могли изменить: такую не кешируем.
+            # До первого refresh номер изменений неизвестен - тоже
+            if self._epoch == epoch and self._generation is not None:
+                self._entries[username] = _Entry(row, time.monotonic() + self.ttl)
+                self._entries.move_to_end(username)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return row
+
+    def invalidate(self, conn, usernames):
+        """Записать изменение в рамках транзакции вызывающего (commit делает он)"""
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO user_cache_changes (username, changed_at) VALUES (?, ?)",
+            [(username, now) for username in usernames]
+        )
+        if now >= self._next_prune:
+            self._next_prune = now + self.retention / 10
+            conn.execute("DELETE FROM user_cache_changes WHERE changed_at < ?",
+                         (now - self.retention,))
+
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += 1
+            for username in usernames:
+                self._entries.pop(username, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size,
+                    "hits": self.hits, "misses": self.misses,
+                    "invalidations": self.invalidations,
+                    "generation": self._generation}
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix User Search
+Поиск пользователей по части username, license_key или hwid
+
+FTS5 с токенизатором trigram по трем колонкам users. Таблица external
+content: сами строки не копируются, в индексе только триграммы со ссылкой
+на users.id. Подстрока от 3 символов находится пересечением списков
+триграмм, без прохода по users (LIKE '%x%' читал бы таблицу целиком).
+Регистр не важен.
+
+Индекс обновляют триггеры на INSERT / UPDATE / DELETE users в той же
+транзакции, что и само изменение, так что запись любым путем (API, реплика,
+ручной SQL) видна поиску сразу после commit.
+
+Существующие строки при первом запуске индексируются в фоне пачками по id,
+как users_epoch в schema_migrations.py: prepare() запоминает MAX(id), строки
+до него заполняет поток, после него - триггеры. Пока заполнение идет,
+триггеры не трогают еще не заполненные строки (их текущие значения попадут в
+индекс вместе с пачкой), а поиск находит не всех - ответ помечен
+complete = False. Пачки оставляют индекс из сотен сегментов, и фраза читает
+каждый, поэтому в конце сегменты сливаются (FTS5 'merge') тоже короткими
+транзакциями: один 'optimize' держал бы запись секунды.
+
+Ранжирование: точное совпадение, начало поля, подстрока; при равенстве
+username важнее license_key, а тот важнее hwid, короткое поле выше длинного.
+Если совпадений больше max_matches, ранжируются первые max_matches по id, и
+ответ помечен truncated: запрос стоит уточнить.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+MIN_QUERY_LENGTH = 3  # короче триграммы индекс не поможет
+
+FIELDS = ("username", "license_key", "hwid")
+ROW_COLUMNS = "id, username, license_key, hwid, expires_at, is_active, created_at"
+
+TABLE_SQL = """
+    CREATE VIRTUAL TABLE users_search USING fts5(
+        username, license_key, hwid,
+        content='users', content_rowid='id', tokenize='trigram'
+    )
+"""
+
+# Строки с id из (users_search_last_id, users_search_upto] ждут фонового
+# заполнения: их не было в индексе, удалять из него нечего
+INDEXED_SQL = """NOT (
+    {row}.id > COALESCE((SELECT value FROM maintenance_state WHERE name = 'users_search_last_id'), 0)
+    AND {row}.id <= COALESCE((SELECT value FROM maintenance_state WHERE name = 'users_search_upto'), 0)
+)"""
+
+ADD_SQL = """
+    INSERT INTO users_search (rowid, username, license_key, hwid)
+    VALUES (NEW.id, NEW.username, NEW.license_key, NEW.hwid);
+"""
+
+# External content: удалить можно только теми значениями, что были проиндексированы
+REMOVE_SQL = """
+    INSERT INTO users_search (users_search, rowid, username, license_key, hwid)
+    VALUES ('delete', OLD.id, OLD.username, OLD.license_key, OLD.hwid);
+"""
+
+TRIGGERS_SQL = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS users_search_insert AFTER INSERT ON users
+    WHEN {INDEXED_SQL.format(row='NEW')}
+    BEGIN {ADD_SQL} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS users_search_delete AFTER DELETE ON users
+    WHEN {INDEXED_SQL.format(row='OLD')}
+    BEGIN {REMOVE_SQL} END
+    """,
+    # Вход пишет hwid и password_hash: индекс трогаем, только если поле изменилось
+    f"""
+    CREATE TRIGGER IF NOT EXISTS users_search_update AFTER UPDATE OF username, license_key, hwid ON users
+    WHEN (NEW.username IS NOT OLD.username OR NEW.license_key IS NOT OLD.license_key
+          OR NEW.hwid IS NOT OLD.hwid) AND {INDEXED_SQL.format(row='OLD')}
+    BEGIN {REMOVE_SQL} {ADD_SQL} END
+    """,
+)
+
+
+def _state(conn, name):
+    row = conn.execute("SELECT value FROM maintenance_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_state(conn, name, value):
+    conn.execute("""
+        INSERT INTO maintenance_state (name, value) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET value = excluded.value
+    """, (name, value))
+
+
+def match_phrase(query):
+    """Строка -> FTS5 фраза: в кавычках trigram ищет ее как подстроку"""
+    return '"' + query.replace('"', '""') + '"'
+
+
+def rank(row, needle):
+    """-> (уровень, поле, длина поля, id): меньше - выше в выдаче.
+    Уровни: 0 точное совпадение, 1 начало поля, 2 подстрока, 3 только по
+    индексу (trigram еще и не различает диакритику)"""
+    best = (3, 0, 0)
+    for field, value in enumerate(row[1:4]):
+        if value is None:
+            continue
+        folded = value.casefold()
+        if folded == needle:
+            tier = 0
+        elif folded.startswith(needle):
+            tier = 1
+        elif needle in folded:
+            tier = 2
+        else:
+            continue
+        best = min(best, (tier, field, len(value)))
+    return best + (row[0],)
+
+
+class UserSearch:
+    def __init__(self, pool, max_matches=1000, batch_size=2000, pause=0.05, merge_pages=256,
+                 check_interval=5.0):
+        self.pool = pool
+        self.max_matches = max_matches
+        self.batch_size = batch_size
+        self.pause = pause
+        self.merge_pages = merge_pages
+        self.check_interval = check_interval
+
+        self._done = False
+        self._next_check = 0.0
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {"queries": 0, "truncated": 0}
+
+    # ───────────────────────────────────────────────────────────
+    # Схема (init_database)
+    # ───────────────────────────────────────────────────────────
+
+    def prepare(self, conn):
+        """Таблица индекса и триггеры. Существующие строки - в фоне"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_search'").fetchone() is None:
+                conn.execute(TABLE_SQL)
+                upto = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+                if upto:
+                    _set_state(conn, "users_search_last_id", 0)
+                    _set_state(conn, "users_search_upto", upto)
+                    print(f"[SEARCH] Indexing {upto} existing users in background")
+            for sql in TRIGGERS_SQL:
+                conn.execute(sql)
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            # FTS5 trigram - SQLite 3.34+
+            conn.rollback()
+            print(f"[SEARCH] User search disabled: {e}")
+            return
+        self._done = _state(conn, "users_search_upto") is None
+
+    # ───────────────────────────────────────────────────────────
+    # Заполнение
+    # ───────────────────────────────────────────────────────────
+
+    def ensure_started(self):
+        """Фоновое заполнение в этом процессе, если оно не закончено.
+        Несколько процессов сразу - безопасно: прогресс читается в той же
+        транзакции, что и пишется"""
+        if self._done or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="user-search-fill", daemon=True).start()
+
+    def _run(self):
+        try:
+            indexed = 0
+            started = time.perf_counter()
+            finished_here = False
+            while not self._done:
+                count = self.step()
+                indexed += count
+                finished_here = self._done and count > 0
+                time.sleep(self.pause)
+            if indexed:
+                print(f"[SEARCH] Indexed {indexed} users in {time.perf_counter() - started:.1f}s")
+            # Сливает процесс, который дописал последнюю пачку
+            if finished_here:
+                started = time.perf_counter()
+                steps = 0
+                while self.merge_step(first=steps == 0):
+                    steps += 1
+                    time.sleep(self.pause)
+                print(f"[SEARCH] Merged index segments in {steps} steps, "
+                      f"{time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            print(f"[SEARCH] Index fill failed: {e}")
+            self._pid = None
+
+    def step(self):
+        """Одна пачка -> сколько строк проиндексировано"""
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            upto = _state(conn, "users_search_upto")
+            if upto is None:
+                conn.rollback()
+                self._done = True
+                return 0
+
+            last_id = _state(conn, "users_search_last_id") or 0
+            upper = min(upto, last_id + self.batch_size)
+            count = conn.execute("""
+                INSERT INTO users_search (rowid, username, license_key, hwid)
+                SELECT id, username, license_key, hwid FROM users WHERE id > ? AND id <= ?
+            """, (last_id, upper)).rowcount
+            finished = upper >= upto
+            if finished:
+                # Без отметок все строки считаются проиндексированными
+                conn.execute("""
+                    DELETE FROM maintenance_state
+                    WHERE name IN ('users_search_last_id', 'users_search_upto')
+                """)
+            else:
+                _set_state(conn, "users_search_last_id", upper)
+            conn.commit()
+        self._done = finished
+        return count
+
+    def merge_step(self, first=False):
+        """До merge_pages страниц слияния сегментов -> была ли работа.
+        Первый шаг (отрицательное N) сводит все сегменты на один уровень,
+        чтобы слияние дошло до одного сегмента, как 'optimize'"""
+        with self.pool.connection() as conn:
+            before = conn.total_changes
+            conn.execute("INSERT INTO users_search (users_search, rank) VALUES ('merge', ?)",
+                         (-self.merge_pages if first else self.merge_pages,))
+            conn.commit()
+            # Так FTS5 советует узнавать, что сливать больше нечего
+            return conn.total_changes - before >= 2
+
+    def done(self):
+        """Все ли строки в индексе (в БД проверяется не чаще check_interval)"""
+        if self._done:
+            return True
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.check_interval
+        with self.pool.connection() as conn:
+            self._done = _state(conn, "users_search_upto") is None
+        return self._done
+
+    # ───────────────────────────────────────────────────────────
+    # Поиск
+    # ───────────────────────────────────────────────────────────
+
+    def search(self, query, limit=20, after=None):
+        """-> (hits, total, truncated). hits - до limit пар (ключ ранга, строка
+        ROW_COLUMNS) по порядку, после ключа after (курсор). total - всего
+        совпадений, None если их больше max_matches. ValueError на короткий запрос"""
+        query = query.strip()
+        if len(query) < MIN_QUERY_LENGTH:
+            raise ValueError(f'query must be at least {MIN_QUERY_LENGTH} characters')
+
+        with self.pool.connection() as conn:
+            # Кандидаты в порядке rowid - это дешево, ранжирование потом
+            rows = conn.execute(f"""
+                SELECT {ROW_COLUMNS} FROM users WHERE id IN (
+                    SELECT rowid FROM users_search WHERE users_search MATCH ? LIMIT ?
+                )
+            """, (match_phrase(query), self.max_matches + 1)).fetchall()
+            truncated = len(rows) > self.max_matches
+            if truncated:
+                rows = rows[:self.max_matches]
+                # Точный логин не должен потеряться за отсечкой
+                exact = conn.execute(f"SELECT {ROW_COLUMNS} FROM users WHERE username = ?",
+                                     (query,)).fetchone()
+                if exact is not None and all(row[0] != exact[0] for row in rows):
+                    rows.append(exact)
+
+        needle = query.casefold()
+        hits = sorted(((rank(row, needle), row) for row in rows), key=lambda hit: hit[0])
+        if after is not None:
+            hits = [hit for hit in hits if hit[0] > after]
+
+        with self._lock:
+            self._stats["queries"] += 1
+            self._stats["truncated"] += truncated
+        return hits[:limit], None if truncated else len(rows), truncated
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, complete=self._done)
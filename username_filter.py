@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rulix Username Filter
+Bloom фильтр существующих username: вход с несуществующим логином
+отклоняется без чтения строки users и без KDF
+
+"Нет" от фильтра точное для id до последнего виденного, "может быть" -
+ложное с вероятностью error_rate, тогда вход идет обычным путем. Пока фильтр
+не загружен, он отвечает "может быть" на все.
+
+Фильтр следит за users по id (AUTOINCREMENT): фоновый поток каждые
+refresh_interval добавляет строки с id больше последнего виденного, так что
+вставки любым путем (другие воркеры, bench, ручной SQL) доходят до фильтра
+не позже refresh_interval. Создание через API добавляет логин сразу. Чтобы
+логин, только что созданный в другом воркере, не получил отказ, "нет"
+подтверждается одним запросом по индексу username среди id новее фильтра:
+строку он не читает, и без новых пользователей ничего не находит.
+Удалять из Bloom фильтра нельзя, но users и не удаляются.
+
+Снимок на диске (биты + последний id) позволяет стартовать с миллионами
+пользователей без полного прохода по таблице: догружаются только новые id.
+"""
+
+import hashlib
+import math
+import os
+import secrets
+import struct
+import threading
+import time
+from pathlib import Path
+
+SNAPSHOT_MAGIC = b"RULXBF01"
+# magic, бит, хешей, добавлено, последний id, соль, отпечаток строки последнего id
+SNAPSHOT_HEADER = struct.Struct("<8sQIQQ16s16s")
+
+
+def bloom_size(capacity, error_rate):
+    """-> (бит, хешей) для capacity элементов при доле ложных "да" error_rate"""
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+class _Bloom:
+    __slots__ = ("bits", "size", "hashes", "salt", "count", "max_id")
+
+    def __init__(self, size, hashes, salt=None, bits=None, count=0, max_id=0):
+        self.size = size
+        self.hashes = hashes
+        self.salt = salt or secrets.token_bytes(16)
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+        self.count = count
+        self.max_id = max_id
+
+    def positions(self, username):
+        # Двойное хеширование: k позиций из одного blake2b. Соль случайная,
+        # чтобы нельзя было заранее подобрать логины с ложным "да"
+        digest = hashlib.blake2b(username.encode(), digest_size=16, key=self.salt).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, username):
+        for pos in self.positions(username):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def contains(self, username):
+        # Все k бит без раннего выхода: время не зависит от ответа
+        found = 1
+        for pos in self.positions(username):
+            found &= self.bits[pos >> 3] >> (pos & 7)
+        return bool(found & 1)
+
+
+class UsernameFilter:
+    def __init__(self, pool, snapshot_path=None, min_capacity=100000, error_rate=0.001,
+                 refresh_interval=1.0, snapshot_interval=600, batch_size=50000):
+        self.pool = pool
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.min_capacity = min_capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.snapshot_interval = snapshot_interval
+        self.batch_size = batch_size
+
+        self._bloom = None
+        self._capacity = 0
+        self._pending = None      # логины, добавленные во время перестройки
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next_snapshot = 0.0
+        self.rejected = 0
+        self.builds = 0
+        self.loaded_from = None
+        self.last_error = None
+
+    # ───────────────────────────────────────────────────────────
+    # Проверка
+    # ───────────────────────────────────────────────────────────
+
+    def might_exist(self, username):
+        """False - такого логина точно нет"""
+        self.ensure_started()
+        bloom = self._bloom
+        if bloom is None:
+            return True
+        if bloom.contains(username):
+            return True
+        if self._created_since(bloom, username):
+            return True
+        self.rejected += 1
+        return False
+
+    def _created_since(self, bloom, username):
+        """Логин с id новее фильтра (создан до его refresh)"""
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT 1 FROM users WHERE username = ? AND id > ?",
+                                (username, bloom.max_id)).fetchone() is not None
+
+    def add(self, usernames):
+        """Только что созданные логины (после commit)"""
+        with self._lock:
+            if self._bloom is not None:
+                for username in usernames:
+                    self._bloom.add(username)
+            if self._pending is not None:
+                self._pending.extend(usernames)
+
+    # ───────────────────────────────────────────────────────────
+    # Фоновый поток
+    # ───────────────────────────────────────────────────────────
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._bloom = None
+            threading.Thread(target=self._run, name="username-filter", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                if self._bloom is None:
+                    if not self.load_snapshot():
+                        self.rebuild()
+                self.refresh()
+                if self._bloom.count > self._capacity:
+                    # Переполнен - ложных "да" больше, чем задумано
+                    self.rebuild()
+                if self.snapshot_path and time.monotonic() >= self._next_snapshot:
+                    self.save_snapshot()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[USERNAME FILTER] {e}")
+            time.sleep(self.refresh_interval)
+
+    def _fetch(self, conn, after_id, upto_id=None):
+        sql = "SELECT id, username FROM users WHERE id > ?"
+        params = [after_id]
+        if upto_id is not None:
+            sql += " AND id <= ?"
+            params.append(upto_id)
+        sql += " ORDER BY id LIMIT ?"
+        return conn.execute(sql, params + [self.batch_size]).fetchall()
+
+    def refresh(self):
+        """Новые строки users (id больше последнего виденного)"""
+        while True:
+            bloom = self._bloom
+            with self.pool.connection() as conn:
+                rows = self._fetch(conn, bloom.max_id)
+            if not rows:
+                return
+            with self._lock:
+                if bloom is not self._bloom:
+                    continue
+                for _, username in rows:
+                    bloom.add(username)
+                bloom.count += len(rows)
+                bloom.max_id = rows[-1][0]
+            if len(rows) < self.batch_size:
+                return
+
+    def rebuild(self):
+        """Полный проход по users в новый фильтр, пачками по id"""
+        started = time.perf_counter()
+        with self.pool.connection() as conn:
+            total, max_id = conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM users").fetchone()
+        capacity = max(self.min_capacity, total * 2)
+        bloom = _Bloom(*bloom_size(capacity, self.error_rate))
+
+        with self._lock:
+            self._pending = []
+        try:
+            last_id = 0
+            while last_id < max_id:
+                with self.pool.connection() as conn:
+                    rows = self._fetch(conn, last_id, max_id)
+                if not rows:
+                    break
+                for _, username in rows:
+                    bloom.add(username)
+                bloom.count += len(rows)
+                last_id = rows[-1][0]
+            bloom.max_id = max_id
+
+            with self._lock:
+                for username in self._pending:
+                    bloom.add(username)
+                self._bloom = bloom
+                self._capacity = capacity
+        finally:
+            with self._lock:
+                self._pending = None
+
+        self.builds += 1
+        self.loaded_from = "users"
+        self._next_snapshot = 0.0
+        print(f"[USERNAME FILTER] Built from {bloom.count} users in "
+              f"{time.perf_counter() - started:.1f}s ({len(bloom.bits) // 1024} KB, {bloom.hashes} hashes)")
+
+    # ───────────────────────────────────────────────────────────
+    # Снимок на диске
+    # ───────────────────────────────────────────────────────────
+
+    def _anchor(self, conn, max_id):
+        """Отпечаток строки с id = max_id: БД из бэкапа могла выдать те же id другим логинам"""
+        row = conn.execute("SELECT username FROM users WHERE id = ?", (max_id,)).fetchone()
+        return hashlib.blake2b(f"{max_id}:{row[0] if row else ''}".encode(), digest_size=16).digest()
+
+    def save_snapshot(self):
+        bloom = self._bloom
+        if bloom is None or self.snapshot_path is None:
+            return
+        with self.pool.connection() as conn:
+            anchor = self._anchor(conn, bloom.max_id)
+        with self._lock:
+            header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, bloom.size, bloom.hashes,
+                                          bloom.count, bloom.max_id, bloom.salt, anchor)
+            bits = bytes(bloom.bits)
+
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.snapshot_path.with_name(f"{self.snapshot_path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(header)
+            f.write(bits)
+        os.replace(tmp, self.snapshot_path)
+        self._next_snapshot = time.monotonic() + self.snapshot_interval
+
+    def load_snapshot(self):
+        """-> True если снимок загружен (новые id догрузит refresh)"""
+        if self.snapshot_path is None or not self.snapshot_path.exists():
+            return False
+        started = time.perf_counter()
+        try:
+            data = self.snapshot_path.read_bytes()
+            magic, size, hashes, count, max_id, salt, anchor = SNAPSHOT_HEADER.unpack_from(data)
+            bits = bytearray(data[SNAPSHOT_HEADER.size:])
+            if magic != SNAPSHOT_MAGIC or len(bits) != (size + 7) // 8:
+                raise ValueError("bad header")
+        except (OSError, ValueError, struct.error) as e:
+            print(f"[USERNAME FILTER] Snapshot ignored: {e}")
+            return False
+
+        with self.pool.connection() as conn:
+            matches = self._anchor(conn, max_id) == anchor
+        if not matches:
+            # Снимок от другой (или восстановленной из бэкапа) БД
+            print("[USERNAME FILTER] Snapshot does not match users table, rebuilding")
+            return False
+
+        with self._lock:
+            self._bloom = _Bloom(size, hashes, salt, bits, count, max_id)
+            self._capacity = round(size * math.log(2) ** 2 / -math.log(self.error_rate))
+        self.loaded_from = "snapshot"
+        self._next_snapshot = time.monotonic() + self.snapshot_interval
+        print(f"[USERNAME FILTER] Loaded snapshot: {count} users up to id {max_id} "
+              f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return True
+
+    def stats(self):
+        bloom = self._bloom
+        return {
+            "ready": bloom is not None,
+            "loaded_from": self.loaded_from,
+            "users": bloom.count if bloom else 0,
+            "capacity": self._capacity,
+            "bytes": len(bloom.bits) if bloom else 0,
+            "hashes": bloom.hashes if bloom else 0,
+            "max_id": bloom.max_id if bloom else 0,
+            "rejected": self.rejected,
+            "builds": self.builds,
+            "last_error": self.last_error,
+        }